@@ -10,82 +10,96 @@ import logging
 import os
 import os.path
 import datetime
+import time
+import threading
 from itertools import groupby
 import subprocess
 
+from azure.common import AzureMissingResourceHttpError
+
 from .__init__ import version
 from .funcmodule import printe, out, log_stdout_stderr
-from .naming import Naming
+from .naming import Naming, BlobRecord
 from .timing import Timing
 from .databaseconnector import DatabaseConnector
+from .isqlsession import IsqlSessionPool
 from .backupexception import BackupException
 from .streamingthread import StreamingThread
+from .tailingthread import TailingThread
+from .bufferpool import BufferPool
+from .blocksizer import BlockSizer
+from .blobcatalog import BlobCatalog
+from .backupinventory import BackupInventory
+from .restoreplanner import RestorePlanner
+from .cancellation import CancellationToken
+from .fileuploader import FileUploader, ConcurrentFileUploader
+from .blockjournal import BlockJournal
+from .blobdownloader import BlobDownloader
+from .restorecache import RestoreCache
+from .restoreexecutor import RestoreExecutor, RestoreReport, DownloadedDumpSource, StreamingDumpSource
+from .backupscheduler import BackupScheduler, BackupJob
+from .stripeplanner import StripePlanner, BackupRun
 
 class BackupAgent(object):
     """The backup business logic implementation."""
     def __init__(self, backup_configuration):
         self.backup_configuration = backup_configuration
-        self.database_connector = DatabaseConnector(self.backup_configuration)
-
-    def existing_backups_for_db(self, dbname, is_full):
-        existing_blobs_dict = dict()
-        marker = None
-        while True:
-            results = self.backup_configuration.storage_client.list_blobs(
-                container_name=self.backup_configuration.azure_storage_container_name,
-                prefix=Naming.construct_blobname_prefix(dbname=dbname, is_full=is_full),
-                marker=marker)
-            for blob in results:
-                blob_name = blob.name
-                parts = Naming.parse_blobname(blob_name)
-                if parts is None:
-                    continue
-
-                end_time_of_existing_blob = parts[3]
-                if not existing_blobs_dict.has_key(end_time_of_existing_blob):
-                    existing_blobs_dict[end_time_of_existing_blob] = []
-
-                val = {'blob_name': blob_name, 'content_length': blob.properties.content_length}
-                existing_blobs_dict[end_time_of_existing_blob].append(val)
-
-            if results.next_marker:
-                marker = results.next_marker
-            else:
-                break
-        return existing_blobs_dict
-
-    def existing_backups(self, databases=[]):
-        existing_blobs_dict = dict()
-        marker = None
-        while True:
-            results = self.backup_configuration.storage_client.list_blobs(
-                container_name=self.backup_configuration.azure_storage_container_name,
-                marker=marker)
-
-            for blob in results:
-                blob_name = blob.name
-                parts = Naming.parse_blobname(blob_name)
-                if parts is None:
-                    continue
-
-                (dbname_of_existing_blob, _is_full, _start_timestamp, end_time_of_existing_blob, _stripe_index, _stripe_count) = parts
-                if len(databases) == 0 or dbname_of_existing_blob in databases:
-                    if not existing_blobs_dict.has_key(end_time_of_existing_blob):
-                        existing_blobs_dict[end_time_of_existing_blob] = []
-                    val = {'blob_name': blob_name, 'content_length': blob.properties.content_length}
-                    existing_blobs_dict[end_time_of_existing_blob].append(val)
-
-            if results.next_marker:
-                marker = results.next_marker
-            else:
-                break
-        return existing_blobs_dict
+        #
+        # Each concurrent dump holds an isql session until it completes, so the
+        # pool has room for the other statements on top.
+        #
+        self.database_connector = DatabaseConnector(
+            self.backup_configuration,
+            max_sessions=IsqlSessionPool.MAX_SESSIONS + self.backup_configuration.get_backup_max_concurrent_dumps())
+        self._catalog = None
+        self._inventory = None
+        self.catalog_lock = threading.RLock()
+
+    @property
+    def catalog(self):
+        """
+        Local index of the dumps in the storage container. It answers the listing
+        queries, and is kept up to date by our own uploads and deletes.
+        """
+        with self.catalog_lock:
+            if self._catalog is None:
+                self._catalog = BlobCatalog(
+                    path=self.backup_configuration.get_catalog_path(),
+                    storage_client=self.backup_configuration.storage_client,
+                    container_name=self.backup_configuration.azure_storage_container_name,
+                    reconcile_seconds=self.backup_configuration.get_catalog_reconcile_seconds())
+            return self._catalog
+
+    @property
+    def inventory(self):
+        """Snapshot of the backups in storage, taken once per invocation and updated in memory."""
+        with self.catalog_lock:
+            if self._inventory is None:
+                self._inventory = BackupInventory(self.catalog.blobs())
+            return self._inventory
+
+    def record_uploaded_blob(self, blob_name, content_length):
+        record = BlobRecord.parse(blob_name, content_length)
+        if record is None:
+            return
+        with self.catalog_lock:
+            self.catalog.add(record)
+            if self._inventory is not None:
+                self._inventory.add(record)
+
+    def record_deleted_blob(self, blob_name):
+        record = BlobRecord.parse(blob_name)
+        with self.catalog_lock:
+            self.catalog.remove(blob_name)
+            if self._inventory is not None and record is not None:
+                self._inventory.remove(record)
 
     def latest_backup_timestamp(self, dbname, is_full):
-        existing_blobs_dict = self.existing_backups_for_db(dbname=dbname, is_full=is_full)
-        if len(existing_blobs_dict.keys()) == 0:
+        with self.catalog_lock:
+            latest = self.inventory.latest(dbname=dbname, is_full=is_full)
+        if latest is None:
             return "19000101_000000"
-        return Timing.sort(existing_blobs_dict.keys())[-1:][0]
+        return latest
 
     @staticmethod
     def should_run_full_backup(now_time, force, latest_full_backup_timestamp, business_hours, db_backup_interval_min, db_backup_interval_max):
@@ -131,19 +145,37 @@ class BackupAgent(object):
 
         return result
 
-    def backup(self, is_full, databases, output_dir, force, skip_upload, use_streaming):
-        databases_to_backup = self.database_connector.determine_databases(user_selected_databases=databases, is_full=is_full)
+    def backup(self, is_full, databases, output_dir, force, skip_upload, use_streaming, use_tailing=False):
+        #
+        # One query lists the databases along with their sizes and stripe counts.
+        #
+        database_sizes = self.database_connector.determine_database_sizes(is_full=is_full, user_selected_databases=databases)
         skip_dbs = self.backup_configuration.get_databases_to_skip()
-        # databases_to_backup = filter(lambda db: not (db in skip_dbs), databases_to_backup)
-        databases_to_backup = [db for db in databases_to_backup if not db in skip_dbs]
+        database_sizes = dict([(size.dbname, size) for size in database_sizes if not size.dbname in skip_dbs])
+        stripe_planner = self.stripe_planner(is_full=is_full, use_streaming=use_streaming)
+        for dbname in sorted(database_sizes.keys()):
+            size = database_sizes[dbname]
+            size.stripe_count = stripe_planner.stripe_count(used_size=size.used_size, default=size.stripe_count)
+            logging.info("Database %s", size)
 
-        for dbname in databases_to_backup:
-            self.backup_single_db(dbname=dbname, is_full=is_full, force=force, skip_upload=skip_upload, output_dir=output_dir, use_streaming=use_streaming)
+        if not skip_upload:
+            self.resume_interrupted_uploads(output_dir=output_dir, is_full=is_full)
+
+        jobs = [BackupJob(dbname=size.dbname, stripe_count=size.stripe_count, expected_size=size.used_size)
+                for size in database_sizes.values()]
+        scheduler = BackupScheduler(
+            run_job=lambda job: self.backup_single_db(
+                dbname=job.dbname, is_full=is_full, force=force, skip_upload=skip_upload, output_dir=output_dir,
+                use_streaming=use_streaming, use_tailing=use_tailing,
+                database_size=database_sizes[job.dbname]),
+            max_concurrent_dumps=self.backup_configuration.get_backup_max_concurrent_dumps(),
+            max_total_stripes=self.backup_configuration.get_backup_max_total_stripes())
+        scheduler.run(jobs)
 
         if not is_full and not skip_upload and not use_streaming:
             self.upload_local_backup_files_from_previous_operations(output_dir=output_dir)
 
-    def start_streaming_threads(self, dbname, is_full, start_timestamp, stripe_count, output_dir, container_name):
+    def start_streaming_threads(self, dbname, is_full, start_timestamp, stripe_count, output_dir, container_name, buffer_pool, cancellation_token, block_sizer=None):
         threads = []
         for stripe_index in range(1, stripe_count + 1):
             pipe_path = Naming.pipe_name(output_dir=output_dir,
@@ -169,7 +201,12 @@ class BackupAgent(object):
 
             t = StreamingThread(
                 storage_client=self.backup_configuration.storage_client,
-                container_name=container_name, blob_name=blob_name, pipe_path=pipe_path)
+                container_name=container_name, blob_name=blob_name, pipe_path=pipe_path,
+                buffer_pool=buffer_pool,
+                max_connections=self.backup_configuration.get_streaming_max_connections(),
+                cancellation_token=cancellation_token,
+                block_timeout=self.backup_configuration.get_streaming_block_timeout(),
+                block_sizer=block_sizer)
             threads.append(t)
 
         try:
@@ -179,11 +216,48 @@ class BackupAgent(object):
         except Exception as e:
             printe(e.message)
 
-    def finalize_streaming_threads(self, threads):
-        _ = [t.join() for t in threads]
-
-    def streaming_backup_single_db(self, dbname, is_full, start_timestamp, stripe_count, output_dir):
-        storage_client = self.backup_configuration.storage_client
+    STREAMING_STOP_GRACE_SECONDS = 10
+
+    def finalize_streaming_threads(self, threads, cancellation_token):
+        """Wait for the upload threads until the deadline, cancel stragglers, and report upload errors."""
+        for t in threads:
+            t.join(cancellation_token.remaining_seconds())
+
+        if any(t.is_alive() for t in threads):
+            logging.error("Streaming uploads did not finish before the deadline, cancelling")
+            self.stop_streaming_threads(threads, cancellation_token)
+
+        errors = [t.get_exception() for t in threads if t.get_exception() is not None]
+        if errors:
+            raise BackupException("Streaming upload failed: {}".format(
+                "; ".join([str(e) for e in errors])))
+
+    def stop_streaming_threads(self, threads, cancellation_token):
+        """Cancel the upload threads and give them a few seconds to release their pipes."""
+        cancellation_token.cancel()
+        _ = [t.stop() for t in threads]
+        for t in threads:
+            t.join(BackupAgent.STREAMING_STOP_GRACE_SECONDS)
+        stuck = [t.blob_name for t in threads if t.is_alive()]
+        if stuck:
+            logging.error("Upload threads for %s did not stop in time", stuck)
+
+    def streaming_memory_budget(self):
+        """The memory budget of one backup, as concurrent backups share the configured budget."""
+        return self.backup_configuration.get_streaming_memory_budget() // self.backup_configuration.get_backup_max_concurrent_dumps()
+
+    def create_block_sizer(self, buffer_pool, stripe_count, expected_size, connections):
+        """
+        Block sizes for the stripes of one backup. Growing the blocks for throughput
+        is limited so that each stripe still gets two buffers from the memory budget.
+        """
+        return BlockSizer(
+            min_block_size=self.backup_configuration.get_streaming_block_size(),
+            expected_stripe_size=expected_size // stripe_count if expected_size else None,
+            connections=connections, buffer_pool=buffer_pool,
+            max_throughput_block_size=self.streaming_memory_budget() // (2 * stripe_count))
+
+    def streaming_backup_single_db(self, dbname, is_full, start_timestamp, stripe_count, output_dir, expected_size=None):
         #
         # The container where backups end up (dest_container_name) could be set with an immutability policy. 
         # We have to "rename" the blobs with the end-times for restore logic to work.
@@ -192,50 +266,181 @@ class BackupAgent(object):
         temp_container_name = self.backup_configuration.azure_storage_container_name_temp
         dest_container_name = self.backup_configuration.azure_storage_container_name
 
+        #
+        # All stripe readers share one memory budget for their block buffers.
+        #
+        buffer_pool = BufferPool(
+            buffer_size=self.backup_configuration.get_streaming_block_size(),
+            memory_budget=self.streaming_memory_budget())
+
+        #
+        # The agent controls the upload threads through a shared cancellation token,
+        # which also carries the overall deadline for the streaming backup.
+        #
+        cancellation_token = CancellationToken(
+            timeout_seconds=self.backup_configuration.get_streaming_deadline())
+
+        block_sizer = self.create_block_sizer(
+            buffer_pool=buffer_pool, stripe_count=stripe_count, expected_size=expected_size,
+            connections=stripe_count * self.backup_configuration.get_streaming_max_connections())
+
         threads = self.start_streaming_threads(
             dbname=dbname, is_full=is_full, start_timestamp=start_timestamp,
-            stripe_count=stripe_count, output_dir=output_dir, container_name=temp_container_name)
+            stripe_count=stripe_count, output_dir=output_dir, container_name=temp_container_name,
+            buffer_pool=buffer_pool, cancellation_token=cancellation_token, block_sizer=block_sizer)
         logging.debug("Start streaming backup SQL call")
         try:
             stdout, stderr, returncode = self.database_connector.create_backup_streaming(
                 dbname=dbname, is_full=is_full, stripe_count=stripe_count,
                 output_dir=output_dir)
         except BackupException:
-            storage_client.delete_container(container_name=temp_container_name)
-            _ = [t.stop() for t in threads]
+            self.stop_streaming_threads(threads, cancellation_token)
+            logging.info("Streaming buffer usage for %s: %s", dbname, buffer_pool.usage())
+            self.delete_temp_blobs(dbname=dbname, is_full=is_full, start_timestamp=start_timestamp, stripe_count=stripe_count)
             raise
 
-        self.finalize_streaming_threads(threads)
+        if DatabaseConnector.MAGIC_SUCCESS_STRING not in stdout:
+            #
+            # ASE did not complete the dump, so the pipes' content must not be committed.
+            #
+            self.stop_streaming_threads(threads, cancellation_token)
+            logging.info("Streaming buffer usage for %s: %s", dbname, buffer_pool.usage())
+            return (stdout, stderr, returncode, Timing.now_localtime())
+
+        self.finalize_streaming_threads(threads, cancellation_token)
+        logging.info("Streaming buffer usage for %s: %s", dbname, buffer_pool.usage())
         end_timestamp = Timing.now_localtime()
 
         #
         # Rename
         # - copy from temp_container_name/old_blob_name to dest_container_name/new_blob_name)
         #
-        source_blobs = []
-        copied_blobs = []
+        # The blocks cannot be staged against the final blob name in the first place,
+        # because that name contains the end_timestamp, which is only known after the
+        # last block has been read from the pipe.
+        #
+        renames = []
         for stripe_index in range(1, stripe_count + 1):
             old_blob_name = Naming.construct_filename(dbname=dbname, is_full=is_full, start_timestamp=start_timestamp, stripe_index=stripe_index, stripe_count=stripe_count)
-            source_blobs.append(old_blob_name)
             new_blob_name = Naming.construct_blobname(dbname=dbname, is_full=is_full, start_timestamp=start_timestamp, end_timestamp=end_timestamp, stripe_index=stripe_index, stripe_count=stripe_count)
-            copied_blobs.append(new_blob_name)
+            renames.append((old_blob_name, new_blob_name))
 
-            copy_source = storage_client.make_blob_url(temp_container_name, old_blob_name)
-            storage_client.copy_blob(dest_container_name, new_blob_name, copy_source=copy_source)
+        self.move_blobs(source_container_name=temp_container_name,
+                        dest_container_name=dest_container_name, renames=renames)
 
-        #
-        # Wait for all copies to succeed
-        #
-        get_all_copy_statuses = lambda: map(lambda b: storage_client.get_blob_properties(dest_container_name, b).properties.copy.status, copied_blobs)
-        while not all(status == "success" for status in get_all_copy_statuses()):
-            logging.debug("Waiting for all blobs to be copied {}".format(get_all_copy_statuses()))
+        return (stdout, stderr, returncode, end_timestamp)
+
+    COPY_POLL_MIN_INTERVAL_SECONDS = 1
+    COPY_POLL_MAX_INTERVAL_SECONDS = 30
+
+    def delete_temp_blobs(self, dbname, is_full, start_timestamp, stripe_count):
+        """Remove the staged stripes of one backup from the temp container, which concurrent backups share."""
+        storage_client = self.backup_configuration.storage_client
+        temp_container_name = self.backup_configuration.azure_storage_container_name_temp
+        for stripe_index in range(1, stripe_count + 1):
+            blob_name = Naming.construct_filename(dbname=dbname, is_full=is_full, start_timestamp=start_timestamp, stripe_index=stripe_index, stripe_count=stripe_count)
+            if storage_client.exists(container_name=temp_container_name, blob_name=blob_name):
+                storage_client.delete_blob(container_name=temp_container_name, blob_name=blob_name)
+
+    def move_blobs(self, source_container_name, dest_container_name, renames):
+        """Server-side copy blobs to their new names, and delete each source once its copy succeeded."""
+        storage_client = self.backup_configuration.storage_client
 
         #
-        # Delete sources
+        # Within the same storage account, copies usually complete synchronously,
+        # so only copies still 'pending' after copy_blob() need to be polled.
         #
-        _ =     [storage_client.delete_blob(temp_container_name, b) for b in source_blobs]
+        pending = []
+        for (old_blob_name, new_blob_name) in renames:
+            copy_source = storage_client.make_blob_url(source_container_name, old_blob_name)
+            copy = storage_client.copy_blob(dest_container_name, new_blob_name, copy_source=copy_source)
+            if copy.status == "success":
+                storage_client.delete_blob(source_container_name, old_blob_name)
+            else:
+                pending.append((old_blob_name, new_blob_name))
+
+        interval = BackupAgent.COPY_POLL_MIN_INTERVAL_SECONDS
+        while pending:
+            logging.debug("Waiting %d seconds for %d blobs to be copied", interval, len(pending))
+            time.sleep(interval)
+            interval = min(2 * interval, BackupAgent.COPY_POLL_MAX_INTERVAL_SECONDS)
+
+            still_pending = []
+            for (old_blob_name, new_blob_name) in pending:
+                copy = storage_client.get_blob_properties(dest_container_name, new_blob_name).properties.copy
+                if copy.status == "success":
+                    storage_client.delete_blob(source_container_name, old_blob_name)
+                elif copy.status == "pending":
+                    still_pending.append((old_blob_name, new_blob_name))
+                else:
+                    raise BackupException("Copy of {} to {} ended with status {}: {}".format(
+                        old_blob_name, new_blob_name, copy.status, copy.status_description))
+            pending = still_pending
+
+    def start_tailing_threads(self, dbname, is_full, start_timestamp, stripe_count, output_dir, cancellation_token, expected_size=None):
+        """Start following the stripe files, which ASE is about to write, and stage their blocks in the temp container."""
+        buffer_pool = BufferPool(
+            buffer_size=self.backup_configuration.get_streaming_block_size(),
+            memory_budget=self.streaming_memory_budget())
+        max_connections = self.backup_configuration.get_upload_max_connections()
+        connection_slots = threading.BoundedSemaphore(max_connections)
+        block_sizer = self.create_block_sizer(
+            buffer_pool=buffer_pool, stripe_count=stripe_count, expected_size=expected_size,
+            connections=min(max_connections, stripe_count * self.backup_configuration.get_streaming_max_connections()))
 
-        return (stdout, stderr, returncode, end_timestamp)
+        threads = []
+        for stripe_index in range(1, stripe_count + 1):
+            file_name = Naming.construct_filename(dbname=dbname, is_full=is_full, start_timestamp=start_timestamp, stripe_index=stripe_index, stripe_count=stripe_count)
+            threads.append(TailingThread(
+                storage_client=self.backup_configuration.storage_client,
+                container_name=self.backup_configuration.azure_storage_container_name_temp,
+                blob_name=file_name, file_path=os.path.join(output_dir, file_name),
+                buffer_pool=buffer_pool,
+                max_connections=self.backup_configuration.get_streaming_max_connections(),
+                cancellation_token=cancellation_token,
+                block_timeout=self.backup_configuration.get_streaming_block_timeout(),
+                block_sizer=block_sizer, connection_slots=connection_slots))
+
+        _ = [t.start() for t in threads]
+        logging.debug("Started %d threads to upload stripe files while dumping", len(threads))
+        return threads
+
+    def finalize_tailing_threads(self, threads, cancellation_token, files):
+        """
+        Wait for the uploads of the finished stripe files, and move each verified
+        blob from the temp container to its final name. A stripe is only trusted
+        if the digest of what was uploaded while dumping matches the final local
+        file; the local file is removed afterwards.
+
+        Returns the (blob_name, file_path) pairs which still need a regular upload.
+        """
+        temp_container_name = self.backup_configuration.azure_storage_container_name_temp
+        _ = [t.finish() for t in threads]
+        for t in threads:
+            t.join(cancellation_token.remaining_seconds())
+        if any(t.is_alive() for t in threads):
+            logging.error("Uploads while dumping did not finish before the deadline, cancelling")
+            self.stop_streaming_threads(threads, cancellation_token)
+
+        renames = []
+        uploaded_files = []
+        remaining = []
+        for (t, (blob_name, blob_path)) in zip(threads, files):
+            if t.get_exception() is None and not t.is_alive() and t.sha256 == FileUploader.file_sha256(blob_path):
+                renames.append((t.blob_name, blob_name))
+                uploaded_files.append(blob_path)
+                continue
+
+            logging.warning("Upload of %s while dumping failed or does not match the final file, uploading it again", blob_path)
+            if t.sha256 is not None:
+                self.backup_configuration.storage_client.delete_blob(temp_container_name, t.blob_name)
+            remaining.append((blob_name, blob_path))
+
+        self.move_blobs(source_container_name=temp_container_name,
+                        dest_container_name=self.backup_configuration.azure_storage_container_name,
+                        renames=renames)
+        _ = [os.remove(blob_path) for blob_path in uploaded_files]
+        return remaining
 
     def file_backup_single_db(self, dbname, is_full, start_timestamp, stripe_count, output_dir):
         stdout, stderr, returncode = self.database_connector.create_backup(
@@ -245,7 +450,7 @@ class BackupAgent(object):
 
         return (stdout, stderr, returncode, end_timestamp)
 
-    def backup_single_db(self, dbname, is_full, force, skip_upload, output_dir, use_streaming):
+    def backup_single_db(self, dbname, is_full, force, skip_upload, output_dir, use_streaming, use_tailing=False, database_size=None):
         previous_backup_timestamp = self.latest_backup_timestamp(dbname, is_full)
 
         start_timestamp = Timing.now_localtime()
@@ -253,25 +458,45 @@ class BackupAgent(object):
             out("Skip backup of database {}".format(dbname))
             return
 
-        stripe_count = self.database_connector.determine_database_backup_stripe_count(
-            dbname=dbname, is_full=is_full)
+        if database_size is None:
+            (database_size, ) = self.database_connector.determine_database_sizes(
+                is_full=is_full, user_selected_databases=[dbname])
+        stripe_count = database_size.stripe_count
+        expected_size = database_size.used_size
 
         backup_exception = None
         stdout = None
         stderr = None
         end_timestamp = None
+        tailing_threads = None
+        cancellation_token = None
+        dump_start_timestamp = None
         try:
             if not use_streaming:
+                if use_tailing and not skip_upload:
+                    #
+                    # Upload the stripe files while ASE writes them. The blocks are committed
+                    # to the temp container only after the dump succeeded, and the local
+                    # files are kept until the upload has been verified.
+                    #
+                    cancellation_token = CancellationToken(
+                        timeout_seconds=self.backup_configuration.get_streaming_deadline())
+                    tailing_threads = self.start_tailing_threads(
+                        dbname=dbname, is_full=is_full, start_timestamp=start_timestamp,
+                        stripe_count=stripe_count, output_dir=output_dir,
+                        cancellation_token=cancellation_token, expected_size=expected_size)
                 out("Start file-based backup for database {dbname}".format(dbname=dbname))
+                dump_start_timestamp = Timing.now_localtime()
                 stdout, stderr, _returncode, end_timestamp = self.file_backup_single_db(
                     dbname=dbname, is_full=is_full, start_timestamp=start_timestamp,
                     stripe_count=stripe_count, output_dir=output_dir)
                 log_stdout_stderr(stdout, stderr)
             else:
                 out("Start streaming-based backup for database {dbname}".format(dbname=dbname))
+                dump_start_timestamp = Timing.now_localtime()
                 stdout, stderr, _returncode, end_timestamp = self.streaming_backup_single_db(
                     dbname=dbname, is_full=is_full, start_timestamp=start_timestamp,
-                    stripe_count=stripe_count, output_dir=output_dir)
+                    stripe_count=stripe_count, output_dir=output_dir, expected_size=expected_size)
                 log_stdout_stderr(stdout, stderr)
         except BackupException as be:
             backup_exception = be
@@ -287,6 +512,9 @@ class BackupAgent(object):
             #
             # Clean up resources
             #
+            if tailing_threads is not None:
+                self.stop_streaming_threads(tailing_threads, cancellation_token)
+
             for stripe_index in range(1, stripe_count + 1):
                 file_name = Naming.construct_filename(dbname=dbname, is_full=is_full, start_timestamp=start_timestamp, stripe_index=stripe_index, stripe_count=stripe_count)
                 file_path = os.path.join(output_dir, file_name)
@@ -296,6 +524,7 @@ class BackupAgent(object):
                 blob_name = Naming.construct_blobname(dbname=dbname, is_full=is_full, start_timestamp=start_timestamp, end_timestamp=end_timestamp, stripe_index=stripe_index, stripe_count=stripe_count)
                 if self.backup_configuration.storage_client.exists(container_name=self.backup_configuration.azure_storage_container_name, blob_name=blob_name):
                     self.backup_configuration.storage_client.delete_blob(container_name=self.backup_configuration.azure_storage_container_name, blob_name=blob_name)
+                    self.record_deleted_blob(blob_name)
 
             message = None
             if not success:
@@ -325,6 +554,7 @@ class BackupAgent(object):
             # If the machine reboots during an isql run, then that rename doesn't happen, and we do
             # not upload these potentially corrupt dump files
             #
+            files = []
             for stripe_index in range(1, stripe_count + 1):
                 file_name = Naming.construct_filename(dbname=dbname, is_full=is_full, start_timestamp=start_timestamp, stripe_index=stripe_index, stripe_count=stripe_count)
                 blob_name = Naming.construct_blobname(dbname=dbname, is_full=is_full, start_timestamp=start_timestamp, end_timestamp=end_timestamp, stripe_index=stripe_index, stripe_count=stripe_count)
@@ -333,10 +563,29 @@ class BackupAgent(object):
 
                 os.rename(file_path, blob_path)
                 out("Move {} to Azure Storage".format(blob_path))
-                self.backup_configuration.storage_client.create_blob_from_path(
-                    container_name=self.backup_configuration.azure_storage_container_name,
-                    file_path=blob_path, blob_name=blob_name, validate_content=True, max_connections=4)
-                os.remove(blob_path)
+                files.append((blob_name, blob_path))
+
+            if tailing_threads is not None:
+                files = self.finalize_tailing_threads(tailing_threads, cancellation_token, files)
+
+            #
+            # All stripes are uploaded concurrently; each one is removed locally after
+            # its own upload succeeded, and recorded even if another stripe failed.
+            #
+            self.upload_files(files)
+
+        #
+        # The throughput of the dump alone, from its start until ASE finished the
+        # last stripe; ddlgen and the file uploads do not depend on the stripe count.
+        #
+        run = BackupRun(
+            dbname=dbname, is_full=is_full, use_streaming=use_streaming, stripe_count=stripe_count,
+            used_size=expected_size, seconds=Timing.time_diff_in_seconds(dump_start_timestamp, end_timestamp),
+            end_timestamp=end_timestamp)
+        self.record_backup_run(run)
+        if expected_size and run.seconds > 0:
+            out("Dump of {dbname} took {seconds}s with {stripes} stripes, {rate:.1f} MB/s per stripe".format(
+                dbname=dbname, seconds=run.seconds, stripes=stripe_count, rate=run.stripe_rate / (1024 * 1024)))
 
         backup_size_in_bytes = 0
         if not skip_upload:
@@ -346,7 +595,11 @@ class BackupAgent(object):
                     container_name=self.backup_configuration.azure_storage_container_name,
                     blob_name=blob_name)
                 backup_size_in_bytes += blob_props.properties.content_length
+                self.record_uploaded_blob(blob_name, blob_props.properties.content_length)
                 print "Blob {n} has size {l}".format(n=blob_name, l=blob_props.properties.content_length)
+            if expected_size:
+                out("Backup of {dbname} has {size:,} bytes, {ratio:.0%} of the {used:,} bytes used in the database".format(
+                    dbname=dbname, size=backup_size_in_bytes, ratio=float(backup_size_in_bytes) / expected_size, used=expected_size))
 
         self.send_notification(
             dbname=dbname, is_full=is_full,
@@ -357,6 +610,77 @@ class BackupAgent(object):
             overall_size_in_bytes=backup_size_in_bytes,
             use_streaming=use_streaming)
 
+    def resume_interrupted_uploads(self, output_dir, is_full):
+        """
+        Upload dump files which a previous run renamed to their blob name, but did
+        not finish uploading. The rename only happens after a successful isql run,
+        so these files are complete. Staged blocks recorded in the file's journal
+        are not uploaded again, and a file whose blob was already committed is
+        only removed.
+
+        Each file is resumed on its own: a failure is logged and notified, and
+        neither stops the other files nor the backups which follow.
+
+        Only dumps of the current backup type are picked up, as the pid lock only
+        protects against concurrent runs of the same type.
+        """
+        for existing_file in sorted(os.listdir(output_dir)):
+            parts = Naming.parse_blobname(existing_file)
+            if parts is None or not existing_file.endswith(".cdmp") or parts[1] != is_full:
+                continue
+
+            (dbname, is_full, start_timestamp, end_timestamp, _stripe_index, _stripe_count) = parts
+            blob_path = os.path.join(output_dir, existing_file)
+            try:
+                file_size = os.path.getsize(blob_path)
+                if self.committed_blob_size(existing_file) == file_size:
+                    out("Upload of {} to Azure Storage was already complete".format(blob_path))
+                    BlockJournal(blob_path).remove()
+                    os.remove(blob_path)
+                    self.record_uploaded_blob(existing_file, file_size)
+                    continue
+
+                out("Resume upload of {} to Azure Storage".format(blob_path))
+                self.upload_files([(existing_file, blob_path)])
+            except Exception as exception:
+                logging.error("Resumed upload of %s failed: %s", blob_path, exception)
+                self.send_notification(
+                    dbname=dbname, is_full=is_full,
+                    previous_backup_timestamp=self.latest_backup_timestamp(dbname, is_full),
+                    start_timestamp=start_timestamp,
+                    end_timestamp=end_timestamp,
+                    success=False,
+                    overall_size_in_bytes=0,
+                    use_streaming=False,
+                    error_msg="Resumed upload of {} failed: {}".format(blob_path, exception))
+
+    def committed_blob_size(self, blob_name):
+        """The size of the committed blob in the container, or None if there is none."""
+        try:
+            blob_props = self.backup_configuration.storage_client.get_blob_properties(
+                container_name=self.backup_configuration.azure_storage_container_name,
+                blob_name=blob_name)
+        except AzureMissingResourceHttpError:
+            return None
+        return blob_props.properties.content_length
+
+    def upload_files(self, files):
+        """Upload and remove the given (blob_name, file_path) pairs, and record the uploaded blobs."""
+        sizes = dict([(file_path, os.path.getsize(file_path)) for (_blob_name, file_path) in files])
+        try:
+            self.create_file_uploader().upload(files)
+        finally:
+            for (blob_name, file_path) in files:
+                if not os.path.exists(file_path):
+                    self.record_uploaded_blob(blob_name, sizes[file_path])
+
+    def create_file_uploader(self):
+        return ConcurrentFileUploader(
+            storage_client=self.backup_configuration.storage_client,
+            container_name=self.backup_configuration.azure_storage_container_name,
+            max_connections=self.backup_configuration.get_upload_max_connections(),
+            memory_budget=self.streaming_memory_budget())
+
     def upload_local_backup_files_from_previous_operations(self, output_dir):
         """Upload ASE-generated cdmp files"""
         for existing_file in os.listdir(output_dir):
@@ -388,10 +712,12 @@ class BackupAgent(object):
             out("Move ASE-generated dump '{file_path}' to Azure Storage as '{blob_name}'".format(file_path=file_path, blob_name=blob_name))
             backup_size_in_bytes = os.stat(file_path).st_size
             try:
-                self.backup_configuration.storage_client.create_blob_from_path(
-                    container_name=self.backup_configuration.azure_storage_container_name, file_path=file_path,
-                    blob_name=blob_name, validate_content=True, max_connections=4)
+                FileUploader(
+                    storage_client=self.backup_configuration.storage_client,
+                    container_name=self.backup_configuration.azure_storage_container_name,
+                    blob_name=blob_name, file_path=file_path).upload()
                 os.remove(file_path)
+                self.record_uploaded_blob(blob_name, backup_size_in_bytes)
                 self.send_notification(
                     dbname=dbname, is_full=False,
                     previous_backup_timestamp=previous_backup_timestamp,
@@ -413,34 +739,18 @@ class BackupAgent(object):
 
     def list_backups(self, databases=[]):
         """Lists backups in the given storage account."""
-        baks_dict = self.existing_backups(databases=databases)
-        for end_timestamp in baks_dict:
-            # http://mark-dot-net.blogspot.com/2014/03/python-equivalents-of-linq-methods.html
-            stripes = baks_dict[end_timestamp]
-
-            stripes = [{
-                "parts": Naming.parse_blobname(x["blob_name"]),
-                "content_length": x["content_length"]
-            } for x in stripes]
-
-            stripes = [{
-                "dbname": x["parts"][0],
-                "is_full": x["parts"][1],
-                "begin": x["parts"][2],
-                "end": x["parts"][3],
-                "stripe_index": x["parts"][4],
-                "content_length": x["content_length"]
-            } for x in stripes]
-
-            group_by_key = lambda x: "db {dbname: <30} start {begin} end {end} ({type})".format(
-                dbname=x["dbname"], end=x["end"], begin=x["begin"], type=Naming.backup_type_str(x["is_full"]))
-
-            for group, values in groupby(stripes, key=group_by_key):
-                values = [x for x in values] # Expand interable
-                print "{backup} {size:>20,} bytes, stripes: {files} ".format(
-                    backup=group,
-                    files=[s["stripe_index"] for s in values],
-                    size=sum([s["content_length"] for s in values]))
+        #
+        # The catalog orders by end timestamp and name, so the stripes of a dump are adjacent.
+        #
+        group_by_key = lambda x: "db {dbname: <30} start {begin} end {end} ({type})".format(
+            dbname=x.dbname, end=x.end_timestamp, begin=x.start_timestamp, type=Naming.backup_type_str(x.is_full))
+
+        for group, values in groupby(self.catalog.blobs(databases=databases or None), key=group_by_key):
+            values = [x for x in values] # Expand interable
+            print "{backup} {size:>20,} bytes, stripes: {files} ".format(
+                backup=group,
+                files=[s.stripe_index for s in values],
+                size=sum([s.content_length for s in values]))
 
     def prune_old_backups(self, older_than, databases):
         """Delete (prune) old backups from Azure storage."""
@@ -451,44 +761,32 @@ class BackupAgent(object):
             logging.warn(msg)
             return
 
-        marker = None
-        while True:
-            results = self.backup_configuration.storage_client.list_blobs(
-                container_name=self.backup_configuration.azure_storage_container_name,
-                marker=marker)
-            for blob in results:
-                parts = Naming.parse_blobname(blob.name)
-                if parts is None:
-                    continue
-
-                (dbname, _is_full, _start_timestamp, end_timestamp, _stripe_index, _stripe_count) = parts
-                if (databases != None) and not dbname in databases:
-                    continue
-
-                diff = Timing.time_diff(end_timestamp, Timing.now_localtime())
-                delete = diff > older_than
-
-                if delete:
-                    logging.warn("Deleting {}".format(blob.name))
-                    self.backup_configuration.storage_client.delete_blob(
-                        container_name=self.backup_configuration.azure_storage_container_name,
-                        blob_name=blob.name)
-                else:
-                    logging.warn("Keeping {}".format(blob.name))
-
-            if results.next_marker:
-                marker = results.next_marker
-            else:
-                break
+        #
+        # A dump is older than `older_than` exactly when it ended before this cutoff.
+        #
+        cutoff = (datetime.datetime.now() - older_than).strftime(Timing.time_format)
+        for record in self.catalog.blobs_ending_before(end_timestamp=cutoff, databases=databases):
+            logging.warn("Deleting {}".format(record.blob_name))
+            try:
+                self.backup_configuration.storage_client.delete_blob(
+                    container_name=self.backup_configuration.azure_storage_container_name,
+                    blob_name=record.blob_name)
+            except AzureMissingResourceHttpError:
+                logging.warn("{} was already deleted".format(record.blob_name))
+            self.record_deleted_blob(record.blob_name)
 
-    def restore(self, restore_point, output_dir, databases):
+    def restore(self, restore_point, output_dir, databases, use_streaming=False, execute=False):
         print "Retriving point-in-time restore {} for databases {}".format(restore_point, str(databases))
         databases = self.database_connector.determine_databases(user_selected_databases=databases, is_full=True)
         skip_dbs = self.backup_configuration.get_databases_to_skip()
         # databases = [db for db in databases if not db in skip_dbs]
         databases = filter(lambda db: not (db in skip_dbs), databases)
         for dbname in databases:
-            self.restore_single_db(dbname=dbname, output_dir=output_dir, restore_point=restore_point)
+            if use_streaming or execute:
+                self.execute_restore_single_db(dbname=dbname, output_dir=output_dir, restore_point=restore_point,
+                                               use_streaming=use_streaming)
+            else:
+                self.restore_single_db(dbname=dbname, output_dir=output_dir, restore_point=restore_point)
 
     def download_ddlgen(self, dbname, start_timestamp, output_dir):
         """Download a database layout"""
@@ -503,50 +801,78 @@ class BackupAgent(object):
 
     def restore_single_db(self, dbname, restore_point, output_dir):
         """Restore a single database"""
-        blobs = self.list_restore_blobs(dbname=dbname)
-        times = [Naming.parse_blobname(b) for b in blobs]
-        restore_files = Timing.files_needed_for_recovery(
-            times, restore_point,
-            select_end_date=lambda x: x[3],
-            select_is_full=lambda x: x[1])
+        plan = self.restore_planner(dbname=dbname).plan(restore_point)
 
-        storage_client = self.backup_configuration.storage_client
-        container_name = self.backup_configuration.azure_storage_container_name
-        for (_dbname, is_full, start_timestamp, end_timestamp, stripe_index, stripe_count) in restore_files:
+        files = []
+        for stripe in plan.stripes:
             # For full database files, download the ddlgen SQL description, but only along with the 1st stripe
-            if is_full and stripe_index == 1:
-                self.download_ddlgen(dbname=dbname, start_timestamp=start_timestamp, output_dir=output_dir)
-
-            blob_name = "{dbname}_{type}_{start}--{end}_S{idx:03d}-{cnt:03d}.cdmp".format(
-                dbname=dbname, type=Naming.backup_type_str(is_full),
-                start=start_timestamp, end=end_timestamp,
-                idx=stripe_index, cnt=stripe_count)
-            file_name = "{dbname}_{type}_{start}_S{idx:03d}-{cnt:03d}.cdmp".format(
-                dbname=dbname, type=Naming.backup_type_str(is_full),
-                start=start_timestamp, idx=stripe_index, cnt=stripe_count)
-
-            file_path = os.path.join(output_dir, file_name)
-            storage_client.get_blob_to_path(container_name=container_name, blob_name=blob_name, file_path=file_path)
-            out("Downloaded dump {}".format(file_path))
-
-    def list_restore_blobs(self, dbname):
-        existing_blobs = []
-        marker = None
-        while True:
-            results = self.backup_configuration.storage_client.list_blobs(
+            if stripe.is_full and stripe.stripe_index == 1:
+                self.download_ddlgen(dbname=dbname, start_timestamp=stripe.start_timestamp, output_dir=output_dir)
+            files.append((stripe.blob_name, os.path.join(output_dir, stripe.file_name), stripe.content_length))
+
+        self.download_files(files)
+
+    def download_files(self, files, cancellation_token=None):
+        """Download (blob_name, file_path, size) triples, through the restore cache if one is configured."""
+        downloader = self.create_blob_downloader(cancellation_token=cancellation_token)
+        cache_dir = self.backup_configuration.get_restore_cache_dir()
+        if cache_dir is None:
+            downloader.download(files)
+            return
+        RestoreCache(
+            directory=cache_dir, max_bytes=self.backup_configuration.get_restore_cache_size(),
+            storage_client=self.backup_configuration.storage_client,
+            container_name=self.backup_configuration.azure_storage_container_name).fetch(files, downloader)
+
+    def create_blob_downloader(self, cancellation_token=None):
+        on_file_downloaded = lambda download: out("Downloaded dump {} ({:.1f} MB/s)".format(
+            download.file_path, download.throughput() / (1024 * 1024)))
+        return BlobDownloader(
+            storage_client=self.backup_configuration.storage_client,
+            container_name=self.backup_configuration.azure_storage_container_name,
+            max_connections=self.backup_configuration.get_download_max_connections(),
+            on_file_downloaded=on_file_downloaded, cancellation_token=cancellation_token)
+
+    def execute_restore_single_db(self, dbname, restore_point, output_dir, use_streaming=False):
+        """
+        Load the restore chain into ASE and bring the database online. The dumps
+        are either downloaded into `output_dir` and removed once loaded, or
+        streamed through one named pipe per stripe, so that no dump is written
+        to local disk.
+        """
+        if use_streaming:
+            source = StreamingDumpSource(
+                storage_client=self.backup_configuration.storage_client,
                 container_name=self.backup_configuration.azure_storage_container_name,
-                prefix="{dbname}_".format(dbname=dbname),
-                marker=marker)
-            for blob in results:
-                existing_blobs.append(blob.name)
-            if results.next_marker:
-                marker = results.next_marker
-            else:
-                break
-        #
-        # restrict to dump files
-        #
-        return [x for x in existing_blobs if x.endswith(".cdmp")]
+                output_dir=output_dir, dbname=dbname,
+                timeout_seconds=self.backup_configuration.get_streaming_deadline())
+        else:
+            source = DownloadedDumpSource(
+                download_files=self.download_files, output_dir=output_dir, dbname=dbname)
+
+        report = RestoreReport()
+        plan = self.restore_planner(dbname=dbname).plan(restore_point)
+        try:
+            RestoreExecutor(database_connector=self.database_connector, dbname=dbname,
+                            source=source, report=report).execute(plan)
+        finally:
+            for line in report.lines():
+                out("{}: {}".format(dbname, line))
+        out("Restored database {} to {}".format(dbname, restore_point))
+
+    def stripe_planner(self, is_full, use_streaming):
+        """A StripePlanner over the recent backup runs of the same kind on this machine."""
+        with self.catalog_lock:
+            runs = self.catalog.runs(is_full=is_full, use_streaming=use_streaming)
+        return StripePlanner(runs, max_stripes=self.backup_configuration.get_backup_max_stripes())
+
+    def record_backup_run(self, run):
+        with self.catalog_lock:
+            self.catalog.add_run(run)
+
+    def restore_planner(self, dbname):
+        """A RestorePlanner over the dumps of a database, which answers many restore points."""
+        return RestorePlanner(self.catalog.blobs(databases=[dbname]))
 
     def show_configuration(self, output_dir):
         return "\n".join(self.get_configuration_printable(output_dir=output_dir))
@@ -592,7 +918,10 @@ class BackupAgent(object):
                 return
 
             template = self.backup_configuration.get_notification_template()
-            env = os.environ
+            #
+            # A copy, as concurrent backup jobs send their notifications at the same time.
+            #
+            env = dict(os.environ)
 
             # Can use a `notification_command` like so:
             #
@@ -130,6 +130,12 @@ class BackupConfiguration(object):
     def get_database_password_generator(self):
         return self.db_config_file_value("database_password_generator")
 
+    def get_database_password_ttl_seconds(self):
+        """How long the database password is kept in memory before the generator is called again."""
+        if self.db_config_file.key_exists("database_password_ttl_minutes"):
+            return 60 * int(self.db_config_file_value("database_password_ttl_minutes"))
+        return 60 * 60
+
     def get_notification_command(self):
         if self.db_config_file.key_exists("notification_command"):
             return self.db_config_file_value("notification_command")
@@ -143,6 +149,90 @@ class BackupConfiguration(object):
 
         return get_data("asebackupcli", "notification.json")
 
+    def get_streaming_block_size(self):
+        """Size in bytes of the blocks which are staged during streaming uploads."""
+        if self.db_config_file.key_exists("streaming.block_size_mb"):
+            return int(self.db_config_file_value("streaming.block_size_mb")) * 1024 * 1024
+        return 4 * 1024 * 1024
+
+    def get_streaming_max_connections(self):
+        """Number of parallel upload connections per stripe during streaming uploads."""
+        if self.db_config_file.key_exists("streaming.max_connections"):
+            return int(self.db_config_file_value("streaming.max_connections"))
+        return 4
+
+    def get_streaming_memory_budget(self):
+        """Upper limit in bytes for the block buffers of all stripes of all concurrent backups, streamed or uploaded from files."""
+        if self.db_config_file.key_exists("streaming.memory_budget_mb"):
+            return int(self.db_config_file_value("streaming.memory_budget_mb")) * 1024 * 1024
+        return 256 * 1024 * 1024
+
+    def get_streaming_block_timeout(self):
+        """Timeout in seconds for staging a single block during streaming uploads."""
+        if self.db_config_file.key_exists("streaming.block_timeout_seconds"):
+            return int(self.db_config_file_value("streaming.block_timeout_seconds"))
+        return 300
+
+    def get_streaming_deadline(self):
+        """Overall time limit in seconds for the uploads of a streaming backup."""
+        if self.db_config_file.key_exists("streaming.deadline_minutes"):
+            return 60 * int(self.db_config_file_value("streaming.deadline_minutes"))
+        return 24 * 60 * 60
+
+    def get_upload_max_connections(self):
+        """Number of parallel upload connections, shared by all stripes, during file-based uploads."""
+        if self.db_config_file.key_exists("upload.max_connections"):
+            return int(self.db_config_file_value("upload.max_connections"))
+        return 8
+
+    def get_backup_max_concurrent_dumps(self):
+        """Number of databases which are backed up at the same time."""
+        if self.db_config_file.key_exists("backup.max_concurrent_dumps"):
+            return int(self.db_config_file_value("backup.max_concurrent_dumps"))
+        return 1
+
+    def get_backup_max_total_stripes(self):
+        """Number of stripes which the concurrent dumps may use together."""
+        if self.db_config_file.key_exists("backup.max_total_stripes"):
+            return int(self.db_config_file_value("backup.max_total_stripes"))
+        return 32
+
+    def get_backup_max_stripes(self):
+        """Upper limit for the stripe count which the stripe planner picks from the run history."""
+        if self.db_config_file.key_exists("backup.max_stripes"):
+            return int(self.db_config_file_value("backup.max_stripes"))
+        return 8
+
+    def get_download_max_connections(self):
+        """Number of parallel ranged downloads, shared by all stripes, during restores."""
+        if self.db_config_file.key_exists("download.max_connections"):
+            return int(self.db_config_file_value("download.max_connections"))
+        return 8
+
+    def get_restore_cache_dir(self):
+        """Directory of the local cache of downloaded stripes for restores, or None without a cache."""
+        if self.db_config_file.key_exists("restore.cache_dir"):
+            return self.db_config_file_value("restore.cache_dir").strip('"')
+        return None
+
+    def get_restore_cache_size(self):
+        """Size limit of the restore cache in bytes."""
+        if self.db_config_file.key_exists("restore.cache_size_gb"):
+            return int(self.db_config_file_value("restore.cache_size_gb")) * 1024 * 1024 * 1024
+        return 100 * 1024 * 1024 * 1024
+
+    def get_catalog_path(self):
+        """Location of the local blob catalog."""
+        if self.db_config_file.key_exists("catalog.path"):
+            return self.db_config_file_value("catalog.path").strip('"')
+        return os.path.join(os.path.expanduser("~"), ".asebackupcli_catalog.db")
+
+    def get_catalog_reconcile_seconds(self):
+        """Maximum age in seconds of the local blob catalog before it is reconciled with the storage container."""
+        if self.db_config_file.key_exists("catalog.reconcile_hours"):
+            return 3600 * int(self.db_config_file_value("catalog.reconcile_hours"))
+        return 24 * 3600
+
     def get_databases_to_skip(self):
         return ["dbccdb"]
 
@@ -0,0 +1,73 @@
+# coding=utf-8
+# pylint: disable=c0301
+
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""Backup inventory module"""
+
+import bisect
+
+from .naming import BlobRecord
+
+class BackupInventory(object):
+    """
+    In-memory snapshot of the backups in storage, taken once per invocation,
+    with the sorted end timestamps per (dbname, is_full). The agent updates it
+    after its own uploads and deletes, so decisions within a run never list again.
+
+        >>> inventory = BackupInventory([BlobRecord.parse(blob_name) for blob_name in [
+        ...     "AZU_tran_20180101_020000--20180101_020100_S001-001.cdmp",
+        ...     "AZU_tran_20180101_010000--20180101_010100_S001-002.cdmp",
+        ...     "AZU_tran_20180101_010000--20180101_010100_S002-002.cdmp"]])
+        >>> inventory.end_timestamps("AZU", False)
+        ['20180101_010100', '20180101_020100']
+        >>> inventory.add(BlobRecord.parse("AZU_full_20180101_030000--20180101_040000_S001-001.cdmp"))
+        >>> inventory.latest("AZU", True)
+        '20180101_040000'
+        >>> inventory.remove(BlobRecord.parse("AZU_tran_20180101_010000--20180101_010100_S001-002.cdmp"))
+        >>> inventory.end_timestamps("AZU", False)
+        ['20180101_010100', '20180101_020100']
+        >>> inventory.remove(BlobRecord.parse("AZU_tran_20180101_010000--20180101_010100_S002-002.cdmp"))
+        >>> inventory.end_timestamps("AZU", False)
+        ['20180101_020100']
+        >>> inventory.latest("OTHER", True) is None
+        True
+    """
+    def __init__(self, records):
+        self.end_timestamps_by_db = dict()
+        self.blobs_by_dump = dict()
+        for record in records:
+            self.add(record)
+
+    def add(self, record):
+        """Add a BlobRecord."""
+        #
+        # All stripes of a dump share the end timestamp, which is kept only once.
+        #
+        key = (record.dbname, record.is_full, record.end_timestamp)
+        if key not in self.blobs_by_dump:
+            self.blobs_by_dump[key] = set()
+            bisect.insort(self.end_timestamps_by_db.setdefault((record.dbname, record.is_full), []), record.end_timestamp)
+        self.blobs_by_dump[key].add(record.blob_name)
+
+    def remove(self, record):
+        """Forget a deleted BlobRecord. The end timestamp goes away with the dump's last stripe."""
+        key = (record.dbname, record.is_full, record.end_timestamp)
+        if key not in self.blobs_by_dump:
+            return
+        self.blobs_by_dump[key].discard(record.blob_name)
+        if not self.blobs_by_dump[key]:
+            del self.blobs_by_dump[key]
+            end_timestamps = self.end_timestamps_by_db[(record.dbname, record.is_full)]
+            del end_timestamps[bisect.bisect_left(end_timestamps, record.end_timestamp)]
+
+    def end_timestamps(self, dbname, is_full):
+        return self.end_timestamps_by_db.get((dbname, is_full), [])
+
+    def latest(self, dbname, is_full):
+        """The end timestamp of the latest backup, or None."""
+        end_timestamps = self.end_timestamps(dbname, is_full)
+        if not end_timestamps:
+            return None
+        return end_timestamps[-1]
@@ -0,0 +1,102 @@
+# coding=utf-8
+# pylint: disable=c0301
+
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""Backup scheduler module"""
+
+import logging
+import threading
+
+from .backupexception import BackupException
+
+class BackupJob(object):
+    """A database to back up, with the stripe count and the expected size of its dump."""
+    def __init__(self, dbname, stripe_count, expected_size):
+        self.dbname = dbname
+        self.stripe_count = stripe_count
+        self.expected_size = expected_size
+
+    def __repr__(self):
+        return "BackupJob({}, {}, {})".format(self.dbname, self.stripe_count, self.expected_size)
+
+class BackupScheduler(object):
+    """
+    Runs backup jobs in parallel, largest expected dump first, so that small
+    databases do not wait hours behind a huge one. At most `max_concurrent_dumps`
+    dumps run at once, and together they use at most `max_total_stripes` Backup
+    Server stripes. When the next job does not fit into the free stripes, a
+    smaller one which fits starts instead; a job which alone exceeds the budget
+    starts once nothing else runs. A failed job does not stop the others, all
+    errors are raised together at the end.
+
+        >>> jobs = [BackupJob("small", 1, 10), BackupJob("big", 8, 1000), BackupJob("new", 1, None)]
+        >>> [job.dbname for job in BackupScheduler.order(jobs)]
+        ['big', 'small', 'new']
+    """
+    WAIT_INTERVAL_SECONDS = 1
+
+    def __init__(self, run_job, max_concurrent_dumps, max_total_stripes):
+        """`run_job` is called with each BackupJob, in a thread of its own."""
+        self.run_job = run_job
+        self.max_concurrent_dumps = max_concurrent_dumps
+        self.max_total_stripes = max_total_stripes
+        self.condition = threading.Condition()
+        self.running_dumps = 0
+        self.running_stripes = 0
+        self.errors = []
+
+    @staticmethod
+    def order(jobs):
+        return sorted(jobs, key=lambda job: -(job.expected_size or 0))
+
+    def next_job(self, pending):
+        """The first pending job which fits into the free dump slots and stripes, or None."""
+        if self.running_dumps >= self.max_concurrent_dumps:
+            return None
+        if self.running_dumps == 0:
+            return pending[0]
+        for job in pending:
+            if self.running_stripes + job.stripe_count <= self.max_total_stripes:
+                return job
+        return None
+
+    def run_one(self, job):
+        try:
+            self.run_job(job)
+        except Exception as exception:
+            logging.error("Backup of %s failed: %s", job.dbname, exception)
+            with self.condition:
+                self.errors.append((job.dbname, exception))
+        finally:
+            with self.condition:
+                self.running_dumps -= 1
+                self.running_stripes -= job.stripe_count
+                self.condition.notify_all()
+
+    def run(self, jobs):
+        pending = BackupScheduler.order(jobs)
+        threads = []
+        with self.condition:
+            while pending:
+                job = self.next_job(pending)
+                if job is None:
+                    self.condition.wait(BackupScheduler.WAIT_INTERVAL_SECONDS)
+                    continue
+                pending.remove(job)
+                self.running_dumps += 1
+                self.running_stripes += job.stripe_count
+                logging.debug("Start backup of %s (%d dumps, %d stripes running)", job.dbname, self.running_dumps, self.running_stripes)
+                thread = threading.Thread(target=self.run_one, args=(job,))
+                thread.daemon = True
+                threads.append(thread)
+                thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        if self.errors:
+            raise BackupException("Backup failed for {} of {} databases: {}".format(
+                len(self.errors), len(jobs),
+                "; ".join(["{}: {}".format(dbname, exception) for (dbname, exception) in self.errors])))
@@ -0,0 +1,240 @@
+# coding=utf-8
+# pylint: disable=c0301
+
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""Blob catalog module"""
+
+import logging
+import sqlite3
+import time
+
+from azure.storage.blob.models import BlobPrefix
+
+from .naming import Naming, BlobRecord
+from .stripeplanner import BackupRun
+from .bloblister import ParallelBlobLister
+
+class BlobCatalog(object):
+    """
+    Local SQLite index of the dump blobs in the backup container, with their
+    parsed names and sizes.
+
+    The agent updates the catalog for its own uploads and deletes, so queries
+    do not have to page through list_blobs. Blobs which change behind our back
+    (e.g. deleted by a lifecycle policy) are picked up when the catalog is
+    reconciled with a listing, at the latest every `reconcile_seconds`. Queries
+    for selected databases only reconcile these, listing the prefixes of each
+    database and backup type in parallel. A full reconcile first asks the
+    service for the distinct name prefixes up to the first underscore, which
+    covers databases the catalog does not know yet, and lists these in parallel.
+
+    Timestamps use Timing.time_format, so their string order is their time order.
+
+    The catalog also keeps the history of this machine's backup runs, from which
+    the StripePlanner learns the achievable throughput.
+    """
+    SCHEMA = [
+        "create table if not exists blobs ("
+        "    blob_name text primary key,"
+        "    dbname text not null,"
+        "    is_full integer not null,"
+        "    start_timestamp text not null,"
+        "    end_timestamp text not null,"
+        "    stripe_index integer not null,"
+        "    stripe_count integer not null,"
+        "    content_length integer not null)",
+        "create index if not exists blobs_by_db on blobs (dbname, is_full, end_timestamp)",
+        "create index if not exists blobs_by_end on blobs (end_timestamp)",
+        "create table if not exists state (key text primary key, value text)",
+        "create table if not exists backup_runs ("
+        "    dbname text not null,"
+        "    is_full integer not null,"
+        "    use_streaming integer not null,"
+        "    stripe_count integer not null,"
+        "    used_size integer not null,"
+        "    seconds real not null,"
+        "    end_timestamp text not null)",
+        "create index if not exists backup_runs_by_type on backup_runs (is_full, use_streaming, end_timestamp)"
+    ]
+    RUN_HISTORY = 50
+    LOCK_TIMEOUT_SECONDS = 60
+
+    def __init__(self, path, storage_client, container_name, reconcile_seconds=24 * 3600, clock=time.time):
+        self.path = path
+        self.storage_client = storage_client
+        self.container_name = container_name
+        self.reconcile_seconds = reconcile_seconds
+        self.clock = clock
+        #
+        # Full and transaction backups run in separate processes, so SQLite's
+        # file locking serializes their writes. Within a process, concurrent
+        # backup jobs share the connection under the agent's catalog lock.
+        #
+        self.connection = sqlite3.connect(path, timeout=BlobCatalog.LOCK_TIMEOUT_SECONDS, check_same_thread=False)
+        with self.connection:
+            for statement in BlobCatalog.SCHEMA:
+                self.connection.execute(statement)
+
+    def close(self):
+        self.connection.close()
+
+    def get_state(self, key):
+        row = self.connection.execute("select value from state where key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_state(self, key, value):
+        self.connection.execute("insert or replace into state (key, value) values (?, ?)", (key, str(value)))
+
+    def is_outdated(self, key):
+        last_reconciled = self.get_state(key)
+        return last_reconciled is None or self.clock() - float(last_reconciled) > self.reconcile_seconds
+
+    def is_stale(self, databases=None):
+        if self.get_state("container_name") != self.container_name:
+            return True
+        if not self.is_outdated("last_reconciled"):
+            return False
+        return databases is None or any([self.is_outdated("last_reconciled:" + dbname) for dbname in databases])
+
+    def ensure_fresh(self, databases=None):
+        if self.is_stale(databases):
+            if self.get_state("container_name") != self.container_name:
+                databases = None
+            self.reconcile(databases)
+
+    COLUMNS = "blob_name, dbname, is_full, start_timestamp, end_timestamp, stripe_index, stripe_count, content_length"
+
+    @staticmethod
+    def record(row):
+        (blob_name, dbname, is_full, start_timestamp, end_timestamp, stripe_index, stripe_count, content_length) = row
+        return BlobRecord(blob_name, dbname, bool(is_full), start_timestamp, end_timestamp, stripe_index, stripe_count, content_length)
+
+    @staticmethod
+    def prefixes(databases):
+        """
+            >>> BlobCatalog.prefixes(["AZU", "ABC"])
+            ['AZU_full_', 'AZU_tran_', 'ABC_full_', 'ABC_tran_']
+        """
+        return [Naming.construct_blobname_prefix(dbname=dbname, is_full=is_full)
+                for dbname in databases for is_full in [True, False]]
+
+    PREFIX_DELIMITER = "_"
+
+    def top_level_prefixes(self):
+        """
+        The distinct blob name prefixes up to the first underscore, e.g. 'AZU_'
+        for all dumps of database AZU. The service collapses the names, so this
+        listing is short, and the prefixes do not overlap.
+        """
+        prefixes = []
+        marker = None
+        while True:
+            results = self.storage_client.list_blobs(
+                container_name=self.container_name, delimiter=BlobCatalog.PREFIX_DELIMITER, marker=marker)
+            prefixes.extend([item.name for item in results if isinstance(item, BlobPrefix)])
+            if not results.next_marker:
+                return prefixes
+            marker = results.next_marker
+
+    def reconcile(self, databases=None):
+        """Replace the catalog's content for the given databases (or all) with a listing of the container."""
+        logging.info("Reconciling blob catalog %s with container %s (databases %s)",
+                     self.path, self.container_name, databases or "all")
+        if databases is None:
+            prefixes = self.top_level_prefixes()
+        else:
+            prefixes = BlobCatalog.prefixes(databases)
+        lister = ParallelBlobLister(
+            storage_client=self.storage_client, container_name=self.container_name,
+            prefixes=prefixes)
+        #
+        # Pages are parsed as they arrive, from all prefixes, and written to a
+        # temporary staging table, one page per transaction. So neither does the
+        # listing, which can take minutes on large containers, sit in memory, nor
+        # does it lock out the other backup process. Only the swap at the end
+        # writes to the catalog file.
+        #
+        self.connection.execute("drop table if exists temp.staged_blobs")
+        self.connection.execute("create temp table staged_blobs as select * from blobs where 0")
+        count = 0
+        for page in lister.pages_as_they_arrive():
+            batch = Naming.parse_blobnames([blob.name for blob in page],
+                                           [blob.properties.content_length for blob in page])
+            rows = [row for row in batch.rows()
+                    if row[0].endswith(".cdmp") and (databases is None or row[1] in databases)]
+            with self.connection:
+                self.connection.executemany("insert into staged_blobs values (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            count += len(rows)
+
+        with self.connection:
+            if databases is None:
+                self.connection.execute("delete from blobs")
+            else:
+                self.connection.executemany("delete from blobs where dbname = ?", [(dbname,) for dbname in databases])
+            self.connection.execute("insert or replace into blobs select * from staged_blobs")
+
+            now = self.clock()
+            if databases is None:
+                self.connection.execute("delete from state where key like 'last_reconciled:%'")
+                self.set_state("container_name", self.container_name)
+                self.set_state("last_reconciled", now)
+            else:
+                for dbname in databases:
+                    self.set_state("last_reconciled:" + dbname, now)
+        self.connection.execute("drop table staged_blobs")
+        logging.debug("Blob catalog reconciled %d dump blobs", count)
+
+    def add(self, record):
+        """Record a BlobRecord which we uploaded."""
+        if not record.blob_name.endswith(".cdmp"):
+            return
+        with self.connection:
+            self.connection.execute("insert or replace into blobs values (?, ?, ?, ?, ?, ?, ?, ?)", record.as_tuple())
+
+    def remove(self, blob_name):
+        """Forget a blob which we deleted."""
+        with self.connection:
+            self.connection.execute("delete from blobs where blob_name = ?", (blob_name,))
+
+    def blobs(self, databases=None, is_full=None):
+        """BlobRecords of the selected dumps, ordered by end timestamp."""
+        self.ensure_fresh(databases)
+        query = "select " + BlobCatalog.COLUMNS + " from blobs"
+        conditions = []
+        args = []
+        if databases is not None:
+            conditions.append("dbname in ({})".format(", ".join("?" * len(databases))))
+            args.extend(databases)
+        if is_full is not None:
+            conditions.append("is_full = ?")
+            args.append(int(is_full))
+        if conditions:
+            query += " where " + " and ".join(conditions)
+        query += " order by end_timestamp, blob_name"
+        return [BlobCatalog.record(row) for row in self.connection.execute(query, args)]
+
+    def blobs_ending_before(self, end_timestamp, databases=None):
+        """BlobRecords of the dumps which ended before `end_timestamp`, i.e. the prune set."""
+        self.ensure_fresh(databases)
+        query = "select " + BlobCatalog.COLUMNS + " from blobs where end_timestamp < ?"
+        args = [end_timestamp]
+        if databases is not None:
+            query += " and dbname in ({})".format(", ".join("?" * len(databases)))
+            args.extend(databases)
+        return [BlobCatalog.record(row) for row in self.connection.execute(query + " order by end_timestamp", args)]
+
+    def add_run(self, run):
+        """Record a completed BackupRun."""
+        with self.connection:
+            self.connection.execute("insert into backup_runs values (?, ?, ?, ?, ?, ?, ?)", run.as_tuple())
+
+    def runs(self, is_full, use_streaming, limit=RUN_HISTORY):
+        """The latest BackupRuns of the given kind, newest first."""
+        rows = self.connection.execute(
+            "select dbname, is_full, use_streaming, stripe_count, used_size, seconds, end_timestamp from backup_runs"
+            " where is_full = ? and use_streaming = ? order by end_timestamp desc limit ?",
+            (int(is_full), int(use_streaming), limit))
+        return [BackupRun(dbname=row[0], is_full=bool(row[1]), use_streaming=bool(row[2]), stripe_count=row[3],
+                          used_size=row[4], seconds=row[5], end_timestamp=row[6]) for row in rows]
@@ -0,0 +1,172 @@
+# coding=utf-8
+# pylint: disable=c0301
+
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""Blob downloader module"""
+
+import os
+import time
+import logging
+import threading
+import Queue
+
+from .backupexception import BackupException
+from .cancellation import CancellationToken
+
+class FileDownload(object):
+    """A blob which is downloaded into a preallocated local file, range by range."""
+    def __init__(self, blob_name, file_path, size):
+        self.blob_name = blob_name
+        self.file_path = file_path
+        self.size = size
+        self.remaining_ranges = 0
+        self.bytes_done = 0
+        self.start_time = None
+        self.lock = threading.Lock()
+
+    def preallocate(self):
+        with open(self.file_path, "wb") as stream:
+            stream.truncate(self.size)
+
+    @staticmethod
+    def ranges(size, range_size):
+        """
+        (offset, length) of the ranged reads for a blob.
+
+            >>> FileDownload.ranges(25, 10)
+            [(0, 10), (10, 10), (20, 5)]
+            >>> FileDownload.ranges(0, 10)
+            []
+        """
+        return [(offset, min(range_size, size - offset)) for offset in range(0, size, range_size)]
+
+    def pwrite(self, offset, data):
+        """
+        Write `data` at `offset`. Python 2 has no os.pwrite, so each range gets
+        its own descriptor, and the seek does not race with other threads.
+        """
+        file_descriptor = os.open(self.file_path, os.O_WRONLY)
+        try:
+            os.lseek(file_descriptor, offset, os.SEEK_SET)
+            view = memoryview(data)
+            written = 0
+            while written < len(view):
+                written += os.write(file_descriptor, view[written:])
+        finally:
+            os.close(file_descriptor)
+
+    def range_done(self, length):
+        """Account for a written range. Returns True for the file's last range."""
+        with self.lock:
+            self.bytes_done += length
+            self.remaining_ranges -= 1
+            return self.remaining_ranges == 0
+
+    def throughput(self):
+        """Bytes per second since the first range started."""
+        duration = max(time.time() - self.start_time, 0.001)
+        return self.bytes_done / duration
+
+class RangeDownloadThread(threading.Thread):
+    """Takes ranges from the queue of a BlobDownloader, and writes them into their files."""
+    def __init__(self, downloader):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.downloader = downloader
+
+    def run(self):
+        while not (self.downloader.failed.is_set() or self.downloader.cancellation_token.is_cancelled()):
+            try:
+                (download, offset, length) = self.downloader.queue.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                self.downloader.download_range(download, offset, length)
+            except Exception as exception:
+                logging.fatal("Download of %s/%s bytes %d-%d failed: %s", self.downloader.container_name,
+                              download.blob_name, offset, offset + length - 1, exception)
+                self.downloader.fail(download, exception)
+                return
+
+class BlobDownloader(object):
+    """
+    Downloads several blobs, e.g. all stripes of a restore chain, into local files.
+
+    Blobs are split into ranges of `range_size` bytes, which are fetched with
+    ranged GETs on `max_connections` threads, shared by all files, and written
+    into preallocated files at their offset. The ranges are queued file by
+    file, so the first files of the chain complete first.
+    """
+    RANGE_SIZE = 32 * 1024 * 1024
+    MAX_CONNECTIONS = 8
+
+    def __init__(self, storage_client, container_name, max_connections=MAX_CONNECTIONS,
+                 range_size=RANGE_SIZE, on_file_downloaded=None, cancellation_token=None):
+        self.storage_client = storage_client
+        self.container_name = container_name
+        self.max_connections = max(1, int(max_connections))
+        self.range_size = range_size
+        self.on_file_downloaded = on_file_downloaded
+        self.cancellation_token = cancellation_token or CancellationToken()
+        self.queue = Queue.Queue()
+        self.failed = threading.Event()
+        self.failures = []
+        self.failures_lock = threading.Lock()
+
+    def download_range(self, download, offset, length):
+        with download.lock:
+            if download.start_time is None:
+                download.start_time = time.time()
+        #
+        # Ranges are not larger than the SDK's single GET size, so one connection suffices.
+        #
+        blob = self.storage_client.get_blob_to_bytes(
+            container_name=self.container_name, blob_name=download.blob_name,
+            start_range=offset, end_range=offset + length - 1, max_connections=1)
+        if len(blob.content) != length:
+            raise BackupException("Received {} bytes instead of {} for {} at offset {}".format(
+                len(blob.content), length, download.blob_name, offset))
+        download.pwrite(offset, blob.content)
+        if download.range_done(length):
+            self.file_done(download)
+        else:
+            logging.debug("Downloading %s: %d of %d bytes (%.1f MB/s)", download.file_path,
+                          download.bytes_done, download.size, download.throughput() / (1024 * 1024))
+
+    def file_done(self, download):
+        logging.info("Downloaded %s/%s to %s (%d bytes, %.1f MB/s)", self.container_name, download.blob_name,
+                     download.file_path, download.size, download.throughput() / (1024 * 1024))
+        if self.on_file_downloaded is not None:
+            self.on_file_downloaded(download)
+
+    def fail(self, download, exception):
+        with self.failures_lock:
+            self.failures.append((download.file_path, exception))
+        self.failed.set()
+
+    def download(self, files):
+        """Download the given (blob_name, file_path, size) triples. Raises a BackupException if any of them failed."""
+        range_count = 0
+        for (blob_name, file_path, size) in files:
+            download = FileDownload(blob_name=blob_name, file_path=file_path, size=size)
+            download.preallocate()
+            ranges = FileDownload.ranges(size, self.range_size)
+            download.remaining_ranges = len(ranges)
+            if not ranges:
+                download.start_time = time.time()
+                self.file_done(download)
+            for (offset, length) in ranges:
+                self.queue.put((download, offset, length))
+            range_count += len(ranges)
+
+        threads = [RangeDownloadThread(self) for _ in range(min(self.max_connections, range_count))]
+        _ = [t.start() for t in threads]
+        _ = [t.join() for t in threads]
+
+        if self.failures:
+            raise BackupException("Download failed for {}".format(
+                ", ".join(sorted(set([file_path for (file_path, _exception) in self.failures])))))
+        if not self.queue.empty():
+            self.cancellation_token.raise_if_cancelled()
@@ -0,0 +1,105 @@
+# coding=utf-8
+# pylint: disable=c0301
+
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""Blob lister module"""
+
+import logging
+import threading
+import Queue
+
+class PrefixListingThread(threading.Thread):
+    """Takes prefixes from the lister's queue, and pages through list_blobs for each of them."""
+    DONE = object()
+
+    def __init__(self, lister):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.lister = lister
+
+    def run(self):
+        while not self.lister.stopped.is_set():
+            try:
+                prefix = self.lister.prefixes.get_nowait()
+            except Queue.Empty:
+                break
+            try:
+                marker = None
+                while not self.lister.stopped.is_set():
+                    results = self.lister.storage_client.list_blobs(
+                        container_name=self.lister.container_name, prefix=prefix, marker=marker)
+                    self.lister.put(list(results))
+                    if results.next_marker:
+                        marker = results.next_marker
+                    else:
+                        break
+            except Exception as exception:
+                logging.error("Listing %s/%s* failed: %s", self.lister.container_name, prefix, exception)
+                self.lister.put(exception)
+                return
+        self.lister.put(PrefixListingThread.DONE)
+
+class ParallelBlobLister(object):
+    """
+    Lists the blobs under several prefixes, e.g. one per database and backup type,
+    from a bounded number of threads. The pages of all prefixes are merged into
+    one stream, in the order they arrive.
+
+    The prefixes must not overlap, otherwise blobs are reported more than once.
+    """
+    MAX_CONNECTIONS = 8
+    MAX_QUEUED_PAGES = 16
+
+    def __init__(self, storage_client, container_name, prefixes, max_connections=MAX_CONNECTIONS):
+        self.storage_client = storage_client
+        self.container_name = container_name
+        self.prefixes = Queue.Queue()
+        for prefix in prefixes:
+            self.prefixes.put(prefix)
+        self.thread_count = max(1, min(max_connections, len(prefixes)))
+        #
+        # Bounded, so that fast listings wait for a slow consumer instead of
+        # buffering a huge container in memory.
+        #
+        self.pages = Queue.Queue(maxsize=ParallelBlobLister.MAX_QUEUED_PAGES)
+        self.stopped = threading.Event()
+
+    QUEUE_POLL_INTERVAL_SECONDS = 1
+
+    def put(self, item):
+        """Hand a page to the consumer. Gives up once the consumer stopped."""
+        while not self.stopped.is_set():
+            try:
+                self.pages.put(item, timeout=ParallelBlobLister.QUEUE_POLL_INTERVAL_SECONDS)
+                return
+            except Queue.Full:
+                continue
+
+    def pages_as_they_arrive(self):
+        """Generator over the pages (lists of blobs). Raises the first listing error."""
+        threads = [PrefixListingThread(self) for _ in range(self.thread_count)]
+        _ = [t.start() for t in threads]
+        running = len(threads)
+        try:
+            while running > 0:
+                page = self.pages.get()
+                if page is PrefixListingThread.DONE:
+                    running -= 1
+                elif isinstance(page, Exception):
+                    raise page
+                else:
+                    yield page
+        finally:
+            self.stop()
+
+    def blobs(self):
+        """Generator over all blobs of all prefixes."""
+        for page in self.pages_as_they_arrive():
+            for blob in page:
+                yield blob
+
+    def stop(self):
+        """Stop the listing threads. Threads waiting for the consumer give up within QUEUE_POLL_INTERVAL_SECONDS."""
+        self.stopped.set()
@@ -0,0 +1,88 @@
+# coding=utf-8
+# pylint: disable=c0301
+
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""Block journal module"""
+
+import os
+import json
+import logging
+import threading
+
+class BlockJournal(object):
+    """
+    Records the block IDs which have been staged for a file upload, so that an
+    interrupted upload can be resumed. The journal lives next to the dump file.
+    The first line is a JSON header describing the upload, and each following
+    line is the ID of a block which the service acknowledged.
+    """
+    SUFFIX = ".journal"
+
+    def __init__(self, file_path):
+        self.path = BlockJournal.journal_path(file_path)
+        self.lock = threading.Lock()
+        self.journal_file = None
+
+    @staticmethod
+    def journal_path(file_path):
+        """
+            >>> BlockJournal.journal_path("/tmp/AZU_full_20180629_124500--20180629_131234_S001-002.cdmp")
+            '/tmp/AZU_full_20180629_124500--20180629_131234_S001-002.cdmp.journal'
+        """
+        return file_path + BlockJournal.SUFFIX
+
+    @staticmethod
+    def header(blob_name, file_size, block_size):
+        return {"blob_name": blob_name, "file_size": file_size, "block_size": block_size}
+
+    def load(self, blob_name, file_size):
+        """
+        Return the header and the set of block IDs of a previous attempt,
+        or (None, empty set) if there is no usable journal.
+        """
+        if not os.path.exists(self.path):
+            return (None, set())
+
+        try:
+            with open(self.path, "rt") as journal_file:
+                lines = journal_file.read().split("\n")
+            header = json.loads(lines[0])
+        except Exception as exception:
+            logging.warning("Ignoring unreadable journal %s: %s", self.path, exception)
+            return (None, set())
+
+        if header.get("blob_name") != blob_name or header.get("file_size") != file_size:
+            logging.warning("Ignoring journal %s, it belongs to a different upload", self.path)
+            return (None, set())
+
+        #
+        # A crash can leave a partially written last line, which is ignored.
+        #
+        block_ids = set([line for line in lines[1:-1] if line])
+        return (header, block_ids)
+
+    def open(self, header, block_ids):
+        """(Re)write the journal with the given header and already staged blocks, and keep it open for appending."""
+        with open(self.path, "wt") as journal_file:
+            journal_file.write(json.dumps(header) + "\n")
+            for block_id in sorted(block_ids):
+                journal_file.write(block_id + "\n")
+        self.journal_file = open(self.path, "at")
+
+    def record(self, block_id):
+        """Append a staged block. Called from the upload connections."""
+        with self.lock:
+            self.journal_file.write(block_id + "\n")
+            self.journal_file.flush()
+
+    def close(self):
+        if self.journal_file is not None:
+            self.journal_file.close()
+            self.journal_file = None
+
+    def remove(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,134 @@
+# coding=utf-8
+# pylint: disable=c0301
+
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""Block sizer module"""
+
+import logging
+import threading
+import time
+
+class BlockSizer(object):
+    """
+    Picks the block size for the stripes of one backup, and grows it while uploading.
+
+    A block blob holds at most MAX_BLOCKS blocks, so the block size must be large
+    enough for the stripe. The expected size is only an estimate, so the block
+    size also doubles each time a stripe has used up half of its remaining blocks.
+    On fast links, small blocks mean many requests, so the block size also grows
+    until a block takes about TARGET_REQUEST_SECONDS per connection at the
+    throughput observed so far.
+
+    Block sizes are power-of-two multiples of the configured minimum, capped at
+    MAX_BLOCK_SIZE. The blocks of one blob may have different sizes.
+    """
+    MAX_BLOCKS = 50000
+    MAX_BLOCK_SIZE = 100 * 1024 * 1024
+    HEADROOM = 2
+    TARGET_REQUEST_SECONDS = 2
+    MIN_MEASURE_SECONDS = 10
+
+    def __init__(self, min_block_size, expected_stripe_size=None, connections=1,
+                 buffer_pool=None, max_throughput_block_size=MAX_BLOCK_SIZE, clock=time.time):
+        self.min_block_size = min_block_size
+        self.connections = max(1, connections)
+        self.buffer_pool = buffer_pool
+        self.max_throughput_block_size = max(min_block_size, max_throughput_block_size)
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.start_time = None
+        self.total_bytes = 0
+        self.initial_block_size = BlockSizer.block_size_for(expected_stripe_size, min_block_size)
+        self.block_size = self.initial_block_size
+        if self.buffer_pool is not None:
+            self.buffer_pool.resize(self.block_size)
+
+    @staticmethod
+    def grow(block_size, minimum):
+        """
+        The smallest power-of-two multiple of `block_size` which is at least `minimum`.
+
+            >>> BlockSizer.grow(4, 9)
+            16
+            >>> BlockSizer.grow(4, 4)
+            4
+            >>> BlockSizer.grow(64 * 1024 * 1024, 1024**3) // (1024 * 1024)
+            100
+        """
+        size = block_size
+        while size < minimum and size < BlockSizer.MAX_BLOCK_SIZE:
+            size *= 2
+        return max(block_size, min(size, BlockSizer.MAX_BLOCK_SIZE))
+
+    @staticmethod
+    def block_size_for(expected_size, min_block_size):
+        """
+        The initial block size for a stripe of the expected size.
+
+            >>> BlockSizer.block_size_for(None, 4 * 1024 * 1024) // (1024 * 1024)
+            4
+            >>> BlockSizer.block_size_for(50 * 1024**3, 4 * 1024 * 1024) // (1024 * 1024)
+            4
+            >>> BlockSizer.block_size_for(500 * 1024**3, 4 * 1024 * 1024) // (1024 * 1024)
+            32
+        """
+        if not expected_size:
+            return min_block_size
+        required = (expected_size * BlockSizer.HEADROOM + BlockSizer.MAX_BLOCKS - 1) // BlockSizer.MAX_BLOCKS
+        return BlockSizer.grow(min_block_size, required)
+
+    @staticmethod
+    def block_size_for_blocks_used(block_size, blocks_used):
+        """
+        Double the block size each time half of the remaining blocks are used.
+
+            >>> BlockSizer.block_size_for_blocks_used(4, 24999)
+            4
+            >>> BlockSizer.block_size_for_blocks_used(4, 25000)
+            8
+            >>> BlockSizer.block_size_for_blocks_used(4, 37500)
+            16
+        """
+        required = block_size
+        threshold = BlockSizer.MAX_BLOCKS // 2
+        while blocks_used >= threshold and required < BlockSizer.MAX_BLOCK_SIZE:
+            required *= 2
+            threshold += (BlockSizer.MAX_BLOCKS - threshold) // 2
+        return BlockSizer.grow(block_size, required)
+
+    def block_size_for_throughput(self, now):
+        if self.start_time is None or now - self.start_time < BlockSizer.MIN_MEASURE_SECONDS:
+            return self.block_size
+        throughput = self.total_bytes / (now - self.start_time)
+        required = int(throughput * BlockSizer.TARGET_REQUEST_SECONDS / self.connections)
+        return min(BlockSizer.grow(self.block_size, required),
+                   max(self.block_size, self.max_throughput_block_size))
+
+    def update(self, length, blocks_used):
+        """
+        Record a block of `length` bytes, which was the `blocks_used`-th block of
+        its stripe, and return the size for the next block.
+        """
+        with self.lock:
+            now = self.clock()
+            #
+            # The clock starts with the first block, so that block itself is not
+            # counted: it may have waited for ASE to start dumping.
+            #
+            if self.start_time is None:
+                self.start_time = now
+            else:
+                self.total_bytes += length
+
+            block_size = max(self.block_size_for_throughput(now),
+                             BlockSizer.block_size_for_blocks_used(self.initial_block_size, blocks_used))
+            if block_size > self.block_size:
+                logging.info("Growing upload block size from %d MB to %d MB (%d blocks used, %d MB/s)",
+                             self.block_size // (1024 * 1024), block_size // (1024 * 1024), blocks_used,
+                             self.total_bytes // max(1, now - self.start_time) // (1024 * 1024))
+                self.block_size = block_size
+                if self.buffer_pool is not None:
+                    self.buffer_pool.resize(block_size)
+            return self.block_size
@@ -0,0 +1,261 @@
+# coding=utf-8
+# pylint: disable=c0301
+
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""Block uploader module"""
+
+import logging
+import threading
+import hashlib
+import Queue
+
+from azure.storage.blob.models import BlobBlock
+from .bufferpool import BlockReader
+from .cancellation import CancellationToken
+
+class BlockUploadWorker(threading.Thread):
+    """Takes blocks from the uploader's queue and stages them via put_block."""
+    def __init__(self, uploader):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.uploader = uploader
+
+    def run(self):
+        while True:
+            item = self.uploader.queue.get()
+            if item is None:
+                self.uploader.queue.task_done()
+                return
+
+            (block_id, data, release) = item
+            try:
+                #
+                # After a failure, keep draining the queue so that the
+                # producer never blocks on a queue nobody reads from.
+                #
+                if self.uploader.exception is None:
+                    self.uploader.cancellation_token.raise_if_cancelled()
+                    if self.uploader.connection_slots is not None:
+                        with self.uploader.connection_slots:
+                            self.uploader.stage_block(block_id=block_id, data=data)
+                    else:
+                        self.uploader.stage_block(block_id=block_id, data=data)
+                    if self.uploader.on_block_staged is not None:
+                        self.uploader.on_block_staged(block_id)
+            except Exception as exception:
+                logging.fatal("Exception during upload of block to %s/%s: %s",
+                              self.uploader.container_name, self.uploader.blob_name, exception)
+                self.uploader.set_exception(exception)
+            finally:
+                if release is not None:
+                    release()
+                self.uploader.queue.task_done()
+
+class SharedRelease(object):
+    """Invokes `release` once all `count` consumers of a buffer are done with it."""
+    def __init__(self, release, count):
+        self.release = release
+        self.count = count
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        with self.lock:
+            self.count -= 1
+            done = self.count == 0
+        if done and self.release is not None:
+            self.release()
+
+class DigestThread(threading.Thread):
+    """
+    Computes the SHA-256 of a whole blob from its blocks, in order. Runs on its
+    own thread with an unbounded queue, so hashing never throttles the reader;
+    memory is bounded by the buffer pool instead.
+    """
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.queue = Queue.Queue()
+        self.sha256 = hashlib.sha256()
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            (data, release) = item
+            try:
+                self.sha256.update(data)
+            finally:
+                if release is not None:
+                    release()
+
+    def put(self, data, release=None):
+        self.queue.put((data, release))
+
+    def finish(self):
+        self.queue.put(None)
+        self.join()
+        return self.sha256.hexdigest()
+
+class BlockUploader(object):
+    """Uploads a block blob by staging blocks from several connections and committing the block list."""
+    def __init__(self, storage_client, container_name, blob_name, max_connections=4, max_queued_blocks=None,
+                 cancellation_token=None, block_timeout=None, compute_digest=True, on_block_staged=None,
+                 connection_slots=None):
+        self.storage_client = storage_client
+        self.container_name = container_name
+        self.blob_name = blob_name
+        self.max_connections = max(1, int(max_connections))
+        if max_queued_blocks is None:
+            max_queued_blocks = 2 * self.max_connections
+        self.queue = Queue.Queue(maxsize=max_queued_blocks)
+        self.block_ids = []
+        self.exception = None
+        self.exception_lock = threading.Lock()
+        self.workers = []
+        self.cancellation_token = cancellation_token or CancellationToken()
+        self.block_timeout = block_timeout
+        self.digest_thread = DigestThread() if compute_digest else None
+        self.sha256 = None
+        self.total_bytes = 0
+        self.on_block_staged = on_block_staged
+        #
+        # Optional semaphore shared by several uploaders, which caps the
+        # number of concurrent put_block requests across all of them.
+        #
+        self.connection_slots = connection_slots
+
+    @staticmethod
+    def block_id(index):
+        """
+        Block IDs of a blob must all have the same length. The SDK base64-encodes them.
+
+            >>> BlockUploader.block_id(17)
+            '00000017'
+        """
+        return "{:08d}".format(index)
+
+    def set_exception(self, exception):
+        with self.exception_lock:
+            if self.exception is None:
+                self.exception = exception
+
+    def get_exception(self):
+        return self.exception
+
+    def start(self):
+        self.workers = [BlockUploadWorker(self) for _ in range(self.max_connections)]
+        _ = [w.start() for w in self.workers]
+        if self.digest_thread is not None:
+            self.digest_thread.start()
+        logging.debug("Started %d upload connections for %s/%s",
+                      len(self.workers), self.container_name, self.blob_name)
+
+    MAX_ATTEMPTS = 3
+
+    def stage_block(self, block_id, data):
+        """
+        Upload a single block. A memoryview is sent through a BlockReader. The
+        SDK's retry policy cannot rewind a stream body, so each attempt gets a
+        fresh reader. The SDK computes the block's MD5 on this worker thread,
+        and the service verifies it.
+        """
+        attempt = 1
+        while True:
+            try:
+                block = BlockReader(data) if isinstance(data, memoryview) else data
+                self.storage_client.put_block(
+                    container_name=self.container_name, blob_name=self.blob_name,
+                    block=block, block_id=block_id, validate_content=True,
+                    timeout=self.block_timeout)
+                return
+            except Exception as exception:
+                if attempt >= BlockUploader.MAX_ATTEMPTS or self.cancellation_token.is_cancelled():
+                    raise
+                logging.warning("Attempt %d to upload block %s to %s/%s failed: %s",
+                                attempt, block_id, self.container_name, self.blob_name, exception)
+                attempt += 1
+
+    QUEUE_POLL_INTERVAL_SECONDS = 1
+
+    def put(self, data, release=None, already_staged=False):
+        """
+        Enqueue the next block. Blocks while the queue is full. The optional
+        `release` callable is invoked once the block is no longer needed.
+
+        A block which has been staged by an earlier, interrupted attempt is
+        only added to the digest and the block list, but not uploaded again.
+        """
+        block_id = BlockUploader.block_id(len(self.block_ids))
+        if already_staged:
+            self.block_ids.append(block_id)
+            self.total_bytes += len(data)
+            if self.digest_thread is not None:
+                self.digest_thread.put(data, release)
+            elif release is not None:
+                release()
+            return
+
+        if self.digest_thread is not None:
+            shared_release = SharedRelease(release, 2)
+        else:
+            shared_release = release
+        try:
+            while True:
+                if self.exception is not None:
+                    raise self.exception
+                self.cancellation_token.raise_if_cancelled()
+                try:
+                    self.queue.put((block_id, data, shared_release), timeout=BlockUploader.QUEUE_POLL_INTERVAL_SECONDS)
+                    break
+                except Queue.Full:
+                    continue
+        except Exception:
+            if release is not None:
+                release()
+            raise
+        self.block_ids.append(block_id)
+        self.total_bytes += len(data)
+        if self.digest_thread is not None:
+            self.digest_thread.put(data, shared_release)
+
+    def stop_workers(self):
+        _ = [self.queue.put(None) for _ in self.workers]
+        _ = [w.join() for w in self.workers]
+        self.workers = []
+
+    def stop_digest(self):
+        if self.digest_thread is not None and self.digest_thread.is_alive():
+            self.sha256 = self.digest_thread.finish()
+
+    def commit(self):
+        """
+        Wait until all blocks are staged, then commit the block list. The blob's
+        SHA-256 is stored as metadata, so that a later verify or restore can check it.
+        """
+        self.stop_workers()
+        self.stop_digest()
+        if self.exception is not None:
+            raise self.exception
+        self.cancellation_token.raise_if_cancelled()
+
+        metadata = None
+        if self.sha256 is not None:
+            metadata = {BlockUploader.SHA256_METADATA_KEY: self.sha256}
+
+        self.storage_client.put_block_list(
+            container_name=self.container_name, blob_name=self.blob_name,
+            block_list=[BlobBlock(id=block_id) for block_id in self.block_ids],
+            metadata=metadata)
+        logging.debug("Committed %d blocks (%d bytes, sha256 %s) to %s/%s",
+                      len(self.block_ids), self.total_bytes, self.sha256, self.container_name, self.blob_name)
+
+    SHA256_METADATA_KEY = "sha256"
+
+    def abort(self):
+        """Stop the upload connections without committing. Staged blocks are garbage-collected by the service."""
+        self.set_exception(Exception("Upload to {}/{} aborted".format(self.container_name, self.blob_name)))
+        self.stop_workers()
+        self.stop_digest()
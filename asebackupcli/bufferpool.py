@@ -0,0 +1,132 @@
+# coding=utf-8
+# pylint: disable=c0301
+
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""Buffer pool module"""
+
+import logging
+import os
+import threading
+
+class BufferPool(object):
+    """
+    Block buffers shared by all stripe readers of a run. Buffers are allocated
+    on demand until the memory budget is reached, and recycled afterwards.
+    When the budget is exhausted, readers wait for a buffer to be released,
+    i.e. they stop draining their pipe, so ASE is throttled.
+    """
+    def __init__(self, buffer_size, memory_budget):
+        self.buffer_size = buffer_size
+        self.memory_budget = memory_budget
+        self.free = []
+        self.condition = threading.Condition()
+        self.allocated = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.waits = 0
+
+    WAIT_INTERVAL_SECONDS = 1
+
+    def acquire(self, cancellation_token=None):
+        """Take a buffer. Blocks while the memory budget is exhausted."""
+        with self.condition:
+            if not self.free and not self.can_allocate():
+                self.waits += 1
+                logging.debug("Memory budget exhausted (%s), pausing pipe read", self.usage())
+                while not self.free and not self.can_allocate():
+                    if cancellation_token is not None:
+                        cancellation_token.raise_if_cancelled()
+                    self.condition.wait(BufferPool.WAIT_INTERVAL_SECONDS)
+
+            while self.free and len(self.free[-1]) != self.buffer_size:
+                self.allocated -= len(self.free.pop())
+            if self.free:
+                buffer = self.free.pop()
+            else:
+                buffer = bytearray(self.buffer_size)
+                self.allocated += len(buffer)
+
+            self.in_use += len(buffer)
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+            return buffer
+
+    def can_allocate(self):
+        # A single buffer is always allowed, even if it exceeds the budget.
+        return self.allocated == 0 or self.allocated + self.buffer_size <= self.memory_budget
+
+    def release(self, buffer):
+        with self.condition:
+            self.in_use -= len(buffer)
+            if len(buffer) == self.buffer_size:
+                self.free.append(buffer)
+            else:
+                # Allocated before a resize(), so it is dropped instead of recycled.
+                self.allocated -= len(buffer)
+            self.condition.notify_all()
+
+    def resize(self, buffer_size):
+        """
+        Change the size of the buffers handed out from now on. Buffers of the old
+        size are dropped as they come back, so the memory budget still holds.
+
+            >>> pool = BufferPool(buffer_size=1024*1024, memory_budget=4*1024*1024)
+            >>> b1 = pool.acquire()
+            >>> pool.resize(2*1024*1024)
+            >>> pool.release(b1)
+            >>> len(pool.acquire())
+            2097152
+            >>> pool.usage()
+            'current 2 MB, peak 2 MB, allocated 2 MB, budget 4 MB, 0 pauses'
+        """
+        with self.condition:
+            if buffer_size == self.buffer_size:
+                return
+            self.buffer_size = buffer_size
+            while self.free:
+                self.allocated -= len(self.free.pop())
+            self.condition.notify_all()
+
+    def usage(self):
+        """
+            >>> pool = BufferPool(buffer_size=1024*1024, memory_budget=4*1024*1024)
+            >>> b1, b2 = pool.acquire(), pool.acquire()
+            >>> pool.release(b1)
+            >>> pool.usage()
+            'current 1 MB, peak 2 MB, allocated 2 MB, budget 4 MB, 0 pauses'
+        """
+        mb = lambda x: x // (1024 * 1024)
+        return "current {} MB, peak {} MB, allocated {} MB, budget {} MB, {} pauses".format(
+            mb(self.in_use), mb(self.peak_in_use), mb(self.allocated), mb(self.memory_budget), self.waits)
+
+class BlockReader(object):
+    """Read-only file-like view on a filled part of a pooled buffer, without copying it."""
+    def __init__(self, view):
+        self.view = view
+        self.position = 0
+
+    def __len__(self):
+        return len(self.view)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            end = len(self.view)
+        else:
+            end = min(len(self.view), self.position + size)
+        data = self.view[self.position:end].tobytes()
+        self.position = end
+        return data
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            self.position = offset
+        elif whence == os.SEEK_CUR:
+            self.position += offset
+        elif whence == os.SEEK_END:
+            self.position = len(self.view) + offset
+        self.position = max(0, min(self.position, len(self.view)))
+        return self.position
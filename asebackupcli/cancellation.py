@@ -0,0 +1,68 @@
+# coding=utf-8
+# pylint: disable=c0301
+
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""Cancellation module"""
+
+import threading
+import time
+
+from .backupexception import BackupException
+
+class CancellationToken(object):
+    """
+    Cooperative cancellation for long-running upload loops, with an optional overall deadline.
+    A token with a `parent` is also cancelled by it, but cancelling the child leaves the parent alone.
+
+        >>> parent = CancellationToken()
+        >>> (first, second) = (CancellationToken(parent=parent), CancellationToken(parent=parent))
+        >>> first.cancel()
+        >>> (first.is_cancelled(), second.is_cancelled(), parent.is_cancelled())
+        (True, False, False)
+        >>> parent.cancel()
+        >>> second.is_cancelled()
+        True
+    """
+    def __init__(self, timeout_seconds=None, parent=None):
+        self.event = threading.Event()
+        self.parent = parent
+        self.deadline = None
+        if timeout_seconds is not None:
+            self.deadline = time.time() + timeout_seconds
+
+    def cancel(self):
+        self.event.set()
+
+    def is_cancelled(self):
+        """
+            >>> token = CancellationToken()
+            >>> token.is_cancelled()
+            False
+            >>> token.cancel()
+            >>> token.is_cancelled()
+            True
+            >>> CancellationToken(timeout_seconds=-1).is_cancelled()
+            True
+        """
+        return self.event.is_set() or self.deadline_exceeded() or (self.parent is not None and self.parent.is_cancelled())
+
+    def deadline_exceeded(self):
+        if self.parent is not None and self.parent.deadline_exceeded():
+            return True
+        return self.deadline is not None and time.time() > self.deadline
+
+    def remaining_seconds(self):
+        """Seconds until the deadline, or None when there is no deadline."""
+        remaining = None if self.parent is None else self.parent.remaining_seconds()
+        if self.deadline is None:
+            return remaining
+        own = max(0, self.deadline - time.time())
+        return own if remaining is None else min(own, remaining)
+
+    def raise_if_cancelled(self):
+        if self.deadline_exceeded():
+            raise BackupException("Deadline exceeded")
+        if self.is_cancelled():
+            raise BackupException("Operation cancelled")
@@ -0,0 +1,100 @@
+# coding=utf-8
+# pylint: disable=c0301
+
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""Credential cache module"""
+
+import logging
+import threading
+import time
+
+class CredentialCache(object):
+    """
+    Holds a secret, e.g. the database password, in memory for `ttl_seconds`.
+
+    Within the last `refresh_fraction` of the TTL, a read still returns the
+    cached value, but starts a refresh in the background, so callers only
+    wait for `fetch` on the first read, or after the value expired. The value
+    is never written to disk.
+
+        >>> clock = [0]
+        >>> values = iter(["secret1", "secret2"])
+        >>> cache = CredentialCache(fetch=lambda: next(values), ttl_seconds=100, clock=lambda: clock[0], background=False)
+        >>> cache.get()
+        'secret1'
+        >>> clock[0] = 95
+        >>> cache.get()
+        'secret1'
+        >>> cache.get()
+        'secret2'
+    """
+    REFRESH_FRACTION = 0.2
+
+    def __init__(self, fetch, ttl_seconds, clock=time.time, refresh_fraction=REFRESH_FRACTION, background=True):
+        self.fetch = fetch
+        self.ttl_seconds = ttl_seconds
+        self.clock = clock
+        self.refresh_fraction = refresh_fraction
+        self.background = background
+        self.value = None
+        self.expires = None
+        self.refreshing = False
+        self.lock = threading.Lock()
+        self.fetch_lock = threading.Lock()
+
+    def refresh(self):
+        value = self.fetch()
+        with self.lock:
+            self.value = value
+            self.expires = self.clock() + self.ttl_seconds
+            self.refreshing = False
+        return value
+
+    def refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception as exception:
+            logging.warning("Background refresh of credential failed: %s", exception)
+            with self.lock:
+                self.refreshing = False
+
+    def current(self):
+        """The cached value while it is valid, else None."""
+        with self.lock:
+            if self.value is None or self.clock() >= self.expires:
+                return None
+            return self.value
+
+    def get(self):
+        with self.lock:
+            now = self.clock()
+            if self.value is None or now >= self.expires:
+                value = None
+            else:
+                value = self.value
+                refresh_due = now >= self.expires - self.refresh_fraction * self.ttl_seconds
+                start_refresh = refresh_due and not self.refreshing
+                if start_refresh:
+                    self.refreshing = True
+        if value is None:
+            #
+            # Callers which find no valid value wait for one fetch, instead of each running their own.
+            #
+            with self.fetch_lock:
+                value = self.current()
+                return value if value is not None else self.refresh()
+        if start_refresh:
+            if self.background:
+                thread = threading.Thread(target=self.refresh_in_background)
+                thread.daemon = True
+                thread.start()
+            else:
+                self.refresh_in_background()
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.value = None
+            self.expires = None
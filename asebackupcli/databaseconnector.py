@@ -9,22 +9,84 @@ from os.path import expanduser
 import glob
 import subprocess
 import logging
+import threading
 
 from .naming import Naming
+from .isqlsession import IsqlSession, IsqlSessionPool
+from .credentialcache import CredentialCache
 from .backupexception import BackupException
 
+class DatabaseSize(object):
+    """Sizes in bytes of a database, and the stripe count for its next dump."""
+    __slots__ = ("dbname", "stripe_count", "used_size", "data_size", "data_free", "log_size", "log_free")
+
+    def __init__(self, dbname, stripe_count, used_size, data_size, data_free, log_size, log_free):
+        self.dbname = dbname
+        self.stripe_count = stripe_count
+        self.used_size = used_size
+        self.data_size = data_size
+        self.data_free = data_free
+        self.log_size = log_size
+        self.log_free = log_free
+
+    @staticmethod
+    def parse(line):
+        """A row of sql_statement_database_sizes, with sizes in MB."""
+        values = line.split()
+        mb = 1024 * 1024
+        return DatabaseSize(dbname=values[0], stripe_count=int(values[1]),
+                            used_size=int(values[2]) * mb, data_size=int(values[3]) * mb, data_free=int(values[4]) * mb,
+                            log_size=int(values[5]) * mb, log_free=int(values[6]) * mb)
+
+    def __str__(self):
+        mb = 1024 * 1024
+        return "{}: {:,} MB used, data {:,} MB ({:,} MB free), log {:,} MB ({:,} MB free), {} stripes".format(
+            self.dbname, self.used_size // mb, self.data_size // mb, self.data_free // mb,
+            self.log_size // mb, self.log_free // mb, self.stripe_count)
+
 class DatabaseConnector(object):
     """The ASE DB logic."""
-    def __init__(self, backup_configuration):
+    def __init__(self, backup_configuration, max_sessions=IsqlSessionPool.MAX_SESSIONS):
         self.backup_configuration = backup_configuration
+        #
+        # Statements run in long-lived isql sessions, so the executable lookup and
+        # the password generator only run when a session starts.
+        #
+        self.isql_sessions = IsqlSessionPool(command_line=self.isql, max_sessions=max_sessions)
+        self.executable_paths = dict()
+        self.password_cache = None
+        self.password_cache_lock = threading.Lock()
+
+    def close(self):
+        self.isql_sessions.close()
 
     def get_executable_path(self, path):
-        return glob.glob(os.path.join(expanduser("~"), path))[0]
+        """Resolve a glob under the home directory. The result is kept while the file exists."""
+        executable_path = self.executable_paths.get(path)
+        if executable_path is None or not os.path.exists(executable_path):
+            matches = glob.glob(os.path.join(expanduser("~"), path))
+            if not matches:
+                raise BackupException("Cannot find {} in {}".format(path, expanduser("~")))
+            executable_path = matches[0]
+            self.executable_paths[path] = executable_path
+        return executable_path
 
     def get_backup_user_name(self):
         return "sapsa"
 
     def get_database_password(self):
+        """The database password, which is kept in memory only, and refreshed before its TTL expires."""
+        #
+        # Concurrent backup jobs start isql sessions at the same time, and must share one cache.
+        #
+        with self.password_cache_lock:
+            if self.password_cache is None:
+                self.password_cache = CredentialCache(
+                    fetch=self.fetch_database_password,
+                    ttl_seconds=self.backup_configuration.get_database_password_ttl_seconds())
+        return self.password_cache.get()
+
+    def fetch_database_password(self):
         try:
             gen = self.backup_configuration.get_database_password_generator()
             password = subprocess.check_output(gen, shell=True)
@@ -65,77 +127,108 @@ class DatabaseConnector(object):
         return "\n".join([str(stdout1), "", str(stdout2)])
 
     @staticmethod
-    def sql_statement_stripe_count(dbname, is_full):
-        return "\n".join([
-            "set nocount on",
-            "go",
-            "declare @dbname varchar(30),",
-            "        @dumptype varchar(12),",
-            "        @stripes int,",
-            "        @data_free numeric (10,2),",
-            "        @data_size numeric (10,2),",
-            "        @log_free numeric (10,2),",
-            "        @log_size numeric (10,2),",
-            "        @max_stripe_size_in_GB int",
-            "",
-            "select @dbname = '{dbname}'".format(dbname=dbname),
-            "select @stripes = 0",
-            "select @max_stripe_size_in_GB = 10",
-            "select",
-            "    @data_free = convert(numeric(10,2),sum(curunreservedpgs(dbid, lstart, unreservedpgs)) * (@@maxpagesize / 1024. / 1024)),",
-            "    @data_size = convert(numeric(10,2),sum(u.size * (@@maxpagesize / 1024. / 1024.))),",
-            "    @log_free = convert(numeric(10,2),lct_admin('logsegment_freepages', u.dbid) * (@@maxpagesize / 1024. /1024. ))",
-            "    from master..sysusages u, master..sysdevices d",
-            "    where d.vdevno = u.vdevno",
-            "        and d.status &2 = 2",
-            "        and u.segmap <> 4",
-            "        and u.segmap < 5",
-            "        and db_name(u.dbid) = @dbname",
-            "    group by u.dbid",
-            "select @log_size =  sum(us.size * (@@maxpagesize / 1024. / 1024.))",
-            "    from master..sysdatabases db, master..sysusages us",
-            "    where db.dbid = us.dbid",
-            "        and us.segmap = 4",
-            "        and db_name(db.dbid) = @dbname",
-            "    group by db.dbid",
-            "select @data_free = isnull (@data_free, 0),",
-            "       @data_size = isnull (@data_size ,0),",
-            "       @log_free  = isnull (@log_free, 0),",
-            "       @log_size  = isnull (@log_size, 0)"
-        ]
-        +
-        {
-            True: [
-                "select @stripes = convert (int, ((@data_size - @data_free + @log_size - @log_free) / 1024 + @max_stripe_size_in_GB ) / @max_stripe_size_in_GB)",
-                "if(( @stripes < 2 ) and ( @data_size - @data_free + @log_size - @log_free > 1024 ))"
-                ],
-            False: [
-                "select @stripes = convert (int, ((@log_size - @log_free) / 1024 + @max_stripe_size_in_GB ) / @max_stripe_size_in_GB)",
-                "if(( @stripes < 2 ) and ( @log_size - @log_free > 1024 ))"
+    def sql_statement_database_sizes(is_full, databases=None):
+        """
+        One result set with the sizes in MB and the stripe count of the next dump
+        of each database, for all databases which can be dumped, or for the given
+        `databases`. A stripe takes up to 10 GB, with 2 to 8 stripes for dumps
+        beyond 1 GB. The temp tables are dropped at the end, as they would live on
+        in the pooled isql session, and before they are created, in case an earlier
+        run failed halfway.
+        """
+        mb_per_page = "(@@maxpagesize / 1024. / 1024.)"
+        return "\n".join(
+            [
+                "set nocount on",
+                "go"
             ]
-        }[is_full]
-        +
-        [
-            "begin",
-            "    select @stripes = 2",
-            "end",
-            "",
-            "if @stripes > 8",
-            "begin",
-            "    select @stripes = 8",
-            "end",
-            "",
-            "select @stripes",
-            "go",
-            ""
-        ])
+            +
+            DatabaseConnector.sql_drop_temp_tables(["#dbname", "#data", "#log", "#sizes"])
+            +
+            [
+                "select dbid, name, status, status2 into #dbname",
+                "    from master..sysdatabases",
+                "    where dbid <> 2 and status3 & 256 = 0"
+            ]
+            +
+            ({
+                False:[
+                    "delete from #dbname where status2 & 16 = 16 or status2 & 32 = 32 or status & 8 = 8",
+                    "delete from #dbname where tran_dumpable_status(name) <> 0"
+                ],
+                True: []
+            }[is_full] if not databases else [
+                "delete from #dbname where name not in ({})".format(
+                    ", ".join(["'{}'".format(dbname.replace("'", "''")) for dbname in databases]))
+            ])
+            +
+            [
+                "select u.dbid,",
+                "    data_size = sum(u.size) * {},".format(mb_per_page),
+                "    data_free = sum(curunreservedpgs(u.dbid, u.lstart, u.unreservedpgs)) * {}".format(mb_per_page),
+                "    into #data",
+                "    from #dbname db, master..sysusages u, master..sysdevices d",
+                "    where db.dbid = u.dbid",
+                "        and d.vdevno = u.vdevno",
+                "        and d.status & 2 = 2",
+                "        and u.segmap <> 4",
+                "        and u.segmap < 5",
+                "    group by u.dbid",
+                "select u.dbid,",
+                "    log_size = sum(u.size) * {}".format(mb_per_page),
+                "    into #log",
+                "    from #dbname db, master..sysusages u",
+                "    where db.dbid = u.dbid",
+                "        and u.segmap = 4",
+                "    group by u.dbid",
+                "select db.name,",
+                "    data_size = convert(numeric(12,2), isnull(d.data_size, 0)),",
+                "    data_free = convert(numeric(12,2), isnull(d.data_free, 0)),",
+                "    log_size = convert(numeric(12,2), isnull(l.log_size, 0)),",
+                "    log_free = convert(numeric(12,2), lct_admin('logsegment_freepages', db.dbid) * {}),".format(mb_per_page),
+                "    used_size = convert(numeric(12,2), 0),",
+                "    stripes = 0",
+                "    into #sizes",
+                "    from #dbname db",
+                "        left outer join #data d on d.dbid = db.dbid",
+                "        left outer join #log l on l.dbid = db.dbid",
+                {
+                    True: "update #sizes set used_size = data_size - data_free + log_size - log_free",
+                    False: "update #sizes set used_size = log_size - log_free"
+                }[is_full],
+                "update #sizes set stripes = convert(int, (used_size / 1024 + 10) / 10)",
+                "update #sizes set stripes = 2 where stripes < 2 and used_size > 1024",
+                "update #sizes set stripes = 8 where stripes > 8",
+                "select name, stripes, convert(int, used_size), convert(int, data_size), convert(int, data_free),",
+                "    convert(int, log_size), convert(int, log_free)",
+                "    from #sizes order by name",
+                "drop table #sizes, #log, #data, #dbname",
+                "go",
+                ""
+            ])
+
+    @staticmethod
+    def sql_drop_temp_tables(tables):
+        """
+        A batch which drops the given temp tables if they exist, e.g. left over in
+        the session by a statement which failed before its own drop.
+
+            >>> DatabaseConnector.sql_drop_temp_tables(["#dbname"])
+            ["if object_id('#dbname') is not null drop table #dbname", 'go']
+        """
+        return ["if object_id('{0}') is not null drop table {0}".format(table) for table in tables] + ["go"]
 
     @staticmethod
     def sql_statement_list_databases(is_full):
         return "\n".join(
             [
                 "set nocount on",
-                "go",
+                "go"
+            ]
+            +
+            DatabaseConnector.sql_drop_temp_tables(["#dbname", "#selected_dbs"])
+            +
+            [
                 "select name, status, status2 into #dbname",
                 "    from master..sysdatabases",
                 "    where dbid <> 2 and status3 & 256 = 0"
@@ -167,8 +260,10 @@ class DatabaseConnector(object):
                 "        select @inputstrg = substring(@inputstrg, @delim_pos + 1, char_length(@inputstrg))",
                 "    end",
                 "    delete from #dbname where name not in (select dbname from #selected_dbs)",
+                "    drop table #selected_dbs",
                 "end",
                 "select name from #dbname order by 1",
+                "drop table #dbname",
                 "go",
                 ""
             ]
@@ -214,15 +309,97 @@ class DatabaseConnector(object):
             ]
         )
 
+    @staticmethod
+    def sql_statement_load(dbname, is_full, files, until_time=None):
+        """
+        Load a dump from the given stripes. A transaction dump can be applied
+        up to `until_time` (in Timing.time_format) only.
+
+            >>> print DatabaseConnector.sql_statement_load("AZU", False, ["/tmp/p1", "/tmp/p2"], until_time="20180101_012000")
+            use master
+            go
+            load transaction AZU from '/tmp/p1'
+                stripe on '/tmp/p2'
+            with until_time = '20180101 01:20:00'
+            <BLANKLINE>
+            if @@error = 0
+            begin
+              print 'ASE_AZURE_BACKUP_SUCCESS'
+            end
+            <BLANKLINE>
+            go
+            <BLANKLINE>
+        """
+        options = []
+        if until_time is not None:
+            options.append("with until_time = '{} {}:{}:{}'".format(
+                until_time[0:8], until_time[9:11], until_time[11:13], until_time[13:15]))
+        return "\n".join(
+            [
+                "use master",
+                "go",
+                "load {type} {dbname} from {file_names}".format(
+                    type={True:"database", False:"transaction"}[is_full],
+                    dbname=dbname,
+                    file_names="\n    stripe on ".join(
+                        ["'{fn}'".format(fn=fn) for fn in files]
+                    )
+                )
+            ]
+            + options +
+            [
+                "",
+                "if @@error = 0",
+                "begin",
+                "  print '{}'".format(DatabaseConnector.MAGIC_SUCCESS_STRING),
+                "end",
+                "",
+                "go",
+                ""
+            ]
+        )
+
+    @staticmethod
+    def sql_statement_online_database(dbname):
+        return "\n".join([
+            "use master",
+            "go",
+            "online database {}".format(dbname),
+            "",
+            "if @@error = 0",
+            "begin",
+            "  print '{}'".format(DatabaseConnector.MAGIC_SUCCESS_STRING),
+            "end",
+            "",
+            "go",
+            ""
+        ])
+
     MAGIC_SUCCESS_STRING = "ASE_AZURE_BACKUP_SUCCESS"
 
-    def determine_database_backup_stripe_count(self, dbname, is_full):
+    @staticmethod
+    def parse_database_sizes(stdout):
+        """
+        Parse the rows printed by sql_statement_database_sizes.
+
+            >>> sizes = DatabaseConnector.parse_database_sizes(" AZU  4  41203  50000  9000  2048  1845 \\n master  1  12  30  20  2  0 \\n")
+            >>> [(size.dbname, size.stripe_count, size.used_size) for size in sizes]
+            [('AZU', 4, 43204476928), ('master', 1, 12582912)]
+        """
+        return [DatabaseSize.parse(line) for line in stdout.split("\n") if line.strip()]
+
+    def determine_database_sizes(self, is_full, user_selected_databases=None):
+        """The DatabaseSizes of the databases to dump, in one isql round trip."""
         (stdout, _stderr, _returncode) = self.call_isql(
-            stdin=DatabaseConnector.sql_statement_stripe_count(dbname=dbname, is_full=is_full))
+            stdin=DatabaseConnector.sql_statement_database_sizes(is_full=is_full, databases=user_selected_databases))
         try:
-            return int(stdout)
+            sizes = DatabaseConnector.parse_database_sizes(stdout)
         except Exception:
-            raise BackupException("Cannot determine stripe_count: {}".format(stdout))
+            raise BackupException("Cannot determine database sizes: {}".format(stdout))
+        unknown = sorted(set(user_selected_databases or []) - set([size.dbname for size in sizes]))
+        if unknown:
+            raise BackupException("{}: {}".format(DatabaseConnector.ERR_UNKNOWN_DATABASE, ", ".join(unknown)))
+        return sizes
 
     def determine_databases(self, user_selected_databases, is_full):
         if user_selected_databases:
@@ -255,17 +432,48 @@ class DatabaseConnector(object):
                     stripe_count=stripe_count,
                     output_dir=output_dir)))
 
+    def load_dump(self, dbname, is_full, files, until_time=None):
+        return self.call_isql(
+            stdin=DatabaseConnector.sql_statement_load(
+                dbname=dbname, is_full=is_full, files=files, until_time=until_time))
+
+    def online_database(self, dbname):
+        return self.call_isql(stdin=DatabaseConnector.sql_statement_online_database(dbname=dbname))
+
     ERR_DATABASE_SERVICE_NOT_AVAILABLE = "Database service not reachable"
     ERR_BACKUP_SERVICE_NOT_AVAILABLE = "Backup server not reachable"
     ERR_BACKUP_SERVICE_KILLED = "Backup service died"
     ERR_UNKNOWN_DATABASE = "Unknown database"
     ERR_FILESYSTEM_FULL = "Filesystem full"
 
+    @staticmethod
+    def is_database_service_not_available(stdout, returncode):
+        return returncode == 255 and "ct_connect(): network packet layer:" in stdout
+
+    @staticmethod
+    def is_session_broken(stdout, returncode):
+        return DatabaseConnector.is_database_service_not_available(stdout, returncode) or IsqlSession.is_connection_lost(stdout)
+
+    def call_isql_session(self, stdin, fresh=False):
+        """Run `stdin` in a pooled isql session, or in a new one if `fresh`."""
+        session = self.isql_sessions.acquire(fresh=fresh)
+        try:
+            return session.execute(stdin)
+        finally:
+            self.isql_sessions.release(session)
+
     def call_isql(self, stdin):
-        """Call `isql` and send `stdin`"""
-        stdout, stderr, returncode = DatabaseConnector.call_process(command_line=self.isql(), stdin=stdin)
+        """
+        Run `stdin` through `isql`. When the session could not connect, or lost its
+        connection, the statement runs once more in a new session.
+        """
+        stdout, stderr, returncode = self.call_isql_session(stdin)
+
+        if DatabaseConnector.is_session_broken(stdout, returncode):
+            logging.warning("isql session has no connection, retrying in a new session")
+            stdout, stderr, returncode = self.call_isql_session(stdin, fresh=True)
 
-        if returncode == 255 and "ct_connect(): network packet layer:" in stdout:
+        if DatabaseConnector.is_session_broken(stdout, returncode):
             raise BackupException(DatabaseConnector.ERR_DATABASE_SERVICE_NOT_AVAILABLE)
 
         if "Attempt to locate entry in sysdatabases for database" in stdout:
@@ -0,0 +1,234 @@
+# coding=utf-8
+# pylint: disable=c0301
+
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""File uploader module"""
+
+import io
+import os
+import hashlib
+import logging
+import threading
+import Queue
+
+from azure.common import AzureMissingResourceHttpError
+from azure.storage.blob.models import BlockListType
+
+from .blockuploader import BlockUploader
+from .blockjournal import BlockJournal
+from .bufferpool import BufferPool
+from .blocksizer import BlockSizer
+from .backupexception import BackupException
+
+class FileUploader(object):
+    """
+    Uploads a local dump file as block blob, computing its digest while the bytes pass through.
+
+    Staged blocks are recorded in a BlockJournal next to the file. When an upload
+    is interrupted, the next attempt only uploads the blocks which are missing
+    in the blob's uncommitted block list.
+    """
+    BLOCK_SIZE = 4 * 1024 * 1024
+    MAX_CONNECTIONS = 4
+
+    def __init__(self, storage_client, container_name, blob_name, file_path,
+                 block_size=BLOCK_SIZE, max_connections=MAX_CONNECTIONS,
+                 buffer_pool=None, connection_slots=None):
+        self.storage_client = storage_client
+        self.container_name = container_name
+        self.blob_name = blob_name
+        self.file_path = file_path
+        self.block_size = block_size
+        self.max_connections = max_connections
+        self.buffer_pool = buffer_pool
+        self.connection_slots = connection_slots
+
+    @staticmethod
+    def fill_buffer(stream, buffer):
+        """Read from the file into `buffer` until it is full, or the end of the file is reached."""
+        view = memoryview(buffer)
+        length = 0
+        while length < len(buffer):
+            count = stream.readinto(view[length:])
+            if not count:
+                break
+            length += count
+        return length
+
+    @staticmethod
+    def file_sha256(file_path):
+        """SHA-256 of a local file, as recorded by upload()."""
+        sha256 = hashlib.sha256()
+        with io.open(file_path, "rb") as stream:
+            while True:
+                data = stream.read(FileUploader.BLOCK_SIZE)
+                if not data:
+                    break
+                sha256.update(data)
+        return sha256.hexdigest()
+
+    @staticmethod
+    def expected_block_size(block_id, block_size, file_size):
+        """
+            >>> FileUploader.expected_block_size(BlockUploader.block_id(0), block_size=10, file_size=25)
+            10
+            >>> FileUploader.expected_block_size(BlockUploader.block_id(2), block_size=10, file_size=25)
+            5
+        """
+        offset = int(block_id) * block_size
+        return max(0, min(block_size, file_size - offset))
+
+    def staged_blocks(self, journaled_block_ids, block_size, file_size):
+        """The journaled blocks which the service still holds as uncommitted, with the expected size."""
+        try:
+            block_list = self.storage_client.get_block_list(
+                container_name=self.container_name, blob_name=self.blob_name,
+                block_list_type=BlockListType.Uncommitted)
+        except AzureMissingResourceHttpError:
+            return set()
+
+        return set([
+            b.id for b in block_list.uncommitted_blocks
+            if b.id in journaled_block_ids and b.size == FileUploader.expected_block_size(b.id, block_size, file_size)
+        ])
+
+    def upload(self):
+        """Upload the file and return its SHA-256."""
+        file_size = os.path.getsize(self.file_path)
+        journal = BlockJournal(self.file_path)
+        (header, journaled_block_ids) = journal.load(blob_name=self.blob_name, file_size=file_size)
+
+        #
+        # The file size is known, so the block size is fixed for the whole upload,
+        # which keeps the block offsets stable for resuming.
+        #
+        block_size = BlockSizer.block_size_for(file_size, self.block_size)
+        staged = set()
+        if header is not None:
+            block_size = header["block_size"]
+            staged = self.staged_blocks(journaled_block_ids, block_size, file_size)
+            logging.info("Resuming upload of %s, %d blocks already staged", self.file_path, len(staged))
+        journal.open(BlockJournal.header(self.blob_name, file_size, block_size), staged)
+
+        pool = self.buffer_pool
+        if pool is None or pool.buffer_size < block_size:
+            pool = BufferPool(
+                buffer_size=block_size,
+                memory_budget=block_size * (2 * self.max_connections + 2))
+        uploader = BlockUploader(
+            storage_client=self.storage_client,
+            container_name=self.container_name, blob_name=self.blob_name,
+            max_connections=self.max_connections,
+            on_block_staged=journal.record,
+            connection_slots=self.connection_slots)
+        uploader.start()
+        try:
+            with io.open(self.file_path, "rb", buffering=0) as stream:
+                while True:
+                    block_buffer = pool.acquire()
+                    length = FileUploader.fill_buffer(stream, memoryview(block_buffer)[0:block_size])
+                    if length == 0:
+                        pool.release(block_buffer)
+                        break
+                    #
+                    # Already staged blocks are still read, because the digest covers the whole file.
+                    #
+                    block_id = BlockUploader.block_id(len(uploader.block_ids))
+                    uploader.put(memoryview(block_buffer)[0:length],
+                                 release=lambda b=block_buffer: pool.release(b),
+                                 already_staged=block_id in staged)
+            uploader.commit()
+        except Exception:
+            uploader.abort()
+            journal.close()
+            raise
+
+        journal.remove()
+        logging.info("Uploaded %s to %s/%s (%d bytes, sha256 %s)", self.file_path,
+                     self.container_name, self.blob_name, uploader.total_bytes, uploader.sha256)
+        return uploader.sha256
+
+class FileUploadThread(threading.Thread):
+    """Takes files from the queue of a ConcurrentFileUploader, uploads and then removes them."""
+    def __init__(self, concurrent_uploader):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.concurrent_uploader = concurrent_uploader
+
+    def run(self):
+        while True:
+            try:
+                (blob_name, file_path) = self.concurrent_uploader.queue.get_nowait()
+            except Queue.Empty:
+                return
+            self.concurrent_uploader.upload_and_remove(blob_name, file_path)
+
+class ConcurrentFileUploader(object):
+    """
+    Uploads several files, e.g. all stripes of a dump, on a bounded number of threads.
+    All uploads share one buffer pool, and a semaphore caps the number of
+    concurrent block uploads across all files at `max_connections`. The pool
+    stays within `memory_budget` bytes, if given.
+
+    Each file is removed locally as soon as its own upload succeeded. A failed
+    file is kept, together with its journal, so that a later run can resume it.
+    """
+    def __init__(self, storage_client, container_name, block_size=FileUploader.BLOCK_SIZE,
+                 max_connections=FileUploader.MAX_CONNECTIONS * 2, max_files=None, memory_budget=None):
+        self.storage_client = storage_client
+        self.container_name = container_name
+        self.block_size = block_size
+        self.max_connections = max(1, int(max_connections))
+        self.max_files = max_files
+        self.memory_budget = memory_budget
+        self.queue = Queue.Queue()
+        self.connection_slots = threading.BoundedSemaphore(self.max_connections)
+        self.failures = []
+        self.failures_lock = threading.Lock()
+        self.buffer_pool = None
+
+    def upload_and_remove(self, blob_name, file_path):
+        try:
+            FileUploader(
+                storage_client=self.storage_client,
+                container_name=self.container_name, blob_name=blob_name, file_path=file_path,
+                block_size=self.block_size, max_connections=self.max_connections,
+                buffer_pool=self.buffer_pool, connection_slots=self.connection_slots).upload()
+            os.remove(file_path)
+        except Exception as exception:
+            logging.fatal("Upload of %s to %s/%s failed: %s", file_path, self.container_name, blob_name, exception)
+            with self.failures_lock:
+                self.failures.append((file_path, exception))
+
+    def upload(self, files):
+        """Upload and remove the given (blob_name, file_path) pairs. Raises a BackupException if any of them failed."""
+        if not files:
+            return
+
+        thread_count = len(files)
+        if self.max_files is not None:
+            thread_count = max(1, min(thread_count, self.max_files))
+
+        #
+        # Each file keeps up to two blocks per connection in flight, but the
+        # connections are shared, so the pool is sized for the total cap, unless
+        # the memory budget is smaller.
+        #
+        buffer_size = max([BlockSizer.block_size_for(os.path.getsize(file_path), self.block_size)
+                           for (_blob_name, file_path) in files])
+        memory_budget = buffer_size * (2 * self.max_connections + 2 * thread_count)
+        if self.memory_budget is not None:
+            memory_budget = min(memory_budget, self.memory_budget)
+        self.buffer_pool = BufferPool(buffer_size=buffer_size, memory_budget=memory_budget)
+        for item in files:
+            self.queue.put(item)
+        threads = [FileUploadThread(self) for _ in range(thread_count)]
+        _ = [t.start() for t in threads]
+        _ = [t.join() for t in threads]
+        logging.debug("Uploaded %d files to %s (buffers: %s)", len(files), self.container_name, self.buffer_pool.usage())
+
+        if self.failures:
+            raise BackupException("Upload failed for {}".format(
+                ", ".join([file_path for (file_path, _exception) in self.failures])))
@@ -0,0 +1,137 @@
+# coding=utf-8
+# pylint: disable=c0301
+
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""isql session module"""
+
+import logging
+import subprocess
+import threading
+
+class IsqlSession(object):
+    """
+    A long-lived isql process, which runs `go`-delimited batches sent over stdin.
+
+    Each statement is followed by a batch which prints a unique sentinel, so the
+    output up to the sentinel is the statement's result. When isql exits, e.g.
+    because the connection failed, the output up to the end is the result, with
+    isql's return code. A session whose server connection was lost is told to
+    quit, and is not used again.
+    """
+    SENTINEL = "ASE_AZURE_SESSION_END"
+    CONNECTION_ERRORS = ["network packet layer:", "connection has been marked dead"]
+
+    def __init__(self, command_line):
+        logging.debug("Start isql session %s", command_line[0])
+        self.process = subprocess.Popen(
+            command_line,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            close_fds=True)
+        self.statement_count = 0
+        self.lost = False
+
+    @staticmethod
+    def is_connection_lost(stdout):
+        """
+            >>> IsqlSession.is_connection_lost("\\tct_results(): network packet layer: internal net library error")
+            True
+            >>> IsqlSession.is_connection_lost("Msg 911, Level 11, State 2: Attempt to locate entry in sysdatabases")
+            False
+        """
+        return any([error in stdout for error in IsqlSession.CONNECTION_ERRORS])
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    def is_usable(self):
+        return self.is_alive() and not self.lost
+
+    def execute(self, sql):
+        """Run the batches in `sql`, and return (stdout, stderr, returncode) like DatabaseConnector.call_process."""
+        self.statement_count += 1
+        sentinel = "{}_{}".format(IsqlSession.SENTINEL, self.statement_count)
+        try:
+            self.process.stdin.write(sql if sql.endswith("\n") else sql + "\n")
+            self.process.stdin.write("print '{}'\ngo\n".format(sentinel))
+            self.process.stdin.flush()
+        except IOError as exception:
+            # isql exited already, its output explains why
+            logging.debug("Cannot write to isql session: %s", exception)
+
+        lines = []
+        while True:
+            line = self.process.stdout.readline()
+            if not line:
+                self.process.wait()
+                return ("".join(lines), "", self.process.returncode)
+            if sentinel in line:
+                return ("".join(lines), "", 0)
+            lines.append(line)
+            if not self.lost and IsqlSession.is_connection_lost(line):
+                #
+                # Without a connection, the sentinel batch cannot print, so isql
+                # quits after the pending batches, and the output ends there.
+                #
+                logging.warning("isql session lost its connection: %s", line.strip())
+                self.lost = True
+                self.quit()
+
+    def quit(self):
+        try:
+            self.process.stdin.write("quit\n")
+            self.process.stdin.close()
+        except IOError:
+            pass
+
+    def close(self):
+        if self.is_alive():
+            self.quit()
+            self.process.wait()
+
+class IsqlSessionPool(object):
+    """
+    Up to `max_sessions` isql sessions, started on demand and reused for later
+    statements. A session is only used by one statement at a time.
+    """
+    MAX_SESSIONS = 4
+
+    def __init__(self, command_line, max_sessions=MAX_SESSIONS):
+        """`command_line` is called for the arguments of each new session."""
+        self.command_line = command_line
+        self.slots = threading.BoundedSemaphore(max_sessions)
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def acquire(self, fresh=False):
+        """A session, reused from earlier statements unless `fresh`."""
+        self.slots.acquire()
+        try:
+            with self.lock:
+                while self.idle and not fresh:
+                    session = self.idle.pop()
+                    if session.is_usable():
+                        return session
+                    session.close()
+            return IsqlSession(self.command_line())
+        except Exception:
+            self.slots.release()
+            raise
+
+    def release(self, session):
+        """Return a session for reuse. Sessions whose isql exited or lost its connection are dropped."""
+        if session.is_usable():
+            with self.lock:
+                self.idle.append(session)
+        else:
+            session.close()
+        self.slots.release()
+
+    def close(self):
+        with self.lock:
+            sessions = self.idle
+            self.idle = []
+        _ = [session.close() for session in sessions]
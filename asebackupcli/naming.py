@@ -9,8 +9,99 @@
 import os
 import re
 
+class BlobRecord(object):
+    """
+    Parsed name and size of a dump blob. Slotted, as inventories of large
+    containers hold many of them.
+
+        >>> record = BlobRecord.parse("AZU_full_20180601_112429--20180601_131234_S002-003.cdmp", 42)
+        >>> (record.dbname, record.is_full, record.end_timestamp, record.stripe_index, record.content_length)
+        ('AZU', True, '20180601_131234', 2, 42)
+        >>> BlobRecord.parse("AZU_ddlgen_20180601_112429.sql") is None
+        True
+    """
+    __slots__ = ("blob_name", "dbname", "is_full", "start_timestamp", "end_timestamp",
+                 "stripe_index", "stripe_count", "content_length")
+
+    def __init__(self, blob_name, dbname, is_full, start_timestamp, end_timestamp, stripe_index, stripe_count, content_length=None):
+        self.blob_name = blob_name
+        self.dbname = dbname
+        self.is_full = is_full
+        self.start_timestamp = start_timestamp
+        self.end_timestamp = end_timestamp
+        self.stripe_index = stripe_index
+        self.stripe_count = stripe_count
+        self.content_length = content_length
+
+    @staticmethod
+    def parse(blob_name, content_length=None):
+        """The record for a blob name, or None if it is not a dump."""
+        parts = Naming.parse_blobname(blob_name)
+        if parts is None:
+            return None
+        return BlobRecord(blob_name, *parts, content_length=content_length)
+
+    def as_tuple(self):
+        """The fields in the order of __slots__."""
+        return (self.blob_name, self.dbname, self.is_full, self.start_timestamp, self.end_timestamp,
+                self.stripe_index, self.stripe_count, self.content_length)
+
+    @property
+    def file_name(self):
+        """The name of the dump file in the local file system."""
+        return Naming.construct_filename(
+            dbname=self.dbname, is_full=self.is_full, start_timestamp=self.start_timestamp,
+            stripe_index=self.stripe_index, stripe_count=self.stripe_count)
+
+    def __repr__(self):
+        return "BlobRecord({!r}, content_length={!r})".format(self.blob_name, self.content_length)
+
+class BlobBatch(object):
+    """
+    The parsed dump blobs of a listing page, column by column. Names which
+    are not dumps are skipped.
+
+        >>> batch = Naming.parse_blobnames([
+        ...     "AZU_full_20180601_112429--20180601_131234_S001-001.cdmp",
+        ...     "AZU_ddlgen_20180601_112429.sql",
+        ...     "AZU_tran_20180601_140000--20180601_140100_S001-001.cdmp"], [10, 1, 20])
+        >>> (len(batch), batch.dbname, batch.is_full, batch.content_length)
+        (2, ['AZU', 'AZU'], [True, False], [10, 20])
+        >>> [r.end_timestamp for r in batch.records()]
+        ['20180601_131234', '20180601_140100']
+    """
+    __slots__ = BlobRecord.__slots__
+
+    def __init__(self):
+        for column in BlobBatch.__slots__:
+            setattr(self, column, [])
+
+    def append(self, blob_name, parts, content_length):
+        (dbname, is_full, start_timestamp, end_timestamp, stripe_index, stripe_count) = parts
+        self.blob_name.append(blob_name)
+        self.dbname.append(dbname)
+        self.is_full.append(is_full)
+        self.start_timestamp.append(start_timestamp)
+        self.end_timestamp.append(end_timestamp)
+        self.stripe_index.append(stripe_index)
+        self.stripe_count.append(stripe_count)
+        self.content_length.append(content_length)
+
+    def __len__(self):
+        return len(self.blob_name)
+
+    def rows(self):
+        """Tuples in the order of BlobRecord.as_tuple()."""
+        return zip(*[getattr(self, column) for column in BlobBatch.__slots__])
+
+    def records(self):
+        return [BlobRecord(*row) for row in self.rows()]
+
 class Naming(object):
     """Naming utilities"""
+    FILENAME_PATTERN = re.compile(r'(?P<dbname>\S+?)_(?P<type>full|tran)_(?P<start>\d{8}_\d{6})_S(?P<idx>\d+)-(?P<cnt>\d+)\.cdmp$')
+    BLOBNAME_PATTERN = re.compile(r'(?P<dbname>\S+?)_(?P<type>full|tran)_(?P<start>\d{8}_\d{6})--(?P<end>\d{8}_\d{6})_S(?P<idx>\d+)-(?P<cnt>\d+)\.cdmp$')
+    ASE_GENERATED_FILENAME_PATTERN = re.compile(r'(?P<dbname>\S+?)_trans_(?P<start>\d{8}_\d{6})_S(?P<idx>\d+)-(?P<cnt>\d+)\.cdmp$')
 
     @staticmethod
     def backup_type_str(is_full):
@@ -41,6 +132,16 @@ class Naming(object):
         return os.path.join(output_dir, "backup_{}_{}_{:03d}_{:03d}.cdmp_pipe".format(
             dbname, Naming.backup_type_str(is_full), stripe_index, stripe_count))
 
+    @staticmethod
+    def restore_pipe_name(output_dir, dbname, is_full, start_timestamp, stripe_index, stripe_count):
+        """
+        Creates a named pipe path for streaming restores, distinct from the backup pipes.
+        The start timestamp keeps the pipes of a dump apart from those of the next dump,
+        which is prefetched while the current one loads.
+        """
+        return os.path.join(output_dir, "restore_{}_{}_{}_{:03d}_{:03d}.cdmp_pipe".format(
+            dbname, Naming.backup_type_str(is_full), start_timestamp, stripe_index, stripe_count))
+
     @staticmethod
     def pipe_names(dbname, is_full, stripe_count, output_dir):
         """Create named pipe names."""
@@ -80,7 +181,7 @@ class Naming(object):
     @staticmethod
     def parse_filename(filename):
         """Parses a filename."""
-        match = re.search(r'(?P<dbname>\S+?)_(?P<type>full|tran)_(?P<start>\d{8}_\d{6})_S(?P<idx>\d+)-(?P<cnt>\d+)\.cdmp', filename)
+        match = Naming.FILENAME_PATTERN.search(filename)
         if match is None:
             return None
 
@@ -89,15 +190,27 @@ class Naming(object):
     @staticmethod
     def parse_blobname(filename):
         """Parses a blob name."""
-        match = re.search(r'(?P<dbname>\S+?)_(?P<type>full|tran)_(?P<start>\d{8}_\d{6})--(?P<end>\d{8}_\d{6})_S(?P<idx>\d+)-(?P<cnt>\d+)\.cdmp', filename)
+        match = Naming.BLOBNAME_PATTERN.search(filename)
         if match is None:
             return None
         return (match.group('dbname'), Naming.type_str_is_full(match.group('type')), match.group('start'), match.group('end'), int(match.group('idx')), int(match.group('cnt')))
 
+    @staticmethod
+    def parse_blobnames(blob_names, content_lengths=None):
+        """Parses a whole listing page into a BlobBatch."""
+        if content_lengths is None:
+            content_lengths = [None] * len(blob_names)
+        batch = BlobBatch()
+        for (blob_name, content_length) in zip(blob_names, content_lengths):
+            parts = Naming.parse_blobname(blob_name)
+            if parts is not None:
+                batch.append(blob_name, parts, content_length)
+        return batch
+
     @staticmethod
     def parse_ase_generated_filename(filename):
         """Returns the filename parts of ASE-generated TRAN dumps."""
-        match = re.search(r'(?P<dbname>\S+?)_trans_(?P<start>\d{8}_\d{6})_S(?P<idx>\d+)-(?P<cnt>\d+)\.cdmp', filename)
+        match = Naming.ASE_GENERATED_FILENAME_PATTERN.search(filename)
         if match is None:
             return None
         return (match.group('dbname'), match.group('start'), int(match.group('idx')), int(match.group('cnt')))
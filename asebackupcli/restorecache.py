@@ -0,0 +1,113 @@
+# coding=utf-8
+# pylint: disable=c0301
+
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""Restore cache module"""
+
+import os
+import time
+import errno
+import shutil
+import logging
+
+class RestoreCache(object):
+    """
+    Local cache of downloaded dump stripes, for repeated restores such as drills.
+
+    An entry is keyed by blob name and ETag, so a blob which was overwritten in
+    storage is never served from the cache. Restores hard-link cached stripes
+    into their output directory (or copy them across file systems), and only
+    download the missing ones. When the cache exceeds `max_bytes`, the least
+    recently used entries are evicted.
+    """
+    PARTIAL_SUFFIX = ".part"
+
+    def __init__(self, directory, max_bytes, storage_client, container_name):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.storage_client = storage_client
+        self.container_name = container_name
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    @staticmethod
+    def entry_name(blob_name, etag):
+        """
+            >>> RestoreCache.entry_name("AZU_full_20180101_000000--20180101_010000_S001-001.cdmp", '"0x8D5ABC"')
+            'AZU_full_20180101_000000--20180101_010000_S001-001.cdmp.0x8D5ABC'
+        """
+        return "{}.{}".format(blob_name, etag.strip('"'))
+
+    def entry_path(self, blob_name):
+        properties = self.storage_client.get_blob_properties(
+            container_name=self.container_name, blob_name=blob_name).properties
+        return os.path.join(self.directory, RestoreCache.entry_name(blob_name, properties.etag))
+
+    def entries(self):
+        """(mtime, size, path) of the complete entries, least recently used first."""
+        result = []
+        for name in os.listdir(self.directory):
+            if name.endswith(RestoreCache.PARTIAL_SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            stat = os.stat(path)
+            result.append((stat.st_mtime, stat.st_size, path))
+        return sorted(result)
+
+    def evict(self, needed_bytes, keep):
+        """Remove least recently used entries, except those in `keep`, until `needed_bytes` fit under the cap."""
+        entries = self.entries()
+        total = sum([size for (_mtime, size, _path) in entries])
+        for (_mtime, size, path) in entries:
+            if total + needed_bytes <= self.max_bytes:
+                break
+            if path in keep:
+                continue
+            logging.info("Evict %s from the restore cache", path)
+            os.remove(path)
+            total -= size
+
+    @staticmethod
+    def link(entry_path, file_path):
+        """Hard-link the cache entry to `file_path`, or copy it when the link is not possible."""
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        try:
+            os.link(entry_path, file_path)
+        except OSError as exception:
+            if exception.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+            shutil.copyfile(entry_path, file_path)
+
+    def fetch(self, files, downloader):
+        """
+        Provide the given (blob_name, file_path, size) triples like
+        BlobDownloader.download, from the cache where possible.
+        """
+        entries = [(blob_name, file_path, size, self.entry_path(blob_name)) for (blob_name, file_path, size) in files]
+        missing = [(blob_name, entry_path + RestoreCache.PARTIAL_SUFFIX, size)
+                   for (blob_name, _file_path, size, entry_path) in entries if not os.path.exists(entry_path)]
+        logging.info("Restore cache has %d of %d stripes", len(entries) - len(missing), len(entries))
+
+        self.evict(sum([size for (_blob_name, _path, size) in missing]),
+                   keep=set([entry_path for (_blob_name, _file_path, _size, entry_path) in entries]))
+        try:
+            downloader.download(missing)
+        except Exception:
+            for (_blob_name, partial_path, _size) in missing:
+                if os.path.exists(partial_path):
+                    os.remove(partial_path)
+            raise
+        for (_blob_name, partial_path, _size) in missing:
+            os.rename(partial_path, partial_path[:-len(RestoreCache.PARTIAL_SUFFIX)])
+
+        #
+        # The modification time marks the last use. An explicit time keeps sub-second
+        # resolution, which os.utime(path, None) does not have on Python 2.
+        #
+        now = time.time()
+        for (_blob_name, file_path, _size, entry_path) in entries:
+            os.utime(entry_path, (now, now))
+            RestoreCache.link(entry_path, file_path)
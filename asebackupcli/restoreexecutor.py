@@ -0,0 +1,249 @@
+# coding=utf-8
+# pylint: disable=c0301
+
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""Restore executor module"""
+
+import os
+import time
+import logging
+import threading
+
+from .naming import Naming
+from .restorestreamingthread import RestoreStreamingThread
+from .cancellation import CancellationToken
+from .databaseconnector import DatabaseConnector
+from .backupexception import BackupException
+
+class RestoreReport(object):
+    """
+    Durations of the steps of a restore, for the summary at the end of the run.
+
+        >>> report = RestoreReport(clock=iter([10.0, 12.5]).next)
+        >>> report.timed("load full dump ending 20180101_010000", lambda: None)
+        >>> report.lines()
+        ['load full dump ending 20180101_010000:     2.5 s']
+    """
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.steps = []
+        self.lock = threading.Lock()
+
+    def record(self, name, seconds):
+        logging.info("Restore step '%s' took %.1f s", name, seconds)
+        with self.lock:
+            self.steps.append((name, seconds))
+
+    def timed(self, name, function):
+        """Call `function` and record its duration, also when it fails."""
+        start = self.clock()
+        try:
+            return function()
+        finally:
+            self.record(name, self.clock() - start)
+
+    def lines(self):
+        with self.lock:
+            return ["{}: {:>7.1f} s".format(name, seconds) for (name, seconds) in self.steps]
+
+class DownloadedDumpSource(object):
+    """
+    Provides each dump as local files, and removes them once loaded. `download_files`
+    takes (blob_name, file_path, size) triples and a cancellation token, like
+    BackupAgent.download_files.
+    """
+    def __init__(self, download_files, output_dir, dbname):
+        self.download_files = download_files
+        self.output_dir = output_dir
+        self.dbname = dbname
+        self.cancellation_token = CancellationToken()
+
+    def prepare(self, dump):
+        files = [(stripe.blob_name, os.path.join(self.output_dir, stripe.file_name), stripe.content_length)
+                 for stripe in dump.stripes]
+        file_paths = [file_path for (_blob_name, file_path, _size) in files]
+        try:
+            self.download_files(files, cancellation_token=self.cancellation_token)
+        except Exception:
+            self.abort(file_paths)
+            raise
+        return file_paths
+
+    @staticmethod
+    def files(handle):
+        return handle
+
+    def finish(self, handle):
+        self.abort(handle)
+
+    def abort(self, handle):
+        for file_path in handle:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+    def cancel(self):
+        self.cancellation_token.cancel()
+
+class StreamingDumpSource(object):
+    """
+    Provides each dump as named pipes, one per stripe, which RestoreStreamingThreads
+    fill from storage. Preparing a dump starts its threads, which fetch their first
+    range while ASE is still busy with the previous dump.
+    """
+    STOP_GRACE_SECONDS = 10
+
+    def __init__(self, storage_client, container_name, output_dir, dbname, timeout_seconds=None):
+        self.storage_client = storage_client
+        self.container_name = container_name
+        self.output_dir = output_dir
+        self.dbname = dbname
+        self.timeout_seconds = timeout_seconds
+        self.cancellation_token = CancellationToken()
+
+    def prepare(self, dump):
+        #
+        # Each dump has a token of its own, so stopping the threads of a finished
+        # dump does not cancel the prefetch of the next one. cancel() stops all.
+        #
+        cancellation_token = CancellationToken(parent=self.cancellation_token)
+        threads = []
+        for stripe in dump.stripes:
+            pipe_path = Naming.restore_pipe_name(output_dir=self.output_dir, dbname=self.dbname, is_full=dump.is_full,
+                                                 start_timestamp=stripe.start_timestamp,
+                                                 stripe_index=stripe.stripe_index, stripe_count=stripe.stripe_count)
+            if os.path.exists(pipe_path):
+                logging.warning("Remove old pipe file %s", pipe_path)
+                os.remove(pipe_path)
+
+            # pylint: disable=no-member
+            os.mkfifo(pipe_path)
+            # pylint: enable=no-member
+
+            threads.append(RestoreStreamingThread(
+                storage_client=self.storage_client, container_name=self.container_name,
+                blob_name=stripe.blob_name, pipe_path=pipe_path, size=stripe.content_length,
+                cancellation_token=cancellation_token))
+        _ = [t.start() for t in threads]
+        return threads
+
+    @staticmethod
+    def files(handle):
+        return [t.pipe_path for t in handle]
+
+    def finish(self, handle):
+        """Wait for the threads, which are done once ASE read the whole dump, and report their errors."""
+        deadline = CancellationToken(timeout_seconds=self.timeout_seconds)
+        for t in handle:
+            t.join(deadline.remaining_seconds())
+        if any(t.is_alive() for t in handle):
+            logging.error("Streaming restore did not finish before the deadline, cancelling")
+        self.abort(handle)
+        errors = [t.get_exception() for t in handle if t.get_exception() is not None]
+        if errors:
+            raise BackupException("Streaming restore failed: {}".format("; ".join([str(e) for e in errors])))
+
+    def abort(self, handle):
+        _ = [t.stop() for t in handle if t.is_alive()]
+        for t in handle:
+            t.join(StreamingDumpSource.STOP_GRACE_SECONDS)
+            if os.path.exists(t.pipe_path):
+                os.remove(t.pipe_path)
+
+    def cancel(self):
+        self.cancellation_token.cancel()
+
+class PrefetchThread(threading.Thread):
+    """Prepares the next dump of the chain while the current one loads."""
+    def __init__(self, source, dump, report, name):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.source = source
+        self.dump = dump
+        self.report = report
+        self.step_name = name
+        self.handle = None
+        self.exception = None
+
+    def run(self):
+        try:
+            self.handle = self.report.timed(self.step_name, lambda: self.source.prepare(self.dump))
+        except Exception as exception:
+            logging.fatal("Preparing %s failed: %s", self.step_name, exception)
+            self.exception = exception
+
+    def result(self):
+        self.join()
+        if self.exception is not None:
+            raise self.exception
+        return self.handle
+
+class RestoreExecutor(object):
+    """
+    Loads the dumps of a RestorePlan in chain order through isql, and brings the
+    database online. While ASE loads dump N, dump N+1 is already prepared by the
+    source, i.e. downloaded or streaming, so that transfer and load overlap.
+    """
+    def __init__(self, database_connector, dbname, source, report=None):
+        self.database_connector = database_connector
+        self.dbname = dbname
+        self.source = source
+        self.report = report or RestoreReport()
+
+    @staticmethod
+    def until_time(dump, restore_point):
+        """The last transaction dump contains the restore point, and is only applied up to it."""
+        if not dump.is_full and dump.end_timestamp > restore_point:
+            return restore_point
+        return None
+
+    @staticmethod
+    def describe(dump):
+        return "{} dump ending {}".format(Naming.backup_type_str(dump.is_full), dump.end_timestamp)
+
+    def prefetch(self, dump):
+        thread = PrefetchThread(self.source, dump, self.report, "prepare " + RestoreExecutor.describe(dump))
+        thread.start()
+        return thread
+
+    def load(self, dump, handle, restore_point):
+        (stdout, _stderr, _returncode) = self.database_connector.load_dump(
+            dbname=self.dbname, is_full=dump.is_full, files=self.source.files(handle),
+            until_time=RestoreExecutor.until_time(dump, restore_point))
+        if DatabaseConnector.MAGIC_SUCCESS_STRING not in stdout:
+            raise BackupException("Load of {} into {} failed: {}".format(
+                RestoreExecutor.describe(dump), self.dbname, stdout))
+
+    def execute(self, plan):
+        if plan.full is None:
+            raise BackupException("No full backup of {} before {}".format(self.dbname, plan.restore_point))
+
+        next_thread = self.prefetch(plan.dumps[0])
+        for (index, dump) in enumerate(plan.dumps):
+            thread = next_thread
+            next_thread = None
+            try:
+                handle = self.report.timed("wait for " + RestoreExecutor.describe(dump), thread.result)
+                if index + 1 < len(plan.dumps):
+                    next_thread = self.prefetch(plan.dumps[index + 1])
+                try:
+                    self.report.timed("load " + RestoreExecutor.describe(dump),
+                                      lambda: self.load(dump, handle, plan.restore_point))
+                    self.source.finish(handle)
+                except Exception:
+                    self.source.abort(handle)
+                    raise
+            except Exception:
+                self.source.cancel()
+                if next_thread is not None:
+                    next_thread.join()
+                    if next_thread.handle is not None:
+                        self.source.abort(next_thread.handle)
+                raise
+
+        def online():
+            (stdout, _stderr, _returncode) = self.database_connector.online_database(dbname=self.dbname)
+            if DatabaseConnector.MAGIC_SUCCESS_STRING not in stdout:
+                raise BackupException("Cannot bring database {} online: {}".format(self.dbname, stdout))
+        self.report.timed("online database", online)
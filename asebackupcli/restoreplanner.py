@@ -0,0 +1,120 @@
+# coding=utf-8
+# pylint: disable=c0301
+
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""Restore planner module"""
+
+import bisect
+
+from .naming import BlobRecord
+from .timing import Timing
+
+class RestorePlan(object):
+    """The dumps, in restore order, which are needed to recover a database to a restore point."""
+    def __init__(self, restore_point, dumps):
+        self.restore_point = restore_point
+        self.dumps = dumps
+
+    @property
+    def stripes(self):
+        """BlobRecords of all stripes, in restore order."""
+        return [stripe for dump in self.dumps for stripe in dump.stripes]
+
+    @property
+    def blob_names(self):
+        return [stripe.blob_name for stripe in self.stripes]
+
+    @property
+    def total_bytes(self):
+        return sum([dump.total_bytes for dump in self.dumps])
+
+    @property
+    def full(self):
+        """The full dump the chain starts with, or None."""
+        if self.dumps and self.dumps[0].is_full:
+            return self.dumps[0]
+        return None
+
+class Dump(object):
+    """All stripes of one full or transaction dump."""
+    def __init__(self, is_full, end_timestamp):
+        self.is_full = is_full
+        self.end_timestamp = end_timestamp
+        self.stripes = []
+
+    @property
+    def total_bytes(self):
+        return sum([stripe.content_length for stripe in self.stripes])
+
+class RestorePlanner(object):
+    """
+    Plans restore chains for one database. The end times of the full and
+    transaction dumps are indexed once, so that each restore point is
+    answered with a few bisections instead of a scan over all stripes.
+
+    A chain is the latest full dump which ended at or before the restore
+    point, the transaction dumps after it up to the restore point, and the
+    first transaction dump after the restore point (which contains it),
+    unless another full dump comes first. This is what
+    Timing.files_needed_for_recovery computes.
+
+        >>> planner = RestorePlanner([BlobRecord.parse(blob_name, content_length) for (blob_name, content_length) in [
+        ...     ("AZU_full_20180101_000000--20180101_010000_S001-002.cdmp", 100),
+        ...     ("AZU_full_20180101_000000--20180101_010000_S002-002.cdmp", 100),
+        ...     ("AZU_tran_20180101_011500--20180101_011500_S001-001.cdmp", 10),
+        ...     ("AZU_tran_20180101_013000--20180101_013000_S001-001.cdmp", 20)]])
+        >>> plan = planner.plan("20180101_012000")
+        >>> plan.blob_names
+        ['AZU_full_20180101_000000--20180101_010000_S001-002.cdmp', 'AZU_full_20180101_000000--20180101_010000_S002-002.cdmp', 'AZU_tran_20180101_011500--20180101_011500_S001-001.cdmp', 'AZU_tran_20180101_013000--20180101_013000_S001-001.cdmp']
+        >>> plan.total_bytes
+        230
+        >>> [p.total_bytes for p in planner.plan_all(["20180101_005959", "20180101_010000", "20180101_020000"])]
+        [0, 210, 230]
+    """
+    def __init__(self, records):
+        """`records` are the BlobRecords of a single database's dumps."""
+        dumps = dict()
+        for record in records:
+            key = (record.is_full, record.end_timestamp)
+            if key not in dumps:
+                dumps[key] = Dump(is_full=record.is_full, end_timestamp=record.end_timestamp)
+            dumps[key].stripes.append(record)
+
+        for dump in dumps.values():
+            dump.stripes.sort(key=lambda stripe: stripe.blob_name)
+
+        self.fulls = sorted([d for d in dumps.values() if d.is_full], key=lambda d: d.end_timestamp)
+        self.trans = sorted([d for d in dumps.values() if not d.is_full], key=lambda d: d.end_timestamp)
+        self.full_ends = [Timing.to_int(d.end_timestamp) for d in self.fulls]
+        self.tran_ends = [Timing.to_int(d.end_timestamp) for d in self.trans]
+
+    def plan(self, restore_point):
+        """The RestorePlan for a restore point in Timing.time_format."""
+        point = Timing.to_int(restore_point)
+
+        full_index = bisect.bisect_right(self.full_ends, point) - 1
+        if full_index >= 0:
+            dumps = [self.fulls[full_index]]
+            first_tran = bisect.bisect_right(self.tran_ends, self.full_ends[full_index])
+        else:
+            dumps = []
+            first_tran = 0
+        last_tran = bisect.bisect_right(self.tran_ends, point)
+        dumps.extend(self.trans[first_tran:last_tran])
+
+        #
+        # The transaction dump which contains the restore point, unless a
+        # full dump ended in between.
+        #
+        if last_tran < len(self.trans):
+            next_full_index = full_index + 1
+            if next_full_index >= len(self.fulls) or self.full_ends[next_full_index] > self.tran_ends[last_tran]:
+                dumps.append(self.trans[last_tran])
+
+        return RestorePlan(restore_point=restore_point, dumps=dumps)
+
+    def plan_all(self, restore_points):
+        """RestorePlans for many restore points, e.g. for restore drills."""
+        return [self.plan(restore_point) for restore_point in restore_points]
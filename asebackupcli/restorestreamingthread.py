@@ -0,0 +1,105 @@
+# coding=utf-8
+# pylint: disable=c0301
+
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""Restore streaming thread module"""
+
+import os
+import errno
+import fcntl
+import time
+import logging
+import threading
+
+from .blobdownloader import FileDownload
+from .cancellation import CancellationToken
+
+class RestoreStreamingThread(threading.Thread):
+    """
+    Streams a dump blob into a named pipe, from which ASE reads it during
+    `load database` or `load transaction`. The blob is fetched in ranged GETs,
+    in order, so no stripe ever lands on local disk.
+    """
+    POLL_INTERVAL_SECONDS = 1
+    RANGE_SIZE = 32 * 1024 * 1024
+
+    def __init__(self, storage_client, container_name, blob_name, pipe_path, size,
+                 cancellation_token=None, range_size=RANGE_SIZE):
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+        self.storage_client = storage_client
+        self.container_name = container_name
+        self.blob_name = blob_name
+        self.pipe_path = pipe_path
+        self.size = size
+        self.range_size = range_size
+        self.cancellation_token = cancellation_token or CancellationToken()
+        self.exception = None
+
+    def get_exception(self):
+        return self.exception
+
+    def open_pipe(self):
+        """
+        Open the write end of the pipe once ASE opened the read end. With
+        O_NONBLOCK, open() fails with ENXIO instead of waiting for a reader, so
+        a cancelled restore never leaves this thread stuck in open().
+        """
+        while True:
+            self.cancellation_token.raise_if_cancelled()
+            try:
+                fd = os.open(self.pipe_path, os.O_WRONLY | os.O_NONBLOCK)
+            except OSError as exception:
+                if exception.errno != errno.ENXIO:
+                    raise
+                time.sleep(RestoreStreamingThread.POLL_INTERVAL_SECONDS)
+                continue
+            #
+            # ASE reads at its own pace, so the writes block while the pipe is full.
+            #
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags & ~os.O_NONBLOCK)
+            return fd
+
+    @staticmethod
+    def write_all(fd, data):
+        view = memoryview(data)
+        written = 0
+        while written < len(view):
+            written += os.write(fd, view[written:])
+
+    def get_range(self, offset, length):
+        self.cancellation_token.raise_if_cancelled()
+        return self.storage_client.get_blob_to_bytes(
+            container_name=self.container_name, blob_name=self.blob_name,
+            start_range=offset, end_range=offset + length - 1, max_connections=1).content
+
+    def run(self):
+        logging.debug("Start streaming restore of %s/%s into %s", self.container_name, self.blob_name, self.pipe_path)
+        try:
+            #
+            # The first range is fetched before ASE opens the pipe, e.g. while
+            # it still loads the previous dump of the chain.
+            #
+            ranges = FileDownload.ranges(self.size, self.range_size)
+            first_range = self.get_range(*ranges[0]) if ranges else b""
+            fd = self.open_pipe()
+            try:
+                start = time.time()
+                RestoreStreamingThread.write_all(fd, first_range)
+                for (offset, length) in ranges[1:]:
+                    RestoreStreamingThread.write_all(fd, self.get_range(offset, length))
+            finally:
+                os.close(fd)
+            logging.info("Streamed %s/%s into %s (%d bytes, %.1f MB/s)", self.container_name, self.blob_name,
+                         self.pipe_path, self.size, self.size / max(time.time() - start, 0.001) / (1024 * 1024))
+        except Exception as exception:
+            logging.fatal("Exception during streaming restore of %s: %s", self.blob_name, exception)
+            self.exception = exception
+
+    def stop(self):
+        """Cancel the restore. A thread blocked in a write is released when ASE closes the pipe."""
+        self.cancellation_token.cancel()
@@ -61,6 +61,15 @@ class Runner(object):
         options.add_argument("-S", "--stream-upload",
                              help="Streaming backup data via named pipe (no local files)",
                              action="store_true")
+        options.add_argument("-E", "--execute-restore",
+                             help="Load the restored dumps into ASE and bring the database online",
+                             action="store_true")
+        options.add_argument("-R", "--stream-restore",
+                             help="Restore by streaming backup data via named pipes into 'load database' (no local files)",
+                             action="store_true")
+        options.add_argument("-T", "--tail-upload",
+                             help="Upload backup files while they are written (keeps local files until the upload is verified)",
+                             action="store_true")
         options.add_argument("-y", "--force",
                              help="Perform forceful backup (ignores age of last backup or business hours)",
                              action="store_true")
@@ -150,41 +159,47 @@ class Runner(object):
         databases = Runner.get_databases(args)
         DatabaseConnector(backup_configuration).log_env()
         use_streaming = args.stream_upload
+        use_tailing = args.tail_upload
         skip_upload = args.skip_upload
         force = args.force
 
-        for line in backup_agent.get_configuration_printable(output_dir=output_dir):
-            logging.debug(line)
-
-        if args.full_backup:
-            try:
-                #is_full, databases, output_dir, force, skip_upload, use_streaming
-                with pid.PidFile(pidname='asebackupcli-full', piddir=expanduser("~")) as _p:
-                    backup_agent.backup(is_full=True, databases=databases, output_dir=output_dir,
-                                        force=force, skip_upload=skip_upload,
-                                        use_streaming=use_streaming)
-            except pid.PidFileAlreadyLockedError:
-                logging.warn("Skip full backup, already running")
-        elif args.transaction_backup:
-            try:
-                with pid.PidFile(pidname='asebackupcli-tran', piddir=expanduser("~")) as _p:
-                    backup_agent.backup(is_full=False, databases=databases, output_dir=output_dir,
-                                        force=force, skip_upload=skip_upload, use_streaming=use_streaming)
-            except pid.PidFileAlreadyLockedError:
-                logging.warn("Skip transaction log backup, already running")
-        elif args.restore:
-            try:
-                Timing.parse(args.restore)
-            except Exception:
-                raise BackupException("Cannot parse restore point \"{}\"".format(args.restore))
-
-            backup_agent.restore(restore_point=args.restore, output_dir=output_dir, databases=databases)
-        elif args.list_backups:
-            backup_agent.list_backups(databases=databases)
-        elif args.prune_old_backups:
-            age = ScheduleParser.parse_timedelta(args.prune_old_backups)
-            backup_agent.prune_old_backups(older_than=age, databases=databases)
-        elif args.show_configuration:
-            print backup_agent.show_configuration(output_dir=output_dir)
-        else:
-            parser.print_help()
+        try:
+            for line in backup_agent.get_configuration_printable(output_dir=output_dir):
+                logging.debug(line)
+
+            if args.full_backup:
+                try:
+                    #is_full, databases, output_dir, force, skip_upload, use_streaming
+                    with pid.PidFile(pidname='asebackupcli-full', piddir=expanduser("~")) as _p:
+                        backup_agent.backup(is_full=True, databases=databases, output_dir=output_dir,
+                                            force=force, skip_upload=skip_upload,
+                                            use_streaming=use_streaming, use_tailing=use_tailing)
+                except pid.PidFileAlreadyLockedError:
+                    logging.warn("Skip full backup, already running")
+            elif args.transaction_backup:
+                try:
+                    with pid.PidFile(pidname='asebackupcli-tran', piddir=expanduser("~")) as _p:
+                        backup_agent.backup(is_full=False, databases=databases, output_dir=output_dir,
+                                            force=force, skip_upload=skip_upload, use_streaming=use_streaming,
+                                            use_tailing=use_tailing)
+                except pid.PidFileAlreadyLockedError:
+                    logging.warn("Skip transaction log backup, already running")
+            elif args.restore:
+                try:
+                    Timing.parse(args.restore)
+                except Exception:
+                    raise BackupException("Cannot parse restore point \"{}\"".format(args.restore))
+
+                backup_agent.restore(restore_point=args.restore, output_dir=output_dir, databases=databases,
+                                     use_streaming=args.stream_restore, execute=args.execute_restore)
+            elif args.list_backups:
+                backup_agent.list_backups(databases=databases)
+            elif args.prune_old_backups:
+                age = ScheduleParser.parse_timedelta(args.prune_old_backups)
+                backup_agent.prune_old_backups(older_than=age, databases=databases)
+            elif args.show_configuration:
+                print backup_agent.show_configuration(output_dir=output_dir)
+            else:
+                parser.print_help()
+        finally:
+            backup_agent.database_connector.close()
@@ -5,51 +5,121 @@
 # Licensed under the MIT License.
 
 import os
+import io
+import select
 import logging
 import threading
 
+from .blockuploader import BlockUploader
+from .cancellation import CancellationToken
+
 class StreamingThread(threading.Thread):
-    def __init__(self, storage_client, container_name, blob_name, pipe_path):
+    POLL_INTERVAL_SECONDS = 1
+
+    def __init__(self, storage_client, container_name, blob_name, pipe_path,
+                 buffer_pool, max_connections=4, cancellation_token=None, block_timeout=None,
+                 block_sizer=None):
         threading.Thread.__init__(self)
+        self.daemon = True
 
         self.storage_client = storage_client
         self.container_name = container_name
         self.blob_name = blob_name
         self.pipe_path = pipe_path
+        self.buffer_pool = buffer_pool
+        self.block_sizer = block_sizer
+        self.max_connections = max_connections
+        self.block_timeout = block_timeout
+        self.cancellation_token = cancellation_token or CancellationToken()
         self.exception = None
 
     def get_exception(self):
         return self.exception
 
+    @staticmethod
+    def fill_buffer(stream, buffer, cancellation_token):
+        """
+        Read from the pipe into `buffer` until it is full, or the writer closed the pipe.
+
+        The pipe is non-blocking, so we wait in select() with a timeout and check for
+        cancellation in between.
+        """
+        view = memoryview(buffer)
+        length = 0
+        while length < len(buffer):
+            cancellation_token.raise_if_cancelled()
+            readable, _, _ = select.select([stream], [], [], StreamingThread.POLL_INTERVAL_SECONDS)
+            if not readable:
+                continue
+            count = stream.readinto(view[length:])
+            if count is None:
+                # EAGAIN, no data available right now
+                continue
+            if count == 0:
+                break
+            length += count
+        return length
+
     def run(self):
         logging.debug("StreamingThread.run(): Start streaming upload for %s to %s/%s",
                       self.pipe_path, self.container_name, self.blob_name)
 
+        #
+        # The pipe is drained by this thread into a bounded queue, and the
+        # blocks are staged from several connections in parallel. When the
+        # queue is full, we stop reading, so ASE is throttled by the FIFO.
+        #
+        # Blocks are read with readinto() into buffers from a pool shared by
+        # all stripes, which are handed to the uploader as memoryview slices,
+        # and recycled once the block has been staged.
+        #
+        pool = self.buffer_pool
+        token = self.cancellation_token
+        uploader = BlockUploader(
+            storage_client=self.storage_client,
+            container_name=self.container_name, blob_name=self.blob_name,
+            max_connections=self.max_connections,
+            cancellation_token=token, block_timeout=self.block_timeout)
+        uploader.start()
         try:
-            with open(self.pipe_path, "rb", buffering=0) as stream:
-                #
-                # For streaming to work, we need to ensure that
-                # use_byte_buffer=True and
-                # max_connections=1 are set
-                #
-                self.storage_client.create_blob_from_stream(
-                    container_name=self.container_name,
-                    blob_name=self.blob_name, stream=stream,
-                    use_byte_buffer=True, max_connections=1)
-                os.remove(self.pipe_path)
+            #
+            # Opening with O_NONBLOCK does not wait for ASE to open the write end,
+            # so a cancelled backup never leaves this thread stuck in open(). Until
+            # a writer connected, select() does not report the pipe as readable.
+            #
+            fd = os.open(self.pipe_path, os.O_RDONLY | os.O_NONBLOCK)
+            with io.open(fd, "rb", buffering=0) as stream:
+                while True:
+                    block_buffer = pool.acquire(cancellation_token=token)
+                    try:
+                        length = StreamingThread.fill_buffer(stream, block_buffer, token)
+                    except Exception:
+                        pool.release(block_buffer)
+                        raise
+                    if length == 0:
+                        pool.release(block_buffer)
+                        break
+                    uploader.put(memoryview(block_buffer)[0:length],
+                                 release=lambda b=block_buffer: pool.release(b))
+                    if self.block_sizer is not None:
+                        self.block_sizer.update(length, len(uploader.block_ids))
+
+            uploader.commit()
+            os.remove(self.pipe_path)
 
-                logging.debug("Finished streaming upload of %s/%s", self.container_name, self.blob_name)
+            logging.debug("Finished streaming upload of %s/%s", self.container_name, self.blob_name)
         except Exception as exception:
             logging.fatal("Exception during streaming upload: %s", exception.message)
+            uploader.abort()
+            if os.path.exists(self.pipe_path):
+                os.remove(self.pipe_path)
             self.exception = exception
 
     def stop(self):
+        """
+        Cancel the upload. The reading loop notices within POLL_INTERVAL_SECONDS,
+        closes the pipe, and drops blocks which have not been staged yet. Blocks
+        in flight are bounded by the per-block timeout.
+        """
         logging.debug("Requested cancellation of upload to %s/%s", self.container_name, self.blob_name)
-        if os.path.exists(self.pipe_path):
-            os.remove(self.pipe_path)
-        # TODO Kill thread...
-        #
-        # The problem is that
-        # (a) Python does not allow me to kill a thread from the outside, and
-        # (b) the create_blob_from_stream() method does not allow external cancellation.
-        #
+        self.cancellation_token.cancel()
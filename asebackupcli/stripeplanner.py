@@ -0,0 +1,121 @@
+# coding=utf-8
+# pylint: disable=c0301
+
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""Stripe planner module"""
+
+class BackupRun(object):
+    """A completed dump, with the seconds from its start until ASE finished writing all stripes."""
+    __slots__ = ("dbname", "is_full", "use_streaming", "stripe_count", "used_size", "seconds", "end_timestamp")
+
+    def __init__(self, dbname, is_full, use_streaming, stripe_count, used_size, seconds, end_timestamp):
+        self.dbname = dbname
+        self.is_full = is_full
+        self.use_streaming = use_streaming
+        self.stripe_count = stripe_count
+        self.used_size = used_size
+        self.seconds = seconds
+        self.end_timestamp = end_timestamp
+
+    def as_tuple(self):
+        return (self.dbname, int(self.is_full), int(self.use_streaming), self.stripe_count,
+                self.used_size, self.seconds, self.end_timestamp)
+
+    @property
+    def rate(self):
+        """Used database bytes dumped per second, over all stripes."""
+        return self.used_size / float(self.seconds)
+
+    @property
+    def stripe_rate(self):
+        """Used database bytes dumped per second and stripe."""
+        return self.rate / self.stripe_count
+
+class StripePlanner(object):
+    """
+    Picks the stripe count with the shortest predicted dump time, from the
+    throughput which earlier dumps on this machine achieved with each stripe
+    count. Counts which were not tried yet are interpolated between tried ones.
+    While more stripes still paid off, one stripe more than ever tried is
+    predicted to scale linearly, so the planner explores it; once the rate
+    stops growing, it sticks to the best count seen. Among counts within
+    `RATE_TOLERANCE` of the best rate, the smallest one wins.
+
+    Each stripe gets at least `min_stripe_size` bytes. Runs smaller than that
+    mostly measure fixed overheads, and are ignored. Without `min_runs` usable
+    runs, the default (i.e. the fixed rule of the database query) is kept.
+
+        >>> GB = 1024 ** 3
+        >>> runs = [BackupRun("AZU", True, False, 2, 40 * GB, 400.0, "20180101_010000"),
+        ...         BackupRun("AZU", True, False, 4, 40 * GB, 220.0, "20180102_010000"),
+        ...         BackupRun("AZU", True, False, 4, 40 * GB, 200.0, "20180103_010000")]
+        >>> planner = StripePlanner(runs, max_stripes=16, min_runs=3)
+        >>> planner.stripe_count(used_size=80 * GB, default=8)
+        5
+        >>> planner.stripe_count(used_size=3 * GB, default=2)
+        3
+        >>> "{:.0f} MB/s per stripe".format(runs[2].stripe_rate / 1024 ** 2)
+        '51 MB/s per stripe'
+        >>> StripePlanner(runs[:2], max_stripes=16, min_runs=3).stripe_count(used_size=80 * GB, default=8)
+        8
+    """
+    MIN_STRIPE_SIZE = 1024 * 1024 * 1024
+    MIN_RUNS = 3
+    RATE_TOLERANCE = 0.05
+
+    def __init__(self, runs, max_stripes, min_stripe_size=MIN_STRIPE_SIZE, min_runs=MIN_RUNS):
+        self.max_stripes = max_stripes
+        self.min_stripe_size = min_stripe_size
+        usable = [run for run in runs if run.used_size >= min_stripe_size and run.seconds > 0]
+        self.has_history = len(usable) >= min_runs
+        rates_by_count = dict()
+        for run in usable:
+            rates_by_count.setdefault(run.stripe_count, []).append(run.rate)
+        self.rates = dict([(count, StripePlanner.median(rates)) for (count, rates) in rates_by_count.items()])
+
+    @staticmethod
+    def median(values):
+        """
+            >>> StripePlanner.median([3.0, 1.0, 2.0]), StripePlanner.median([1.0, 2.0])
+            (2.0, 1.5)
+        """
+        values = sorted(values)
+        middle = len(values) // 2
+        if len(values) % 2 == 1:
+            return values[middle]
+        return (values[middle - 1] + values[middle]) / 2
+
+    def predicted_rate(self, stripe_count):
+        """Predicted bytes per second with `stripe_count` stripes, or None where history says nothing."""
+        if stripe_count in self.rates:
+            return self.rates[stripe_count]
+        counts = sorted(self.rates.keys())
+        lower = [count for count in counts if count < stripe_count]
+        higher = [count for count in counts if count > stripe_count]
+        if lower and higher:
+            (low, high) = (lower[-1], higher[0])
+            return self.rates[low] + (self.rates[high] - self.rates[low]) * (stripe_count - low) / float(high - low)
+        if higher:
+            return self.rates[higher[0]] * stripe_count / float(higher[0])
+        if lower and stripe_count == lower[-1] + 1:
+            still_scaling = len(lower) == 1 or self.rates[lower[-1]] > self.rates[lower[-2]]
+            if still_scaling:
+                return self.rates[lower[-1]] * stripe_count / float(lower[-1])
+        return None
+
+    def predicted_seconds(self, used_size, stripe_count):
+        rate = self.predicted_rate(stripe_count)
+        return None if rate is None else used_size / rate
+
+    def stripe_count(self, used_size, default):
+        if not self.has_history or not used_size:
+            return default
+        limit = max(1, min(self.max_stripes, used_size // self.min_stripe_size))
+        predictions = [(count, self.predicted_rate(count)) for count in range(1, limit + 1)]
+        predictions = [(count, rate) for (count, rate) in predictions if rate is not None]
+        if not predictions:
+            return default
+        best_rate = max([rate for (_count, rate) in predictions])
+        return min([count for (count, rate) in predictions if rate >= (1 - StripePlanner.RATE_TOLERANCE) * best_rate])
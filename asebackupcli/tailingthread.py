@@ -0,0 +1,127 @@
+# coding=utf-8
+# pylint: disable=c0301
+
+# Copyright (c) Microsoft Corporation.
+# Licensed under the MIT License.
+
+"""Tailing thread module"""
+
+import os
+import io
+import logging
+import threading
+
+from .blockuploader import BlockUploader
+from .cancellation import CancellationToken
+from .backupexception import BackupException
+
+class TailingThread(threading.Thread):
+    """
+    Follows a stripe file while ASE writes it, and stages each block as soon as
+    it is complete. The block list is only committed after finish() has been
+    called, i.e. once the dump has succeeded, and the file has been read to its end.
+    The local file itself is left untouched.
+    """
+    POLL_INTERVAL_SECONDS = 1
+
+    def __init__(self, storage_client, container_name, blob_name, file_path,
+                 buffer_pool, max_connections=4, cancellation_token=None, block_timeout=None,
+                 block_sizer=None, connection_slots=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+        self.storage_client = storage_client
+        self.container_name = container_name
+        self.blob_name = blob_name
+        self.file_path = file_path
+        self.buffer_pool = buffer_pool
+        self.block_sizer = block_sizer
+        self.max_connections = max_connections
+        self.block_timeout = block_timeout
+        self.connection_slots = connection_slots
+        self.cancellation_token = cancellation_token or CancellationToken()
+        self.dump_finished = threading.Event()
+        self.exception = None
+        self.sha256 = None
+        self.total_bytes = 0
+
+    def get_exception(self):
+        return self.exception
+
+    def fill_buffer(self, stream, buffer):
+        """
+        Read from the file into `buffer` until it is full. Reaching the current end
+        of the file only ends the block once the dump has finished, otherwise we
+        wait for ASE to append more data.
+        """
+        view = memoryview(buffer)
+        length = 0
+        while length < len(buffer):
+            self.cancellation_token.raise_if_cancelled()
+            #
+            # Check before reading: only an end of file seen after the dump
+            # finished is the real end of the file.
+            #
+            finished = self.dump_finished.is_set()
+            count = stream.readinto(view[length:])
+            if count:
+                length += count
+            elif finished:
+                break
+            else:
+                self.dump_finished.wait(TailingThread.POLL_INTERVAL_SECONDS)
+        return length
+
+    def wait_for_file(self):
+        while not os.path.exists(self.file_path):
+            if self.dump_finished.is_set() and not os.path.exists(self.file_path):
+                raise BackupException("Dump file {} was not created".format(self.file_path))
+            self.cancellation_token.raise_if_cancelled()
+            self.dump_finished.wait(TailingThread.POLL_INTERVAL_SECONDS)
+
+    def run(self):
+        logging.debug("TailingThread.run(): Start upload of growing file %s to %s/%s",
+                      self.file_path, self.container_name, self.blob_name)
+        pool = self.buffer_pool
+        uploader = BlockUploader(
+            storage_client=self.storage_client,
+            container_name=self.container_name, blob_name=self.blob_name,
+            max_connections=self.max_connections,
+            cancellation_token=self.cancellation_token, block_timeout=self.block_timeout,
+            connection_slots=self.connection_slots)
+        uploader.start()
+        try:
+            self.wait_for_file()
+            with io.open(self.file_path, "rb", buffering=0) as stream:
+                while True:
+                    block_buffer = pool.acquire(cancellation_token=self.cancellation_token)
+                    try:
+                        length = self.fill_buffer(stream, block_buffer)
+                    except Exception:
+                        pool.release(block_buffer)
+                        raise
+                    if length == 0:
+                        pool.release(block_buffer)
+                        break
+                    uploader.put(memoryview(block_buffer)[0:length],
+                                 release=lambda b=block_buffer: pool.release(b))
+                    if self.block_sizer is not None:
+                        self.block_sizer.update(length, len(uploader.block_ids))
+
+            uploader.commit()
+            self.sha256 = uploader.sha256
+            self.total_bytes = uploader.total_bytes
+            logging.debug("Finished upload of %s to %s/%s", self.file_path, self.container_name, self.blob_name)
+        except Exception as exception:
+            logging.error("Exception during upload of growing file %s: %s", self.file_path, exception)
+            uploader.abort()
+            self.exception = exception
+
+    def finish(self):
+        """Signal that the dump has succeeded, so the file will not grow any further."""
+        self.dump_finished.set()
+
+    def stop(self):
+        """Cancel the upload, e.g. because the dump failed. Nothing is committed."""
+        logging.debug("Requested cancellation of upload to %s/%s", self.container_name, self.blob_name)
+        self.cancellation_token.cancel()
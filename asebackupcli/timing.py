@@ -55,10 +55,20 @@ class Timing(object):
 
         return int((dt_utc - datetime.datetime(1970, 1, 1, tzinfo=timezone_utc)).total_seconds())
 
+    @staticmethod
+    def to_int(time_str):
+        """
+        Pack a time string into an integer, which compares like the time itself.
+
+            >>> Timing.to_int("20180605_215959")
+            20180605215959
+        """
+        return int(time_str[0:8] + time_str[9:15])
+
     @staticmethod
     def sort(times, selector=lambda x: x):
-        """Sort by time."""
-        return sorted(times, cmp=lambda a, b: Timing.time_diff_in_seconds(selector(b), selector(a)))
+        """Sort by time. Each time string is parsed once."""
+        return sorted(times, key=lambda x: Timing.to_int(selector(x)))
 
     @staticmethod
     def time_diff_in_seconds(timestr_1, timestr_2):
@@ -69,14 +79,24 @@ class Timing(object):
                                   select_end_date=lambda a: a["end_date"],
                                   select_is_full=lambda f: f["is_full"]):
         """Compute which files must be fetched for a restore"""
-        create_tuple = lambda a: (select_end_date(a), select_is_full(a))
-        by_end_date = lambda (end_date, _is_full): end_date
+        restore_point_int = Timing.to_int(restore_point)
+
+        #
+        # Parse each end date once, and sort the stripes once; the distinct
+        # backups are then visited in the same order.
+        #
+        keyed = sorted([(Timing.to_int(select_end_date(t)), i, t) for (i, t) in enumerate(times)])
+        backups = []
+        seen = set()
+        for (end_date, _i, t) in keyed:
+            backup = (end_date, select_is_full(t))
+            if backup not in seen:
+                seen.add(backup)
+                backups.append(backup)
 
         index_of_files_to_download = set()
-        for (end_date, is_full) in Timing.sort(
-                                               set(map(create_tuple, times)),
-                                               by_end_date):
-            is_before = Timing.time_diff_in_seconds(restore_point, end_date) <= 0
+        for (end_date, is_full) in backups:
+            is_before = end_date <= restore_point_int
 
             #
             # Each time we encounter a full backup which could serve
@@ -96,11 +116,7 @@ class Timing(object):
             if not is_before:
                 break
 
-        files_to_download = []
-        for stripe in Timing.sort(times, select_end_date):
-            if create_tuple(stripe) in index_of_files_to_download:
-                files_to_download.append(stripe)
-
-        result = Timing.sort(files_to_download, select_end_date)
+        result = [t for (end_date, _i, t) in keyed
+                  if (end_date, select_is_full(t)) in index_of_files_to_download]
         logging.debug("Files which must be fetched for %s: %s", restore_point, str(result))
         return result
@@ -0,0 +1,53 @@
+# coding=utf-8
+
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+# --------------------------------------------------------------------------
+
+"""
+Benchmark for sorting blob names by end timestamp.
+
+Not part of the unit tests, run with
+
+    python -m tests.benchmark_timing [count]
+"""
+import random
+import sys
+import time
+from asebackupcli.naming import Naming
+from asebackupcli.timing import Timing
+
+def synthetic_blob_names(count):
+    """Transaction dumps, every 15 minutes from 2018 on, shuffled."""
+    random.seed(42)
+    start = time.mktime((2018, 1, 1, 0, 0, 0, 0, 0, -1))
+    names = []
+    for i in range(count):
+        end = time.strftime(Timing.time_format, time.localtime(start + 900 * i))
+        names.append(Naming.construct_blobname(
+            dbname="AZU", is_full=False, start_timestamp=end, end_timestamp=end,
+            stripe_index=1, stripe_count=1))
+    random.shuffle(names)
+    return names
+
+def cmp_sort(times, selector):
+    """The former Timing.sort, which parses both time strings per comparison."""
+    return sorted(times, cmp=lambda a, b: Timing.time_diff_in_seconds(selector(b), selector(a)))
+
+def measure(label, sort, names):
+    start = time.time()
+    result = sort(names, lambda name: Naming.parse_blobname(name)[3])
+    duration = time.time() - start
+    print("{:<10} {:>8} names {:>8.2f} s".format(label, len(names), duration))
+    return result, duration
+
+def main(count):
+    names = synthetic_blob_names(count)
+    by_key, key_duration = measure("key", Timing.sort, names)
+    by_cmp, cmp_duration = measure("cmp", cmp_sort, names)
+    assert by_key == by_cmp
+    print("speedup    {:>8.1f}x".format(cmp_duration / key_duration))
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
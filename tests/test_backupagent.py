@@ -6,9 +6,15 @@
 # --------------------------------------------------------------------------
 
 """Unit tests for BackupAgent."""
+import os
+import shutil
+import tempfile
 import unittest
+from azure.common import AzureMissingResourceHttpError
 from asebackupcli.backupagent import BackupAgent
+from asebackupcli.naming import BlobRecord
 from asebackupcli.businesshours import BusinessHours
+from asebackupcli.backupexception import BackupException
 from .test_businesshours import TestBusinessHours
 
 class TestBackupAgent(unittest.TestCase):
@@ -170,3 +176,181 @@ class TestBackupAgent(unittest.TestCase):
                 db_backup_interval_max=db_backup_interval_max),
             True
         )
+
+class FakeCopyProperties(object):
+    """Copy status as returned by the storage SDK."""
+    def __init__(self, status):
+        self.status = status
+        self.status_description = None
+
+class FakeCopyStorageClient(object):
+    """Storage client whose copies complete after a number of status polls."""
+    def __init__(self, polls_until_done, final_status="success"):
+        self.polls = dict()
+        self.polls_until_done = polls_until_done
+        self.final_status = final_status
+        self.deleted = []
+
+    def make_blob_url(self, container_name, blob_name):
+        return "https://account/{}/{}".format(container_name, blob_name)
+
+    def copy_blob(self, container_name, blob_name, copy_source):
+        self.polls[blob_name] = 0
+        return self.copy_status(blob_name)
+
+    def copy_status(self, blob_name):
+        if self.polls[blob_name] < self.polls_until_done:
+            return FakeCopyProperties("pending")
+        return FakeCopyProperties(self.final_status)
+
+    def get_blob_properties(self, container_name, blob_name):
+        self.polls[blob_name] += 1
+        class Properties(object):
+            pass
+        result = Properties()
+        result.properties = Properties()
+        result.properties.copy = self.copy_status(blob_name)
+        return result
+
+    def delete_blob(self, container_name, blob_name):
+        self.deleted.append((container_name, blob_name))
+
+class FakeCommittedStorageClient(object):
+    """Storage client which knows the sizes of some committed blobs."""
+    def __init__(self, committed):
+        self.committed = committed
+
+    def get_blob_properties(self, container_name, blob_name):
+        if blob_name not in self.committed:
+            raise AzureMissingResourceHttpError("The specified blob does not exist.", 404)
+        class Properties(object):
+            pass
+        result = Properties()
+        result.properties = Properties()
+        result.properties.content_length = self.committed[blob_name]
+        return result
+
+class FakeBackupConfiguration(object):
+    """Backup configuration which only carries a storage client."""
+    def __init__(self, storage_client):
+        self.storage_client = storage_client
+        self.azure_storage_container_name = "container"
+
+    @staticmethod
+    def get_backup_max_concurrent_dumps():
+        return 1
+
+class TestBackupAgentMoveBlobs(unittest.TestCase):
+    """Unit tests for BackupAgent.move_blobs"""
+
+    def setUp(self):
+        self.min_interval = BackupAgent.COPY_POLL_MIN_INTERVAL_SECONDS
+        BackupAgent.COPY_POLL_MIN_INTERVAL_SECONDS = 0
+
+    def tearDown(self):
+        BackupAgent.COPY_POLL_MIN_INTERVAL_SECONDS = self.min_interval
+
+    def test_move_blobs_synchronous(self):
+        """Synchronously completed copies are not polled"""
+        client = FakeCopyStorageClient(polls_until_done=0)
+        agent = BackupAgent(FakeBackupConfiguration(client))
+        agent.move_blobs("temp", "dest", [("a", "a2"), ("b", "b2")])
+        self.assertEqual(client.polls, {"a2": 0, "b2": 0})
+        self.assertEqual(client.deleted, [("temp", "a"), ("temp", "b")])
+
+    def test_move_blobs_pending(self):
+        """Pending copies are polled until they succeed"""
+        client = FakeCopyStorageClient(polls_until_done=2)
+        agent = BackupAgent(FakeBackupConfiguration(client))
+        agent.move_blobs("temp", "dest", [("a", "a2")])
+        self.assertEqual(client.polls, {"a2": 2})
+        self.assertEqual(client.deleted, [("temp", "a")])
+
+    def test_move_blobs_failed(self):
+        """Failed copies raise and keep the source"""
+        client = FakeCopyStorageClient(polls_until_done=1, final_status="failed")
+        agent = BackupAgent(FakeBackupConfiguration(client))
+        self.assertRaises(BackupException, agent.move_blobs, "temp", "dest", [("a", "a2")])
+        self.assertEqual(client.deleted, [])
+
+class FakeCatalog(object):
+    """In-memory catalog which counts queries."""
+    def __init__(self, blob_names):
+        self.blob_names = list(blob_names)
+        self.queries = 0
+
+    def blobs(self, databases=None, is_full=None):
+        self.queries += 1
+        return [BlobRecord.parse(name, 0) for name in self.blob_names]
+
+    def add(self, record):
+        self.blob_names.append(record.blob_name)
+
+    def remove(self, blob_name):
+        self.blob_names.remove(blob_name)
+
+class TestBackupAgentInventory(unittest.TestCase):
+    """Unit tests for the per-invocation backup inventory"""
+
+    def test_latest_backup_timestamp(self):
+        """All decisions of a run read one snapshot, which follows our own uploads"""
+        agent = BackupAgent(FakeBackupConfiguration(None))
+        agent._catalog = FakeCatalog([
+            "AZU_tran_20180101_010000--20180101_010100_S001-001.cdmp",
+            "AZU_full_20180101_000000--20180101_003000_S001-001.cdmp"])
+
+        self.assertEqual(agent.latest_backup_timestamp("AZU", False), "20180101_010100")
+        self.assertEqual(agent.latest_backup_timestamp("AZU", True), "20180101_003000")
+        self.assertEqual(agent.latest_backup_timestamp("ABC", True), "19000101_000000")
+
+        agent.record_uploaded_blob("AZU_tran_20180101_020000--20180101_020100_S001-001.cdmp", 10)
+        self.assertEqual(agent.latest_backup_timestamp("AZU", False), "20180101_020100")
+        agent.record_deleted_blob("AZU_tran_20180101_020000--20180101_020100_S001-001.cdmp")
+        self.assertEqual(agent.latest_backup_timestamp("AZU", False), "20180101_010100")
+        self.assertEqual(agent._catalog.queries, 1)
+
+class TestBackupAgentLocalFiles(unittest.TestCase):
+    """Unit tests for the pickup of dump files left in the output directory"""
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_leftover_journal_is_not_a_dump(self):
+        """The journal of an interrupted upload is not uploaded as an ASE-generated dump"""
+        journal = os.path.join(self.tempdir, "AZ3_trans_20181130_141532_S01-01.cdmp.journal")
+        with open(journal, "w") as stream:
+            stream.write("{}")
+        agent = BackupAgent(FakeBackupConfiguration(None))
+        agent.upload_local_backup_files_from_previous_operations(output_dir=self.tempdir)
+        self.assertEqual(os.listdir(self.tempdir), [os.path.basename(journal)])
+
+    def test_resume_interrupted_uploads(self):
+        """Each leftover dump is resumed on its own, and committed blobs are not uploaded again"""
+        names = ["AZU_full_20180101_000000--20180101_003000_S001-001.cdmp",
+                 "ABC_full_20180101_000000--20180101_003000_S001-001.cdmp",
+                 "XYZ_full_20180101_000000--20180101_003000_S001-001.cdmp",
+                 "AZU_tran_20180101_010000--20180101_010100_S001-001.cdmp"]
+        for name in names:
+            with open(os.path.join(self.tempdir, name), "w") as stream:
+                stream.write("dump")
+        agent = BackupAgent(FakeBackupConfiguration(FakeCommittedStorageClient({names[1]: 4})))
+        agent._catalog = FakeCatalog([])
+        uploaded = []
+        notified = []
+        def upload_files(files):
+            for (blob_name, file_path) in files:
+                if blob_name == names[0]:
+                    raise BackupException("Upload failed for {}".format(file_path))
+                uploaded.append(blob_name)
+                os.remove(file_path)
+        agent.upload_files = upload_files
+        agent.send_notification = lambda **kwargs: notified.append((kwargs["dbname"], kwargs["success"]))
+
+        agent.resume_interrupted_uploads(output_dir=self.tempdir, is_full=True)
+        self.assertEqual(uploaded, [names[2]])
+        self.assertEqual(notified, [("AZU", False)])
+        self.assertEqual(agent._catalog.blob_names, [names[1]])
+        self.assertEqual(sorted(os.listdir(self.tempdir)), [names[0], names[3]])
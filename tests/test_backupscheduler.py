@@ -0,0 +1,77 @@
+# coding=utf-8
+
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+# --------------------------------------------------------------------------
+
+"""Unit tests for BackupScheduler."""
+import threading
+import time
+import unittest
+from asebackupcli.backupscheduler import BackupScheduler, BackupJob
+from asebackupcli.backupexception import BackupException
+
+class RecordingJobRunner(object):
+    """Runs jobs for a short while, and records what ran concurrently."""
+    def __init__(self, failing=()):
+        self.failing = failing
+        self.lock = threading.Lock()
+        self.running = []
+        self.started = []
+        self.peak_dumps = 0
+        self.peak_stripes = 0
+
+    def __call__(self, job):
+        with self.lock:
+            self.started.append(job.dbname)
+            self.running.append(job)
+            self.peak_dumps = max(self.peak_dumps, len(self.running))
+            self.peak_stripes = max(self.peak_stripes, sum([j.stripe_count for j in self.running]))
+        try:
+            time.sleep(0.05)
+            if job.dbname in self.failing:
+                raise BackupException("dump of {} failed".format(job.dbname))
+        finally:
+            with self.lock:
+                self.running.remove(job)
+
+class TestBackupScheduler(unittest.TestCase):
+    """Unit tests for class BackupScheduler."""
+
+    def test_caps(self):
+        """Concurrent dumps stay within the dump and stripe caps"""
+        runner = RecordingJobRunner()
+        jobs = [BackupJob("db{}".format(i), stripe_count=2, expected_size=i) for i in range(8)]
+        BackupScheduler(run_job=runner, max_concurrent_dumps=3, max_total_stripes=4).run(jobs)
+        self.assertEqual(sorted(runner.started), sorted([job.dbname for job in jobs]))
+        self.assertEqual(runner.peak_dumps, 2)
+        self.assertEqual(runner.peak_stripes, 4)
+
+    def test_largest_first_and_backfill(self):
+        """Small jobs fill the stripes which the largest one leaves free"""
+        runner = RecordingJobRunner()
+        jobs = [BackupJob("small1", 1, 10), BackupJob("huge", 6, 1000), BackupJob("big", 4, 500), BackupJob("small2", 1, 20)]
+        BackupScheduler(run_job=runner, max_concurrent_dumps=4, max_total_stripes=8).run(jobs)
+        self.assertEqual(runner.started[0], "huge")
+        self.assertEqual(set(runner.started[1:3]), set(["small1", "small2"]))
+        self.assertEqual(runner.started[3], "big")
+
+    def test_oversized_job_runs_alone(self):
+        """A job with more stripes than the budget still runs"""
+        runner = RecordingJobRunner()
+        BackupScheduler(run_job=runner, max_concurrent_dumps=2, max_total_stripes=4).run(
+            [BackupJob("huge", 8, 1000), BackupJob("small", 1, 10)])
+        self.assertEqual(runner.started, ["huge", "small"])
+        self.assertEqual(runner.peak_dumps, 1)
+
+    def test_errors_are_aggregated(self):
+        """Failed jobs do not stop the others, and are reported together"""
+        runner = RecordingJobRunner(failing=("a", "c"))
+        jobs = [BackupJob(dbname, 1, 1) for dbname in ["a", "b", "c", "d"]]
+        scheduler = BackupScheduler(run_job=runner, max_concurrent_dumps=2, max_total_stripes=8)
+        with self.assertRaises(BackupException) as context:
+            scheduler.run(jobs)
+        self.assertEqual(sorted(runner.started), ["a", "b", "c", "d"])
+        self.assertIn("2 of 4", str(context.exception))
+        self.assertEqual(sorted([dbname for (dbname, _exception) in scheduler.errors]), ["a", "c"])
@@ -0,0 +1,210 @@
+# coding=utf-8
+
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+# --------------------------------------------------------------------------
+
+"""Unit tests for BlobCatalog."""
+import os
+import shutil
+import sqlite3
+import threading
+import tempfile
+import unittest
+from azure.storage.blob.models import BlobPrefix
+from asebackupcli.blobcatalog import BlobCatalog
+from asebackupcli.naming import BlobRecord
+from asebackupcli.stripeplanner import BackupRun
+
+class FakeBlobProperties(object):
+    def __init__(self, content_length):
+        self.content_length = content_length
+
+class FakeBlob(object):
+    def __init__(self, name, content_length):
+        self.name = name
+        self.properties = FakeBlobProperties(content_length)
+
+class FakeListResult(list):
+    def __init__(self, blobs, next_marker):
+        list.__init__(self, blobs)
+        self.next_marker = next_marker
+
+def blob_prefix(name):
+    prefix = BlobPrefix()
+    prefix.name = name
+    return prefix
+
+class FakeListStorageClient(object):
+    """Lists blobs in pages of two. With a delimiter, the names are collapsed into prefixes."""
+    def __init__(self, blob_names):
+        self.blob_names = blob_names
+        self.list_calls = 0
+        self.listed_prefixes = []
+
+    def list_blobs(self, container_name, prefix=None, marker=None, delimiter=None, **_kwargs):
+        self.list_calls += 1
+        self.listed_prefixes.append(prefix)
+        names = [name for name in self.blob_names if name.startswith(prefix or "")]
+        start = int(marker or 0)
+        if delimiter is not None:
+            items = []
+            for name in names:
+                rest = name[len(prefix or ""):]
+                if delimiter not in rest:
+                    items.append(FakeBlob(name, 100))
+                    continue
+                item = (prefix or "") + rest[:rest.index(delimiter) + 1]
+                if item not in [i.name for i in items]:
+                    items.append(blob_prefix(item))
+            next_marker = str(start + 2) if start + 2 < len(items) else None
+            return FakeListResult(items[start:start + 2], next_marker)
+        page = [FakeBlob(name, 100) for name in names[start:start + 2]]
+        next_marker = str(start + 2) if start + 2 < len(names) else None
+        return FakeListResult(page, next_marker)
+
+class WritingListStorageClient(FakeListStorageClient):
+    """Writes to the catalog file from another connection during each listing call, like the other backup process."""
+    def __init__(self, blob_names, path):
+        FakeListStorageClient.__init__(self, blob_names)
+        self.path = path
+        self.errors = []
+        self.lock = threading.Lock()
+
+    def list_blobs(self, container_name, prefix=None, marker=None, **kwargs):
+        # The listing threads take turns, so only the catalog can hold the lock.
+        with self.lock:
+            connection = sqlite3.connect(self.path, timeout=0)
+            try:
+                with connection:
+                    connection.execute("insert or replace into state (key, value) values ('other', 'process')")
+            except sqlite3.OperationalError as exception:
+                self.errors.append(exception)
+            finally:
+                connection.close()
+        return FakeListStorageClient.list_blobs(self, container_name, prefix=prefix, marker=marker, **kwargs)
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def latest_end_timestamp(catalog, dbname, is_full):
+    records = catalog.blobs(databases=[dbname], is_full=is_full)
+    return records[-1].end_timestamp if records else None
+
+class TestBlobCatalog(unittest.TestCase):
+    """Unit tests for class BlobCatalog."""
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.client = FakeListStorageClient([
+            "AZU_full_20180101_000000--20180101_010000_S001-001.cdmp",
+            "AZU_tran_20180101_020000--20180101_020100_S001-001.cdmp",
+            "AZU_tran_20180101_030000--20180101_030100_S001-001.cdmp",
+            "AZU_ddlgen_20180101_000000.txt",
+            "AZU_X_full_20180102_000000--20180102_010000_S001-001.cdmp",
+        ])
+        self.clock = FakeClock()
+        self.catalog = BlobCatalog(path=os.path.join(self.tempdir, "catalog.db"),
+                                   storage_client=self.client, container_name="c",
+                                   reconcile_seconds=3600, clock=self.clock)
+
+    def tearDown(self):
+        self.catalog.close()
+        shutil.rmtree(self.tempdir)
+
+    def test_queries_after_reconcile(self):
+        """The catalog is filled from one listing and answers queries locally"""
+        self.assertEqual(latest_end_timestamp(self.catalog, "AZU", is_full=False), "20180101_030100")
+        self.assertEqual(latest_end_timestamp(self.catalog, "AZU", is_full=True), "20180101_010000")
+        self.assertEqual(latest_end_timestamp(self.catalog, "AZU_X", is_full=False), None)
+        self.assertEqual([b.blob_name for b in self.catalog.blobs(databases=["AZU"])], [
+            "AZU_full_20180101_000000--20180101_010000_S001-001.cdmp",
+            "AZU_tran_20180101_020000--20180101_020100_S001-001.cdmp",
+            "AZU_tran_20180101_030000--20180101_030100_S001-001.cdmp"])
+        self.assertEqual(len(self.catalog.blobs()), 4)
+        self.assertEqual(self.client.list_calls, 4)
+
+    def test_incremental_updates(self):
+        """Own uploads and deletes are visible without listing again"""
+        self.catalog.ensure_fresh()
+        self.catalog.add(BlobRecord.parse("AZU_tran_20180101_040000--20180101_040100_S001-001.cdmp", 42))
+        self.catalog.remove("AZU_full_20180101_000000--20180101_010000_S001-001.cdmp")
+
+        self.assertEqual(latest_end_timestamp(self.catalog, "AZU", is_full=False), "20180101_040100")
+        self.assertEqual(latest_end_timestamp(self.catalog, "AZU", is_full=True), None)
+        self.assertEqual(self.client.list_calls, 4)
+
+    def test_backup_runs(self):
+        """Backup runs are kept per kind, newest first, and survive a reconcile"""
+        self.catalog.add_run(BackupRun("AZU", True, False, 2, 100, 10.0, "20180101_010000"))
+        self.catalog.add_run(BackupRun("AZU", True, False, 4, 100, 5.0, "20180102_010000"))
+        self.catalog.add_run(BackupRun("AZU", False, False, 1, 10, 1.0, "20180102_020000"))
+        self.catalog.add_run(BackupRun("AZU", True, True, 4, 100, 4.0, "20180103_010000"))
+        self.catalog.reconcile()
+
+        runs = self.catalog.runs(is_full=True, use_streaming=False)
+        self.assertEqual([(run.stripe_count, run.seconds, run.is_full) for run in runs], [(4, 5.0, True), (2, 10.0, True)])
+        self.assertEqual(len(self.catalog.runs(is_full=True, use_streaming=False, limit=1)), 1)
+
+    def test_reconcile_does_not_lock_during_listing(self):
+        """Other processes can write to the catalog while the container is listed"""
+        path = os.path.join(self.tempdir, "locking.db")
+        client = WritingListStorageClient(self.client.blob_names, path)
+        catalog = BlobCatalog(path=path, storage_client=client, container_name="c", clock=self.clock)
+        try:
+            catalog.ensure_fresh()
+            catalog.reconcile(databases=["AZU"])
+        finally:
+            catalog.close()
+        self.assertEqual(client.errors, [])
+        self.assertTrue(client.list_calls > 1)
+
+    def test_reconcile_all_databases_by_prefix(self):
+        """A full reconcile lists the prefix of each database, including ones the catalog does not know"""
+        self.catalog.ensure_fresh()
+        self.client.blob_names.extend([
+            "ABC_full_20180101_000000--20180101_010000_S001-001.cdmp",
+            "DEF_tran_20180101_000000--20180101_000100_S001-001.cdmp",
+            "readme.txt"])
+        self.client.listed_prefixes = []
+        self.catalog.reconcile()
+
+        self.assertEqual(sorted(self.client.listed_prefixes[2:]), ["ABC_", "AZU_", "AZU_", "AZU_", "DEF_"])
+        self.assertEqual(len(self.catalog.blobs()), 6)
+        self.assertEqual(self.catalog.connection.execute(
+            "select count(*) from sqlite_temp_master where name = 'staged_blobs'").fetchone()[0], 0)
+
+    def test_reconcile_when_stale(self):
+        """After reconcile_seconds, the catalog is compared with storage again"""
+        self.catalog.ensure_fresh()
+        self.catalog.add(BlobRecord.parse("AZU_tran_20180101_040000--20180101_040100_S001-001.cdmp", 42))
+        self.clock.now += 3601
+        self.assertEqual(latest_end_timestamp(self.catalog, "AZU", is_full=False), "20180101_030100")
+        self.assertEqual(self.client.list_calls, 6)
+
+    def test_reconcile_selected_databases(self):
+        """A query for some databases only lists their prefixes, and keeps the other databases"""
+        self.catalog.ensure_fresh()
+        self.clock.now += 3601
+        self.client.blob_names.append("AZU_X_full_20180103_000000--20180103_010000_S001-001.cdmp")
+        self.client.blob_names.remove("AZU_full_20180101_000000--20180101_010000_S001-001.cdmp")
+
+        self.assertEqual([b.blob_name for b in self.catalog.blobs(databases=["AZU"], is_full=True)], [])
+        self.assertEqual(self.client.list_calls, 6)
+        self.assertEqual([b.blob_name for b in self.catalog.blobs(databases=["AZU"], is_full=False)], [
+            "AZU_tran_20180101_020000--20180101_020100_S001-001.cdmp",
+            "AZU_tran_20180101_030000--20180101_030100_S001-001.cdmp"])
+        self.assertEqual(self.client.list_calls, 6)
+        self.assertEqual(len(self.catalog.connection.execute("select * from blobs where dbname = 'AZU_X'").fetchall()), 1)
+
+    def test_prune_set(self):
+        """Dumps which ended before the cutoff, restricted to the selected databases"""
+        self.assertEqual([b.blob_name for b in self.catalog.blobs_ending_before("20180101_030000", databases=["AZU"])], [
+            "AZU_full_20180101_000000--20180101_010000_S001-001.cdmp",
+            "AZU_tran_20180101_020000--20180101_020100_S001-001.cdmp"])
+        self.assertEqual(self.catalog.blobs_ending_before("20180103_000000", databases=[]), [])
@@ -0,0 +1,124 @@
+# coding=utf-8
+
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+# --------------------------------------------------------------------------
+
+"""Unit tests for BlobDownloader and RestoreStreamingThread."""
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from collections import namedtuple
+from asebackupcli.blobdownloader import BlobDownloader
+from asebackupcli.restorestreamingthread import RestoreStreamingThread
+from asebackupcli.backupexception import BackupException
+
+FakeBlob = namedtuple("FakeBlob", ["content"])
+
+class FakeDownloadStorageClient(object):
+    """Serves ranges of in-memory blobs, and records the concurrency."""
+    def __init__(self, blobs, fail_blob=None):
+        self.blobs = blobs
+        self.fail_blob = fail_blob
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+        self.requests = 0
+
+    def get_blob_to_bytes(self, container_name, blob_name, start_range, end_range, **_kwargs):
+        with self.lock:
+            self.active += 1
+            self.requests += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(0.01)
+            if blob_name == self.fail_blob:
+                raise Exception("Simulated failure for blob {}".format(blob_name))
+            return FakeBlob(self.blobs[blob_name][start_range:end_range + 1])
+        finally:
+            with self.lock:
+                self.active -= 1
+
+class TestBlobDownloader(unittest.TestCase):
+    """Unit tests for class BlobDownloader."""
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.blobs = {
+            "stripe1": os.urandom(1000),
+            "stripe2": os.urandom(999),
+            "tran": os.urandom(10),
+            "empty": b""
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def files(self):
+        return [(name, os.path.join(self.tempdir, name), len(content)) for (name, content) in sorted(self.blobs.items())]
+
+    def test_download(self):
+        """All files are downloaded in ranges, with at most max_connections requests at a time"""
+        client = FakeDownloadStorageClient(self.blobs)
+        downloaded = []
+        downloader = BlobDownloader(storage_client=client, container_name="c", max_connections=3,
+                                    range_size=100, on_file_downloaded=lambda d: downloaded.append(d.blob_name))
+        downloader.download(self.files())
+
+        for (name, content) in self.blobs.items():
+            with open(os.path.join(self.tempdir, name), "rb") as stream:
+                self.assertEqual(stream.read(), content)
+        self.assertEqual(sorted(downloaded), sorted(self.blobs.keys()))
+        self.assertEqual(client.requests, 10 + 10 + 1)
+        self.assertTrue(1 < client.max_active <= 3)
+
+    def test_failure(self):
+        """A failed range stops the download, and is reported"""
+        client = FakeDownloadStorageClient(self.blobs, fail_blob="stripe2")
+        downloader = BlobDownloader(storage_client=client, container_name="c", max_connections=2, range_size=100)
+        with self.assertRaises(BackupException) as context:
+            downloader.download(self.files())
+        self.assertTrue("stripe2" in str(context.exception))
+        self.assertFalse("stripe1" in str(context.exception))
+
+class TestRestoreStreamingThread(unittest.TestCase):
+    """Unit tests for class RestoreStreamingThread."""
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.pipe_path = os.path.join(self.tempdir, "restore_pipe")
+        os.mkfifo(self.pipe_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_stream_into_pipe(self):
+        """The blob arrives in order through the pipe"""
+        content = os.urandom(1000)
+        client = FakeDownloadStorageClient({"stripe1": content})
+        thread = RestoreStreamingThread(storage_client=client, container_name="c", blob_name="stripe1",
+                                        pipe_path=self.pipe_path, size=len(content), range_size=128)
+        thread.start()
+        with open(self.pipe_path, "rb") as stream:
+            received = stream.read()
+        thread.join(5)
+        self.assertEqual(received, content)
+        self.assertEqual(client.requests, 8)
+        self.assertEqual(thread.get_exception(), None)
+
+    def test_stop_without_reader(self):
+        """A thread waiting for ASE to open the pipe has only prefetched its first range, and can be stopped"""
+        client = FakeDownloadStorageClient({"stripe1": b"xy"})
+        thread = RestoreStreamingThread(storage_client=client, container_name="c", blob_name="stripe1",
+                                        pipe_path=self.pipe_path, size=2, range_size=1)
+        thread.start()
+        time.sleep(0.1)
+        thread.stop()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertTrue(thread.get_exception() is not None)
+        self.assertEqual(client.requests, 1)
@@ -0,0 +1,38 @@
+# coding=utf-8
+
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+# --------------------------------------------------------------------------
+
+"""Unit tests for ParallelBlobLister."""
+import unittest
+from asebackupcli.bloblister import ParallelBlobLister
+from tests.test_blobcatalog import FakeListStorageClient
+
+class FailingStorageClient(FakeListStorageClient):
+    def list_blobs(self, container_name, prefix=None, marker=None, **kwargs):
+        if prefix == "BAD_":
+            raise Exception("Simulated listing failure")
+        return FakeListStorageClient.list_blobs(self, container_name, prefix=prefix, marker=marker, **kwargs)
+
+class TestParallelBlobLister(unittest.TestCase):
+    """Unit tests for class ParallelBlobLister."""
+
+    BLOB_NAMES = ["A_{:03d}".format(i) for i in range(7)] + ["B_{:03d}".format(i) for i in range(5)] + ["C_000"]
+
+    def test_merge_all_prefixes(self):
+        """Every blob of every prefix is reported exactly once"""
+        client = FakeListStorageClient(TestParallelBlobLister.BLOB_NAMES)
+        lister = ParallelBlobLister(storage_client=client, container_name="c",
+                                    prefixes=["A_", "B_", "C_", "D_"], max_connections=2)
+        names = sorted([blob.name for blob in lister.blobs()])
+        self.assertEqual(names, TestParallelBlobLister.BLOB_NAMES)
+        self.assertEqual(client.list_calls, 4 + 3 + 1 + 1)
+
+    def test_failure(self):
+        """A failed listing is raised to the consumer"""
+        client = FailingStorageClient(TestParallelBlobLister.BLOB_NAMES)
+        lister = ParallelBlobLister(storage_client=client, container_name="c",
+                                    prefixes=["A_", "BAD_"], max_connections=2)
+        self.assertRaises(Exception, lambda: list(lister.blobs()))
@@ -0,0 +1,66 @@
+# coding=utf-8
+
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+# --------------------------------------------------------------------------
+
+"""Unit tests for BlockSizer."""
+import unittest
+from asebackupcli.blocksizer import BlockSizer
+from asebackupcli.bufferpool import BufferPool
+
+MB = 1024 * 1024
+
+class FakeClock(object):
+    """A clock which only moves when told to."""
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+class TestBlockSizer(unittest.TestCase):
+    """Unit tests for class BlockSizer."""
+
+    def test_initial_size_from_expected_size(self):
+        """Large stripes start with blocks large enough for the block limit"""
+        pool = BufferPool(buffer_size=4 * MB, memory_budget=256 * MB)
+        sizer = BlockSizer(min_block_size=4 * MB, expected_stripe_size=1024 * 1024 * MB, buffer_pool=pool)
+        self.assertEqual(sizer.block_size, 64 * MB)
+        self.assertEqual(pool.buffer_size, 64 * MB)
+        self.assertTrue(BlockSizer.MAX_BLOCKS * sizer.block_size >= 2 * 1024 * 1024 * MB)
+
+    def test_grow_for_throughput(self):
+        """Blocks grow until a request takes about TARGET_REQUEST_SECONDS per connection"""
+        clock = FakeClock()
+        sizer = BlockSizer(min_block_size=4 * MB, connections=4, clock=clock)
+        sizer.update(4 * MB, 1)
+        for i in range(2, 102):
+            clock.now += 0.1
+            self.assertTrue(sizer.update(4 * MB, i) >= 4 * MB)
+
+        # 40 MB/s over 4 connections, 2 seconds per request: 20 MB, rounded up to 32 MB
+        self.assertEqual(sizer.block_size, 32 * MB)
+
+    def test_grow_limited_by_memory(self):
+        """Growing for throughput respects the memory limit"""
+        clock = FakeClock()
+        sizer = BlockSizer(min_block_size=4 * MB, connections=1, clock=clock,
+                           max_throughput_block_size=8 * MB)
+        sizer.update(4 * MB, 1)
+        clock.now += 20
+        sizer.update(1000 * MB, 2)
+        self.assertEqual(sizer.block_size, 8 * MB)
+
+    def test_grow_for_block_limit(self):
+        """An underestimated stripe still fits into the block limit"""
+        sizer = BlockSizer(min_block_size=4 * MB, clock=FakeClock())
+        total = 0
+        block_size = sizer.block_size
+        for i in range(1, BlockSizer.MAX_BLOCKS):
+            total += block_size
+            block_size = sizer.update(block_size, i)
+            if total > 500 * 1024 * MB:
+                break
+        self.assertTrue(total > 500 * 1024 * MB)
@@ -0,0 +1,419 @@
+# coding=utf-8
+
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+# --------------------------------------------------------------------------
+
+"""Unit tests for BlockUploader, StreamingThread and FileUploader."""
+import os
+import hashlib
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from collections import namedtuple
+from asebackupcli.blockuploader import BlockUploader
+from asebackupcli.bufferpool import BufferPool, BlockReader
+from asebackupcli.streamingthread import StreamingThread
+from asebackupcli.tailingthread import TailingThread
+from asebackupcli.cancellation import CancellationToken
+from asebackupcli.fileuploader import FileUploader, ConcurrentFileUploader
+from asebackupcli.blockjournal import BlockJournal
+from asebackupcli.backupexception import BackupException
+
+FakeBlock = namedtuple("FakeBlock", ["id", "size"])
+FakeBlockList = namedtuple("FakeBlockList", ["uncommitted_blocks"])
+
+class FakeStorageClient(object):
+    """Records staged blocks and committed block lists in memory."""
+    def __init__(self, fail_on_block=None):
+        self.lock = threading.Lock()
+        self.staged = {}
+        self.committed = {}
+        self.metadata = {}
+        self.fail_on_block = fail_on_block
+        self.put_count = 0
+
+    def put_block(self, container_name, blob_name, block, block_id, **_kwargs):
+        if block_id == self.fail_on_block:
+            raise Exception("Simulated failure for block {}".format(block_id))
+        data = block.read() if hasattr(block, 'read') else bytes(block)
+        with self.lock:
+            self.staged[(container_name, blob_name, block_id)] = data
+            self.put_count += 1
+
+    def get_block_list(self, container_name, blob_name, **_kwargs):
+        with self.lock:
+            return FakeBlockList([FakeBlock(id=k[2], size=len(v)) for (k, v) in self.staged.items()
+                                  if k[0] == container_name and k[1] == blob_name])
+
+    def put_block_list(self, container_name, blob_name, block_list, metadata=None, **_kwargs):
+        with self.lock:
+            self.metadata[(container_name, blob_name)] = metadata
+            self.committed[(container_name, blob_name)] = b"".join(
+                [self.staged[(container_name, blob_name, b.id)] for b in block_list])
+
+    def blob_content(self, container_name, blob_name):
+        return self.committed[(container_name, blob_name)]
+
+class SlowStorageClient(FakeStorageClient):
+    """Tracks the number of concurrent put_block calls across all blobs."""
+    def __init__(self, fail_on_blob=None):
+        FakeStorageClient.__init__(self)
+        self.fail_on_blob = fail_on_blob
+        self.active = 0
+        self.max_active = 0
+
+    def put_block(self, container_name, blob_name, block, block_id, **kwargs):
+        if blob_name == self.fail_on_blob:
+            raise Exception("Simulated failure for blob {}".format(blob_name))
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(0.001)
+        with self.lock:
+            self.active -= 1
+        FakeStorageClient.put_block(self, container_name, blob_name, block, block_id, **kwargs)
+
+class TestBlockUploader(unittest.TestCase):
+    """Unit tests for class BlockUploader."""
+
+    def test_block_id(self):
+        """Test BlockUploader.block_id"""
+        self.assertEqual(BlockUploader.block_id(0), '00000000')
+        self.assertEqual(len(BlockUploader.block_id(49999)), len(BlockUploader.block_id(1)))
+
+    def test_upload_in_order(self):
+        """Blocks staged from several connections are committed in original order"""
+        client = FakeStorageClient()
+        uploader = BlockUploader(storage_client=client, container_name="c", blob_name="b",
+                                 max_connections=3, max_queued_blocks=2)
+        uploader.start()
+        for i in range(50):
+            uploader.put("block{:02d};".format(i))
+        uploader.commit()
+
+        self.assertEqual(
+            client.blob_content("c", "b"),
+            "".join(["block{:02d};".format(i) for i in range(50)]))
+
+    def test_upload_memoryview(self):
+        """Pooled buffers are released once their block is staged"""
+        client = FakeStorageClient()
+        pool = BufferPool(buffer_size=4, memory_budget=8)
+        uploader = BlockUploader(storage_client=client, container_name="c", blob_name="b",
+                                 max_connections=2, max_queued_blocks=2)
+        uploader.start()
+        for i in range(20):
+            block_buffer = pool.acquire()
+            block_buffer[0:4] = "{:04d}".format(i)
+            uploader.put(memoryview(block_buffer)[0:3], release=lambda b=block_buffer: pool.release(b))
+        uploader.commit()
+
+        self.assertEqual(client.blob_content("c", "b"), "".join(["{:04d}".format(i)[0:3] for i in range(20)]))
+        self.assertEqual(uploader.sha256, hashlib.sha256(client.blob_content("c", "b")).hexdigest())
+        self.assertEqual(len(pool.free), 2)
+        self.assertEqual(pool.in_use, 0)
+        self.assertEqual(pool.peak_in_use, 8)
+
+    def test_upload_failure(self):
+        """A failing put_block prevents the commit"""
+        client = FakeStorageClient(fail_on_block=BlockUploader.block_id(3))
+        uploader = BlockUploader(storage_client=client, container_name="c", blob_name="b",
+                                 max_connections=2, max_queued_blocks=1)
+        uploader.start()
+        for i in range(10):
+            try:
+                uploader.put("x{}".format(i))
+            except Exception:
+                break
+        self.assertRaises(Exception, uploader.commit)
+        self.assertEqual(client.committed, {})
+
+class TestBlockReader(unittest.TestCase):
+    """Unit tests for class BlockReader."""
+
+    def test_read_and_seek(self):
+        """BlockReader behaves like a seekable stream over the view"""
+        reader = BlockReader(memoryview(bytearray("0123456789"))[2:8])
+        self.assertEqual(len(reader), 6)
+        self.assertEqual(reader.read(4), "2345")
+        self.assertEqual(reader.tell(), 4)
+        self.assertEqual(reader.read(), "67")
+        self.assertEqual(reader.read(4), "")
+        reader.seek(0)
+        self.assertEqual(reader.read(), "234567")
+
+class TestStreamingThread(unittest.TestCase):
+    """Unit tests for class StreamingThread."""
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_streaming_upload(self):
+        """Stream a file through the block uploader"""
+        content = os.urandom(100 * 1024 + 17)
+        pipe_path = os.path.join(self.tempdir, "backup_AZU_full_001_001.cdmp_pipe")
+        with open(pipe_path, "wb") as pipe:
+            pipe.write(content)
+
+        client = FakeStorageClient()
+        pool = BufferPool(buffer_size=4096, memory_budget=3 * 4096)
+        thread = StreamingThread(storage_client=client, container_name="c", blob_name="b",
+                                 pipe_path=pipe_path, buffer_pool=pool, max_connections=4)
+        thread.start()
+        thread.join()
+
+        self.assertEqual(thread.get_exception(), None)
+        self.assertEqual(client.blob_content("c", "b"), content)
+        self.assertEqual(client.metadata[("c", "b")], {"sha256": hashlib.sha256(content).hexdigest()})
+        self.assertFalse(os.path.exists(pipe_path))
+        self.assertTrue(pool.peak_in_use <= 3 * 4096)
+
+    def test_streaming_upload_fifo(self):
+        """Stream through a named pipe, like ASE does"""
+        content = os.urandom(64 * 1024 + 5)
+        pipe_path = os.path.join(self.tempdir, "backup_AZU_full_001_001.cdmp_pipe")
+        os.mkfifo(pipe_path)
+
+        client = FakeStorageClient()
+        pool = BufferPool(buffer_size=4096, memory_budget=2 * 4096)
+        thread = StreamingThread(storage_client=client, container_name="c", blob_name="b",
+                                 pipe_path=pipe_path, buffer_pool=pool, max_connections=2)
+        thread.start()
+        with open(pipe_path, "wb") as pipe:
+            pipe.write(content)
+        thread.join(10)
+
+        self.assertEqual(thread.get_exception(), None)
+        self.assertEqual(client.blob_content("c", "b"), content)
+
+    def test_stop_without_writer(self):
+        """A stopped thread releases the pipe even when ASE never opened it"""
+        pipe_path = os.path.join(self.tempdir, "backup_AZU_full_001_001.cdmp_pipe")
+        os.mkfifo(pipe_path)
+
+        client = FakeStorageClient()
+        token = CancellationToken()
+        thread = StreamingThread(storage_client=client, container_name="c", blob_name="b",
+                                 pipe_path=pipe_path, buffer_pool=BufferPool(4096, 4096),
+                                 cancellation_token=token)
+        thread.start()
+        thread.stop()
+        thread.join(5)
+
+        self.assertFalse(thread.is_alive())
+        self.assertTrue(token.is_cancelled())
+        self.assertTrue(isinstance(thread.get_exception(), BackupException))
+        self.assertEqual(client.committed, {})
+        self.assertFalse(os.path.exists(pipe_path))
+
+    def test_deadline(self):
+        """An exceeded deadline aborts the upload"""
+        pipe_path = os.path.join(self.tempdir, "backup_AZU_full_001_001.cdmp_pipe")
+        os.mkfifo(pipe_path)
+
+        client = FakeStorageClient()
+        thread = StreamingThread(storage_client=client, container_name="c", blob_name="b",
+                                 pipe_path=pipe_path, buffer_pool=BufferPool(4096, 4096),
+                                 cancellation_token=CancellationToken(timeout_seconds=0.5))
+        thread.start()
+        thread.join(5)
+
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(thread.get_exception().message, "Deadline exceeded")
+        self.assertEqual(client.committed, {})
+
+class TestTailingThread(unittest.TestCase):
+    """Unit tests for class TailingThread."""
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.poll_interval = TailingThread.POLL_INTERVAL_SECONDS
+        TailingThread.POLL_INTERVAL_SECONDS = 0.01
+
+    def tearDown(self):
+        TailingThread.POLL_INTERVAL_SECONDS = self.poll_interval
+        shutil.rmtree(self.tempdir)
+
+    def test_upload_growing_file(self):
+        """Blocks are staged while the file grows, and committed after finish()"""
+        file_path = os.path.join(self.tempdir, "AZU_full_20180629_124500_S001-001.cdmp")
+        client = FakeStorageClient()
+        thread = TailingThread(storage_client=client, container_name="c", blob_name="b",
+                               file_path=file_path, buffer_pool=BufferPool(1024, 4 * 1024))
+        thread.start()
+
+        chunks = [os.urandom(700) for _ in range(10)]
+        with open(file_path, "wb") as dump:
+            for chunk in chunks:
+                dump.write(chunk)
+                dump.flush()
+                time.sleep(0.005)
+            self.assertEqual(client.committed, {})
+        thread.finish()
+        thread.join(10)
+
+        content = b"".join(chunks)
+        self.assertEqual(thread.get_exception(), None)
+        self.assertEqual(client.blob_content("c", "b"), content)
+        self.assertEqual(thread.sha256, hashlib.sha256(content).hexdigest())
+        self.assertTrue(os.path.exists(file_path))
+
+    def test_stop(self):
+        """A stopped thread commits nothing"""
+        file_path = os.path.join(self.tempdir, "AZU_full_20180629_124500_S001-001.cdmp")
+        client = FakeStorageClient()
+        thread = TailingThread(storage_client=client, container_name="c", blob_name="b",
+                               file_path=file_path, buffer_pool=BufferPool(1024, 4 * 1024))
+        thread.start()
+        thread.stop()
+        thread.join(5)
+
+        self.assertFalse(thread.is_alive())
+        self.assertTrue(isinstance(thread.get_exception(), BackupException))
+        self.assertEqual(client.committed, {})
+
+class TestFileUploader(unittest.TestCase):
+    """Unit tests for class FileUploader."""
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_upload(self):
+        """Upload a file in blocks and record its digest"""
+        content = os.urandom(10 * 1024 + 3)
+        file_path = os.path.join(self.tempdir, "AZU_full_20180629_124500_S001-001.cdmp")
+        with open(file_path, "wb") as dump:
+            dump.write(content)
+
+        client = FakeStorageClient()
+        digest = FileUploader(storage_client=client, container_name="c", blob_name="b",
+                              file_path=file_path, block_size=1024, max_connections=3).upload()
+
+        self.assertEqual(client.blob_content("c", "b"), content)
+        self.assertEqual(digest, hashlib.sha256(content).hexdigest())
+        self.assertEqual(client.metadata[("c", "b")], {"sha256": digest})
+
+    def test_resume_upload(self):
+        """An interrupted upload only stages the missing blocks on the next attempt"""
+        content = os.urandom(10 * 1024)
+        file_path = os.path.join(self.tempdir, "AZU_full_20180629_124500_S001-001.cdmp")
+        with open(file_path, "wb") as dump:
+            dump.write(content)
+
+        client = FakeStorageClient(fail_on_block=BlockUploader.block_id(6))
+        uploader = FileUploader(storage_client=client, container_name="c", blob_name="b",
+                                file_path=file_path, block_size=1024, max_connections=1)
+        with self.assertRaises(Exception):
+            uploader.upload()
+        self.assertTrue(os.path.exists(BlockJournal.journal_path(file_path)))
+        self.assertEqual(client.committed, {})
+
+        client.fail_on_block = None
+        client.put_count = 0
+        digest = uploader.upload()
+
+        self.assertEqual(client.put_count, 4)
+        self.assertEqual(client.blob_content("c", "b"), content)
+        self.assertEqual(digest, hashlib.sha256(content).hexdigest())
+        self.assertFalse(os.path.exists(BlockJournal.journal_path(file_path)))
+
+class TestConcurrentFileUploader(unittest.TestCase):
+    """Unit tests for class ConcurrentFileUploader."""
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def create_files(self, count):
+        files = []
+        for i in range(count):
+            file_path = os.path.join(self.tempdir, "stripe{}.cdmp".format(i))
+            with open(file_path, "wb") as dump:
+                dump.write(os.urandom(8 * 1024 + i))
+            files.append(("blob{}".format(i), file_path))
+        return files
+
+    def test_upload_with_shared_connections(self):
+        """All stripes are uploaded, without exceeding the shared connection cap"""
+        files = self.create_files(4)
+        contents = [open(file_path, "rb").read() for (_blob_name, file_path) in files]
+        client = SlowStorageClient()
+        ConcurrentFileUploader(storage_client=client, container_name="c",
+                               block_size=1024, max_connections=3).upload(files)
+
+        for ((blob_name, file_path), content) in zip(files, contents):
+            self.assertEqual(client.blob_content("c", blob_name), content)
+            self.assertFalse(os.path.exists(file_path))
+        self.assertTrue(client.max_active <= 3)
+
+    def test_memory_budget(self):
+        """The shared buffers stay within the memory budget"""
+        files = self.create_files(4)
+        client = SlowStorageClient()
+        uploader = ConcurrentFileUploader(storage_client=client, container_name="c",
+                                          block_size=1024, max_connections=3, memory_budget=2048)
+        uploader.upload(files)
+
+        for (blob_name, file_path) in files:
+            self.assertTrue(client.blob_content("c", blob_name))
+            self.assertFalse(os.path.exists(file_path))
+        self.assertTrue(uploader.buffer_pool.allocated <= 2048)
+
+    def test_failed_stripe_is_kept(self):
+        """Only the stripes which were uploaded successfully are removed"""
+        files = self.create_files(3)
+        client = SlowStorageClient(fail_on_blob="blob1")
+        uploader = ConcurrentFileUploader(storage_client=client, container_name="c",
+                                          block_size=1024, max_connections=2)
+        with self.assertRaises(BackupException):
+            uploader.upload(files)
+
+        self.assertFalse(os.path.exists(files[0][1]))
+        self.assertTrue(os.path.exists(files[1][1]))
+        self.assertFalse(os.path.exists(files[2][1]))
+
+class TestBlockJournal(unittest.TestCase):
+    """Unit tests for class BlockJournal."""
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.tempdir, "dump.cdmp")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_record_and_load(self):
+        """Recorded blocks are loaded back, a partial last line is ignored"""
+        journal = BlockJournal(self.file_path)
+        journal.open(BlockJournal.header("b", 100, 10), set(["00000000"]))
+        journal.record("00000001")
+        journal.close()
+        with open(journal.path, "at") as journal_file:
+            journal_file.write("000000")
+
+        (header, block_ids) = BlockJournal(self.file_path).load(blob_name="b", file_size=100)
+        self.assertEqual(header["block_size"], 10)
+        self.assertEqual(block_ids, set(["00000000", "00000001"]))
+
+    def test_load_mismatch(self):
+        """A journal of a different upload is ignored"""
+        journal = BlockJournal(self.file_path)
+        journal.open(BlockJournal.header("b", 100, 10), set(["00000000"]))
+        journal.close()
+
+        self.assertEqual(journal.load(blob_name="b", file_size=200), (None, set()))
+        self.assertEqual(journal.load(blob_name="other", file_size=100), (None, set()))
+        journal.remove()
+        self.assertEqual(journal.load(blob_name="b", file_size=100), (None, set()))
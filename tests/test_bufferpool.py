@@ -0,0 +1,60 @@
+# coding=utf-8
+
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+# --------------------------------------------------------------------------
+
+"""Unit tests for BufferPool."""
+import threading
+import unittest
+from asebackupcli.bufferpool import BufferPool
+
+class TestBufferPool(unittest.TestCase):
+    """Unit tests for class BufferPool."""
+
+    def test_recycle(self):
+        """Released buffers are reused instead of allocating new ones"""
+        pool = BufferPool(buffer_size=16, memory_budget=64)
+        b1 = pool.acquire()
+        pool.release(b1)
+        b2 = pool.acquire()
+        self.assertTrue(b1 is b2)
+        self.assertEqual(pool.allocated, 16)
+
+    def test_backpressure(self):
+        """Readers wait while the budget is exhausted"""
+        pool = BufferPool(buffer_size=16, memory_budget=32)
+        held = [pool.acquire(), pool.acquire()]
+        acquired = threading.Event()
+
+        def reader():
+            pool.acquire()
+            acquired.set()
+
+        thread = threading.Thread(target=reader)
+        thread.start()
+        self.assertFalse(acquired.wait(0.2))
+
+        pool.release(held[0])
+        thread.join(5)
+        self.assertTrue(acquired.is_set())
+        self.assertEqual(pool.allocated, 32)
+        self.assertEqual(pool.peak_in_use, 32)
+        self.assertEqual(pool.waits, 1)
+
+    def test_single_buffer_exceeding_budget(self):
+        """A buffer larger than the budget is still handed out"""
+        pool = BufferPool(buffer_size=64, memory_budget=16)
+        self.assertEqual(len(pool.acquire()), 64)
+
+    def test_resize(self):
+        """Buffers of the old size are dropped when they come back"""
+        pool = BufferPool(buffer_size=16, memory_budget=64)
+        b1 = pool.acquire()
+        pool.resize(32)
+        b2 = pool.acquire()
+        self.assertEqual(len(b2), 32)
+        pool.release(b1)
+        self.assertEqual(pool.allocated, 32)
+        self.assertEqual(pool.free, [])
@@ -6,8 +6,13 @@
 # --------------------------------------------------------------------------
 
 """Unit tests for DatabaseConnector."""
+import os
+import shutil
+import tempfile
+import threading
 import unittest
 from asebackupcli.databaseconnector import DatabaseConnector
+from asebackupcli.backupexception import BackupException
 
 class TestDatabaseConnector(unittest.TestCase):
     """Unit tests for class DatabaseConnector."""
@@ -134,3 +139,93 @@ end
 go
 '''
         )
+
+    def test_sql_statement_database_sizes(self):
+        """Selected databases replace the eligibility filter, and transaction dumps only count the log"""
+        full = DatabaseConnector.sql_statement_database_sizes(is_full=True, databases=["AZU", "O'Brien"])
+        self.assertIn("delete from #dbname where name not in ('AZU', 'O''Brien')", full)
+        self.assertNotIn("tran_dumpable_status", full)
+        self.assertIn("update #sizes set used_size = data_size - data_free + log_size - log_free", full)
+
+        tran = DatabaseConnector.sql_statement_database_sizes(is_full=False)
+        self.assertIn("tran_dumpable_status", tran)
+        self.assertIn("update #sizes set used_size = log_size - log_free", tran)
+
+    def test_temp_tables_are_dropped(self):
+        """Temp tables do not outlive the statement in a pooled isql session"""
+        sizes = DatabaseConnector.sql_statement_database_sizes(is_full=True)
+        self.assertTrue(sizes.endswith("drop table #sizes, #log, #data, #dbname\ngo\n"))
+        databases = DatabaseConnector.sql_statement_list_databases(is_full=True)
+        self.assertTrue(databases.endswith("drop table #dbname\ngo\n"))
+
+    def test_leftover_temp_tables_are_dropped_first(self):
+        """Temp tables left in the session by a failed statement are dropped before they are created"""
+        sizes = DatabaseConnector.sql_statement_database_sizes(is_full=True)
+        for table in ["#dbname", "#data", "#log", "#sizes"]:
+            drop = "if object_id('{0}') is not null drop table {0}".format(table)
+            self.assertTrue(sizes.index(drop) < sizes.index("into " + table))
+        databases = DatabaseConnector.sql_statement_list_databases(is_full=True)
+        self.assertTrue(databases.index("if object_id('#dbname') is not null drop table #dbname") < databases.index("into #dbname"))
+
+    def test_determine_database_sizes_unknown(self):
+        """Selected databases which the server does not report are an error"""
+        connector = DatabaseConnector(None)
+        connector.call_isql = lambda stdin: (" AZU 1 100 200 100 10 10\n", "", 0)
+        self.assertEqual([size.dbname for size in connector.determine_database_sizes(True, ["AZU"])], ["AZU"])
+        self.assertRaises(BackupException, connector.determine_database_sizes, True, ["AZU", "ABC"])
+
+class FakePasswordConfiguration(object):
+    """Counts how often the password generator runs."""
+    def __init__(self, directory):
+        self.counter_file = os.path.join(directory, "calls")
+
+    def get_database_password_generator(self):
+        return "echo x >> {0}; echo secret".format(self.counter_file)
+
+    def get_database_password_ttl_seconds(self):
+        return 3600
+
+    def slow(self):
+        self.get_database_password_generator = lambda: "sleep 0.2; echo x >> {0}; echo secret".format(self.counter_file)
+        return self
+
+    def calls(self):
+        with open(self.counter_file) as stream:
+            return len(stream.readlines())
+
+class TestDatabaseConnectorCaches(unittest.TestCase):
+    """Unit tests for the password and executable caches of DatabaseConnector."""
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_password_generator_runs_once(self):
+        """The password is generated once within its TTL"""
+        configuration = FakePasswordConfiguration(self.tempdir)
+        connector = DatabaseConnector(configuration)
+        self.assertEqual([connector.get_database_password() for _ in range(3)], ["secret"] * 3)
+        self.assertEqual(configuration.calls(), 1)
+
+    def test_password_generator_runs_once_for_concurrent_callers(self):
+        """Concurrent first reads share one run of the password generator"""
+        configuration = FakePasswordConfiguration(self.tempdir).slow()
+        connector = DatabaseConnector(configuration)
+        passwords = []
+        threads = [threading.Thread(target=lambda: passwords.append(connector.get_database_password())) for _ in range(4)]
+        _ = [t.start() for t in threads]
+        _ = [t.join() for t in threads]
+        self.assertEqual(passwords, ["secret"] * 4)
+        self.assertEqual(configuration.calls(), 1)
+
+    def test_executable_path_is_kept(self):
+        """The executable is looked up again only when it disappeared"""
+        connector = DatabaseConnector(None)
+        executable = os.path.join(self.tempdir, "isql")
+        connector.executable_paths["OCS-*/bin/isql"] = executable
+        open(executable, "w").close()
+        self.assertEqual(connector.get_executable_path("OCS-*/bin/isql"), executable)
+        os.remove(executable)
+        self.assertRaises(BackupException, lambda: connector.get_executable_path("OCS-*/bin/isql"))
@@ -8,9 +8,47 @@
 import doctest
 
 from asebackupcli import scheduleparser
+from asebackupcli import blockuploader
+from asebackupcli import bufferpool
+from asebackupcli import cancellation
+from asebackupcli import blockjournal
+from asebackupcli import fileuploader
+from asebackupcli import blocksizer
+from asebackupcli import databaseconnector
+from asebackupcli import backupinventory
+from asebackupcli import blobcatalog
+from asebackupcli import timing
+from asebackupcli import restoreplanner
+from asebackupcli import naming
+from asebackupcli import blobdownloader
+from asebackupcli import restoreexecutor
+from asebackupcli import restorecache
+from asebackupcli import credentialcache
+from asebackupcli import backupscheduler
+from asebackupcli import stripeplanner
+from asebackupcli import isqlsession
 
 def load_tests(_loader, tests, _ignore):
     """Run doctests"""
     doctest.DocFileSuite()
     tests.addTests(doctest.DocTestSuite(scheduleparser))
+    tests.addTests(doctest.DocTestSuite(blockuploader))
+    tests.addTests(doctest.DocTestSuite(bufferpool))
+    tests.addTests(doctest.DocTestSuite(cancellation))
+    tests.addTests(doctest.DocTestSuite(blockjournal))
+    tests.addTests(doctest.DocTestSuite(fileuploader))
+    tests.addTests(doctest.DocTestSuite(blocksizer))
+    tests.addTests(doctest.DocTestSuite(databaseconnector))
+    tests.addTests(doctest.DocTestSuite(backupinventory))
+    tests.addTests(doctest.DocTestSuite(blobcatalog))
+    tests.addTests(doctest.DocTestSuite(timing))
+    tests.addTests(doctest.DocTestSuite(restoreplanner))
+    tests.addTests(doctest.DocTestSuite(naming))
+    tests.addTests(doctest.DocTestSuite(blobdownloader))
+    tests.addTests(doctest.DocTestSuite(restoreexecutor))
+    tests.addTests(doctest.DocTestSuite(restorecache))
+    tests.addTests(doctest.DocTestSuite(credentialcache))
+    tests.addTests(doctest.DocTestSuite(backupscheduler))
+    tests.addTests(doctest.DocTestSuite(stripeplanner))
+    tests.addTests(doctest.DocTestSuite(isqlsession))
     return tests
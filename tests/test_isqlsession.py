@@ -0,0 +1,132 @@
+# coding=utf-8
+
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+# --------------------------------------------------------------------------
+
+"""Unit tests for IsqlSession and IsqlSessionPool."""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from asebackupcli.isqlsession import IsqlSession, IsqlSessionPool
+from asebackupcli.databaseconnector import DatabaseConnector
+from asebackupcli.backupexception import BackupException
+
+#
+# Runs `go`-delimited batches like isql, but only understands print. When the
+# file given as first argument exists, it is removed, and the connection fails.
+# When the second one exists, it is removed, and the connection drops at the
+# first batch; isql stays alive, but every batch fails.
+#
+FAKE_ISQL = """
+import os
+import sys
+if len(sys.argv) > 1 and os.path.exists(sys.argv[1]):
+    os.remove(sys.argv[1])
+    sys.stdout.write("ct_connect(): network packet layer: internal net library error: Net-Lib protocol driver call to connect two endpoints failed\\n")
+    sys.exit(255)
+sys.stdout.write("pid {}\\n".format(os.getpid()))
+dropped = len(sys.argv) > 2 and os.path.exists(sys.argv[2])
+if dropped:
+    os.remove(sys.argv[2])
+batch = []
+while True:
+    line = sys.stdin.readline()
+    if not line or line.strip() == "quit":
+        break
+    line = line.rstrip("\\n")
+    if line != "go":
+        batch.append(line)
+        continue
+    if dropped:
+        sys.stdout.write("CT-LIBRARY error:\\n\\tct_send(): network packet layer: internal net library error: Net-Lib protocol driver call to write to the remote endpoint failed\\n")
+        batch = []
+        continue
+    for statement in batch:
+        if statement.startswith("print '"):
+            sys.stdout.write(statement[len("print '"):-1] + "\\n")
+    sys.stdout.flush()
+    batch = []
+"""
+
+class TestIsqlSession(unittest.TestCase):
+    """Unit tests for isql sessions."""
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.script = os.path.join(self.tempdir, "fake_isql.py")
+        with open(self.script, "w") as stream:
+            stream.write(FAKE_ISQL)
+        self.fail_marker = os.path.join(self.tempdir, "fail_next_connect")
+        self.drop_marker = os.path.join(self.tempdir, "drop_next_connection")
+        self.starts = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def command_line(self):
+        self.starts += 1
+        return [sys.executable, self.script, self.fail_marker, self.drop_marker]
+
+    def test_statements_in_one_process(self):
+        """Several statements run in one isql process, each with its own output"""
+        session = IsqlSession(self.command_line())
+        (stdout1, _stderr, returncode) = session.execute("print 'one'\ngo\nprint 'two'\ngo\n")
+        (stdout2, _stderr, _returncode) = session.execute("print 'three'\ngo")
+        session.close()
+        self.assertEqual(stdout1.split("\n")[1:], ["one", "two", ""])
+        self.assertEqual(stdout2, "three\n")
+        self.assertEqual(returncode, 0)
+        self.assertFalse(session.is_alive())
+
+    def test_pool_reuses_sessions(self):
+        """Sequential statements share a session"""
+        pool = IsqlSessionPool(command_line=self.command_line, max_sessions=2)
+        for _ in range(3):
+            session = pool.acquire()
+            session.execute("print 'x'\ngo\n")
+            pool.release(session)
+        first = pool.acquire()
+        second = pool.acquire()
+        pool.release(first)
+        pool.release(second)
+        pool.close()
+        self.assertEqual(self.starts, 2)
+
+    def test_reconnect(self):
+        """A session which cannot connect is replaced once"""
+        connector = DatabaseConnector(backup_configuration=None)
+        connector.isql_sessions = IsqlSessionPool(command_line=self.command_line)
+
+        open(self.fail_marker, "w").close()
+        (stdout, _stderr, returncode) = connector.call_isql("print 'hello'\ngo\n")
+        self.assertTrue(stdout.endswith("hello\n"))
+        self.assertEqual(returncode, 0)
+        self.assertEqual(self.starts, 2)
+        connector.close()
+
+    def test_lost_connection(self):
+        """A live session whose connection dropped is replaced, and not reused"""
+        connector = DatabaseConnector(backup_configuration=None)
+        connector.isql_sessions = IsqlSessionPool(command_line=self.command_line)
+
+        open(self.drop_marker, "w").close()
+        (stdout, _stderr, returncode) = connector.call_isql("print 'hello'\ngo\n")
+        self.assertTrue(stdout.endswith("hello\n"))
+        self.assertEqual(returncode, 0)
+        (stdout, _stderr, _returncode) = connector.call_isql("print 'again'\ngo\n")
+        self.assertEqual(stdout, "again\n")
+        self.assertEqual(self.starts, 2)
+        connector.close()
+
+    def test_not_available(self):
+        """When the second session cannot connect either, the database service is not available"""
+        connector = DatabaseConnector(backup_configuration=None)
+        connector.isql_sessions = IsqlSessionPool(
+            command_line=lambda: [sys.executable, "-c", "import sys; sys.stdout.write('ct_connect(): network packet layer: error'); sys.exit(255)"])
+        with self.assertRaises(BackupException) as context:
+            connector.call_isql("print 'hello'\ngo\n")
+        self.assertEqual(str(context.exception), DatabaseConnector.ERR_DATABASE_SERVICE_NOT_AVAILABLE)
@@ -69,6 +69,14 @@ class TestNaming(unittest.TestCase):
             Naming.parse_ase_generated_filename('AZU_tran_20181205_091930_S01-11.cdmp'),
             None
         )
+        self.assertEqual(
+            Naming.parse_ase_generated_filename('AZU_trans_20181205_091930_S01-11.cdmp.journal'),
+            None
+        )
+        self.assertEqual(
+            Naming.parse_blobname('AZU_tran_20181205_091930--20181205_092000_S001-001.cdmp.journal'),
+            None
+        )
 
     def test_parse_filename(self):
         """Test Naming.parse_filename"""
@@ -0,0 +1,87 @@
+# coding=utf-8
+
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+# --------------------------------------------------------------------------
+
+"""Unit tests for RestoreCache."""
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from collections import namedtuple
+from asebackupcli.restorecache import RestoreCache
+from asebackupcli.blobdownloader import BlobDownloader
+from asebackupcli.backupexception import BackupException
+from .test_blobdownloader import FakeDownloadStorageClient
+
+FakeProperties = namedtuple("FakeProperties", ["etag"])
+FakeBlobWithProperties = namedtuple("FakeBlobWithProperties", ["properties"])
+
+class FakeCacheStorageClient(FakeDownloadStorageClient):
+    """Also serves ETags, which change when a blob is overwritten."""
+    def __init__(self, blobs, fail_blob=None):
+        FakeDownloadStorageClient.__init__(self, blobs, fail_blob)
+        self.etags = dict([(name, '"0x1"') for name in blobs])
+
+    def get_blob_properties(self, container_name, blob_name, **_kwargs):
+        return FakeBlobWithProperties(FakeProperties(self.etags[blob_name]))
+
+class TestRestoreCache(unittest.TestCase):
+    """Unit tests for class RestoreCache."""
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.output_dir = os.path.join(self.tempdir, "out")
+        os.mkdir(self.output_dir)
+        self.blobs = {"full": os.urandom(500), "tran1": os.urandom(100), "tran2": os.urandom(100)}
+        self.client = FakeCacheStorageClient(self.blobs)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def fetch(self, names, max_bytes=10000, client=None):
+        client = client or self.client
+        cache = RestoreCache(directory=os.path.join(self.tempdir, "cache"), max_bytes=max_bytes,
+                             storage_client=client, container_name="c")
+        files = [(name, os.path.join(self.output_dir, name), len(self.blobs[name])) for name in names]
+        cache.fetch(files, BlobDownloader(storage_client=client, container_name="c", range_size=100))
+        for name in names:
+            with open(os.path.join(self.output_dir, name), "rb") as stream:
+                self.assertEqual(stream.read(), self.blobs[name])
+        return cache
+
+    def test_reuse(self):
+        """A second restore only downloads the stripes which are not cached yet"""
+        self.fetch(["full", "tran1"])
+        self.assertEqual(self.client.requests, 6)
+        self.fetch(["full", "tran1", "tran2"])
+        self.assertEqual(self.client.requests, 7)
+        self.assertEqual(os.stat(os.path.join(self.output_dir, "full")).st_nlink, 2)
+
+    def test_changed_blob(self):
+        """A blob with a new ETag is downloaded again"""
+        self.fetch(["tran1"])
+        self.blobs["tran1"] = os.urandom(100)
+        self.client.etags["tran1"] = '"0x2"'
+        self.fetch(["tran1"])
+        self.assertEqual(self.client.requests, 2)
+
+    def test_lru_eviction(self):
+        """Least recently used stripes are evicted to stay under the size cap"""
+        self.fetch(["tran1"], max_bytes=600)
+        time.sleep(0.01)
+        self.fetch(["tran2"], max_bytes=600)
+        now = time.time()
+        os.utime(os.path.join(self.tempdir, "cache", "tran1.0x1"), (now, now))
+        cache = self.fetch(["full"], max_bytes=600)
+        self.assertEqual(sorted([os.path.basename(path) for (_mtime, _size, path) in cache.entries()]),
+                         ["full.0x1", "tran1.0x1"])
+
+    def test_failed_download(self):
+        """A failed download leaves no partial entry behind"""
+        client = FakeCacheStorageClient(self.blobs, fail_blob="full")
+        self.assertRaises(BackupException, lambda: self.fetch(["full"], client=client))
+        self.assertEqual(os.listdir(os.path.join(self.tempdir, "cache")), [])
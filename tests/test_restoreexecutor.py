@@ -0,0 +1,179 @@
+# coding=utf-8
+
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+# --------------------------------------------------------------------------
+
+"""Unit tests for RestoreExecutor."""
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from asebackupcli.naming import BlobRecord
+from asebackupcli.restoreplanner import RestorePlanner
+from asebackupcli.restoreexecutor import RestoreExecutor, RestoreReport, DownloadedDumpSource, StreamingDumpSource
+from asebackupcli.restorestreamingthread import RestoreStreamingThread
+from asebackupcli.blobdownloader import BlobDownloader
+from asebackupcli.databaseconnector import DatabaseConnector
+from asebackupcli.backupexception import BackupException
+from .test_blobdownloader import FakeDownloadStorageClient
+
+BLOB_NAMES = [
+    "AZU_full_20180101_000000--20180101_010000_S001-002.cdmp",
+    "AZU_full_20180101_000000--20180101_010000_S002-002.cdmp",
+    "AZU_tran_20180101_011500--20180101_011500_S001-001.cdmp",
+    "AZU_tran_20180101_013000--20180101_013000_S001-001.cdmp"
+]
+
+class FakeDatabaseConnector(object):
+    """Records the loads, which take a while, and checks that the dump files exist."""
+    def __init__(self, fail_on_load=None):
+        self.events = []
+        self.lock = threading.Lock()
+        self.fail_on_load = fail_on_load
+
+    def log(self, event):
+        with self.lock:
+            self.events.append(event)
+
+    def load_dump(self, dbname, is_full, files, until_time=None):
+        self.log(("load", is_full, [os.path.basename(f) for f in files], until_time))
+        assert all([os.path.exists(f) for f in files])
+        time.sleep(0.05)
+        if len(self.events) == self.fail_on_load:
+            return ("Msg 3105: load failed", "", 1)
+        return (DatabaseConnector.MAGIC_SUCCESS_STRING, "", 0)
+
+    def online_database(self, dbname):
+        self.log(("online", dbname))
+        return (DatabaseConnector.MAGIC_SUCCESS_STRING, "", 0)
+
+class FakeStreamingDatabaseConnector(FakeDatabaseConnector):
+    """Reads all stripes of a dump from their pipes at the same time, like ASE."""
+    def __init__(self):
+        FakeDatabaseConnector.__init__(self)
+        self.contents = []
+
+    def load_dump(self, dbname, is_full, files, until_time=None):
+        self.log(("load", is_full, len(files), until_time))
+        data = [None] * len(files)
+
+        def read(index):
+            with open(files[index], "rb") as pipe:
+                data[index] = pipe.read()
+        threads = [threading.Thread(target=read, args=(index,)) for index in range(len(files))]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        for t in threads:
+            t.join(10)
+        if any([t.is_alive() for t in threads]):
+            return ("Msg 3201: timed out reading the dump", "", 1)
+        self.contents.append(data)
+        return (DatabaseConnector.MAGIC_SUCCESS_STRING, "", 0)
+
+class TestRestoreExecutor(unittest.TestCase):
+    """Unit tests for class RestoreExecutor."""
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.blobs = dict([(name, os.urandom(300)) for name in BLOB_NAMES])
+        self.client = FakeDownloadStorageClient(self.blobs)
+        self.plan = RestorePlanner([BlobRecord.parse(name, 300) for name in BLOB_NAMES]).plan("20180101_012000")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def source(self):
+        download_files = lambda files, cancellation_token: BlobDownloader(
+            storage_client=self.client, container_name="c", range_size=100,
+            cancellation_token=cancellation_token).download(files)
+        return DownloadedDumpSource(download_files=download_files, output_dir=self.tempdir, dbname="AZU")
+
+    def test_execute(self):
+        """The chain is loaded in order, ends at the restore point, and the database goes online"""
+        connector = FakeDatabaseConnector()
+        report = RestoreReport()
+        RestoreExecutor(database_connector=connector, dbname="AZU", source=self.source(), report=report).execute(self.plan)
+
+        self.assertEqual(connector.events, [
+            ("load", True, ["AZU_full_20180101_000000_S001-002.cdmp", "AZU_full_20180101_000000_S002-002.cdmp"], None),
+            ("load", False, ["AZU_tran_20180101_011500_S001-001.cdmp"], None),
+            ("load", False, ["AZU_tran_20180101_013000_S001-001.cdmp"], "20180101_012000"),
+            ("online", "AZU")])
+        self.assertEqual(os.listdir(self.tempdir), [])
+        self.assertEqual(len(report.lines()), 3 * 3 + 1)
+
+    def test_prefetch_overlaps_load(self):
+        """While a dump loads, the next one is already downloaded"""
+        connector = FakeDatabaseConnector()
+        report = RestoreReport()
+        RestoreExecutor(database_connector=connector, dbname="AZU", source=self.source(), report=report).execute(self.plan)
+
+        waits = [seconds for (name, seconds) in report.steps if name.startswith("wait for tran")]
+        self.assertEqual(len(waits), 2)
+        self.assertTrue(all([seconds < 0.04 for seconds in waits]), msg=report.lines())
+
+    def test_load_failure(self):
+        """A failed load stops the restore, and removes the downloaded dumps"""
+        connector = FakeDatabaseConnector(fail_on_load=2)
+        executor = RestoreExecutor(database_connector=connector, dbname="AZU", source=self.source())
+        self.assertRaises(BackupException, lambda: executor.execute(self.plan))
+        self.assertEqual([e[0] for e in connector.events], ["load", "load"])
+        self.assertEqual(os.listdir(self.tempdir), [])
+
+    def test_no_full_backup(self):
+        """Without a full dump before the restore point, nothing is loaded"""
+        connector = FakeDatabaseConnector()
+        plan = RestorePlanner([BlobRecord.parse(name, 300) for name in BLOB_NAMES[2:]]).plan("20180101_012000")
+        executor = RestoreExecutor(database_connector=connector, dbname="AZU", source=self.source())
+        self.assertRaises(BackupException, lambda: executor.execute(plan))
+        self.assertEqual(connector.events, [])
+
+class TestStreamingRestoreExecutor(unittest.TestCase):
+    """Unit tests for RestoreExecutor with a StreamingDumpSource."""
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.poll_interval = RestoreStreamingThread.POLL_INTERVAL_SECONDS
+        RestoreStreamingThread.POLL_INTERVAL_SECONDS = 0.01
+
+    def tearDown(self):
+        RestoreStreamingThread.POLL_INTERVAL_SECONDS = self.poll_interval
+        shutil.rmtree(self.tempdir)
+
+    def test_transaction_chain(self):
+        """Consecutive transaction dumps with the same stripe count stream through pipes of their own"""
+        blob_names = BLOB_NAMES + [
+            "AZU_tran_20180101_014500--20180101_014500_S001-001.cdmp",
+            "AZU_tran_20180101_020000--20180101_020000_S001-001.cdmp"]
+        blobs = dict([(name, os.urandom(300)) for name in blob_names])
+        plan = RestorePlanner([BlobRecord.parse(name, 300) for name in blob_names]).plan("20180101_020000")
+        source = StreamingDumpSource(storage_client=FakeDownloadStorageClient(blobs), container_name="c",
+                                     output_dir=self.tempdir, dbname="AZU", timeout_seconds=30)
+        connector = FakeStreamingDatabaseConnector()
+        RestoreExecutor(database_connector=connector, dbname="AZU", source=source).execute(plan)
+
+        self.assertEqual(connector.contents, [[blobs[stripe.blob_name] for stripe in dump.stripes] for dump in plan.dumps])
+        self.assertEqual(len(connector.contents), 5)
+        self.assertEqual(os.listdir(self.tempdir), [])
+
+    def test_abort_leaves_prefetch_running(self):
+        """Stopping the threads of one dump does not cancel the next dump, but cancel() stops all"""
+        blobs = dict([(name, os.urandom(300)) for name in BLOB_NAMES])
+        plan = RestorePlanner([BlobRecord.parse(name, 300) for name in BLOB_NAMES]).plan("20180101_013000")
+        source = StreamingDumpSource(storage_client=FakeDownloadStorageClient(blobs), container_name="c",
+                                     output_dir=self.tempdir, dbname="AZU", timeout_seconds=30)
+        current = source.prepare(plan.dumps[1])
+        prefetched = source.prepare(plan.dumps[2])
+        source.abort(current)
+        self.assertTrue(all([t.cancellation_token.is_cancelled() for t in current]))
+        self.assertTrue(all([t.is_alive() and not t.cancellation_token.is_cancelled() for t in prefetched]))
+
+        source.cancel()
+        source.abort(prefetched)
+        self.assertFalse(any([t.is_alive() for t in prefetched]))
+        self.assertEqual(os.listdir(self.tempdir), [])
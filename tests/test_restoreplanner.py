@@ -0,0 +1,62 @@
+# coding=utf-8
+
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+# --------------------------------------------------------------------------
+
+"""Unit tests for RestorePlanner."""
+import time
+import unittest
+from asebackupcli.naming import Naming, BlobRecord
+from asebackupcli.timing import Timing
+from asebackupcli.restoreplanner import RestorePlanner
+
+def timestamp(minutes):
+    return time.strftime(Timing.time_format, time.localtime(time.mktime((2018, 1, 1, 0, 0, 0, 0, 0, -1)) + 60 * minutes))
+
+class TestRestorePlanner(unittest.TestCase):
+    """Unit tests for class RestorePlanner."""
+
+    def setUp(self):
+        #
+        # A full dump with two stripes every 6 hours, and a transaction dump every 15 minutes.
+        #
+        self.blobs = []
+        for minutes in range(60, 3 * 24 * 60, 15):
+            is_full = minutes % 360 == 0
+            stripe_count = 2 if is_full else 1
+            for stripe_index in range(1, stripe_count + 1):
+                blob_name = Naming.construct_blobname(
+                    dbname="AZU", is_full=is_full, start_timestamp=timestamp(minutes - 10), end_timestamp=timestamp(minutes),
+                    stripe_index=stripe_index, stripe_count=stripe_count)
+                self.blobs.append(BlobRecord.parse(blob_name, minutes))
+        self.planner = RestorePlanner(self.blobs)
+
+    def test_same_as_files_needed_for_recovery(self):
+        """Every hour, and the exact end times, give the same chain as Timing.files_needed_for_recovery"""
+        restore_points = [timestamp(minutes) for minutes in range(0, 3 * 24 * 60 + 60, 60)]
+        restore_points += [timestamp(minutes) for minutes in range(345, 375)]
+        plans = self.planner.plan_all(restore_points)
+        self.assertEqual(len(plans), len(restore_points))
+        for plan in plans:
+            expected = Timing.files_needed_for_recovery(
+                [b.blob_name for b in self.blobs], plan.restore_point,
+                select_end_date=lambda b: Naming.parse_blobname(b)[3],
+                select_is_full=lambda b: Naming.parse_blobname(b)[1])
+            self.assertEqual(plan.blob_names, expected, msg=plan.restore_point)
+
+    def test_chain(self):
+        """The chain starts with the latest full dump, and ends with the dump containing the restore point"""
+        plan = self.planner.plan(timestamp(6 * 60 + 20))
+        self.assertEqual(plan.full.end_timestamp, timestamp(6 * 60))
+        self.assertEqual([d.end_timestamp for d in plan.dumps[1:]], [timestamp(6 * 60 + 15), timestamp(6 * 60 + 30)])
+        self.assertEqual(plan.total_bytes, 2 * 360 + 375 + 390)
+        self.assertEqual(len(plan.stripes), 4)
+
+    def test_no_dumps(self):
+        """A restore point before the first dump needs the first transaction dump only"""
+        plan = RestorePlanner([]).plan(timestamp(0))
+        self.assertEqual(plan.dumps, [])
+        self.assertEqual(plan.full, None)
+        self.assertEqual(self.planner.plan(timestamp(0)).blob_names, [self.blobs[0].blob_name])
@@ -0,0 +1,35 @@
+# coding=utf-8
+
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+# --------------------------------------------------------------------------
+
+"""Unit tests for StripePlanner."""
+import unittest
+from asebackupcli.stripeplanner import StripePlanner, BackupRun
+
+GB = 1024 ** 3
+
+def run(stripe_count, seconds, used_size=100 * GB):
+    return BackupRun("AZU", True, False, stripe_count, used_size, seconds, "20180101_010000")
+
+class TestStripePlanner(unittest.TestCase):
+    """Unit tests for class StripePlanner."""
+
+    def test_saturation_stops_exploring(self):
+        """Once more stripes stop paying off, the best tried count is kept"""
+        planner = StripePlanner([run(8, 1000.0), run(10, 700.0), run(12, 720.0)], max_stripes=32)
+        self.assertEqual(planner.predicted_rate(13), None)
+        self.assertEqual(planner.stripe_count(used_size=200 * GB, default=8), 10)
+
+    def test_beyond_fixed_maximum(self):
+        """With a higher cap, the planner tries more than the fixed rule's 8 stripes"""
+        runs = [run(8, 1000.0), run(8, 1000.0), run(4, 2000.0)]
+        self.assertEqual(StripePlanner(runs, max_stripes=16).stripe_count(used_size=200 * GB, default=8), 9)
+        self.assertEqual(StripePlanner(runs, max_stripes=8).stripe_count(used_size=200 * GB, default=8), 8)
+
+    def test_small_runs_are_ignored(self):
+        """Runs below the minimum stripe size do not count as history"""
+        runs = [run(1, 1.0, used_size=GB // 2)] * 5
+        self.assertEqual(StripePlanner(runs, max_stripes=8).stripe_count(used_size=200 * GB, default=6), 6)
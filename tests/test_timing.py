@@ -29,6 +29,13 @@ class TestTiming(unittest.TestCase):
             Timing.time_diff("20180106_110000", "20180106_120010"),
             datetime.timedelta(0, 3610))
 
+    def test_sort(self):
+        """Sorting is by time, and stable for equal times"""
+        times = [("b", "20180110_120000"), ("a", "20180109_235959"),
+                 ("c", "20180110_120000"), ("d", "20171231_000000")]
+        self.assertEqual([x[0] for x in Timing.sort(times, lambda x: x[1])], ["d", "a", "b", "c"])
+        self.assertTrue(Timing.to_int("20180110_000000") > Timing.to_int("20180109_235959"))
+
     def test_restore_files(self):
         """Test restore computation"""
         sample_times = [